@@ -1161,6 +1161,36 @@ def random_histogram(counts, nbins, seed):
     return numpy.histogram(numpy.random.random(counts), nbins, (0, 1))[0]
 
 
+def _splitmix64(z):
+    # SplitMix64 finalizer, operating on uint64 arrays modulo 2**64
+    z = z + numpy.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return z ^ (z >> numpy.uint64(31))
+
+
+def counter_uniform(seed, *counters):
+    """
+    Counter-based random numbers uniformly distributed in (0, 1).
+    The number associated to a seed and to a tuple of integer counters
+    does not depend on the other numbers generated, so any subset of them
+    can be generated independently (for instance in different tasks or
+    threads) with identical results. The counters are broadcast together.
+
+    >>> u = counter_uniform(42, numpy.arange(5))
+    >>> numpy.testing.assert_equal(counter_uniform(42, [3, 1]), u[[3, 1]])
+    >>> counter_uniform(42, [[0], [1]], [0, 1, 2]).shape
+    (2, 3)
+    """
+    h = _splitmix64(numpy.full(1, seed, numpy.uint64))
+    for counter in counters:
+        # NB: negative counters are mapped to large unsigned integers
+        h = _splitmix64(h ^ numpy.asarray(counter, numpy.int64).astype(
+            numpy.uint64))
+    # take the 53 most significant bits and stay away from 0
+    return ((h >> numpy.uint64(11)) + .5) * 2. ** -53
+
+
 def get_indices(integers):
     """
     :param integers: a sequence of integers (with repetitions)
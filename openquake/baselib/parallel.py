@@ -183,14 +183,19 @@ fast sources.
 import os
 import re
 import ast
+import gc
 import sys
 import time
+import shutil
 import socket
 import signal
+import heapq
 import pickle
+import hashlib
 import inspect
 import logging
 import operator
+import tempfile
 import traceback
 import collections
 from unittest import mock
@@ -198,6 +203,10 @@ import multiprocessing.dummy
 import subprocess
 import psutil
 import numpy
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:  # Python < 3.8
+    shared_memory = None
 try:
     from setproctitle import setproctitle
 except ImportError:
@@ -216,6 +225,8 @@ sys.setrecursionlimit(1200)  # raised a bit to make pickle happier
 # see https://github.com/gem/oq-engine/issues/5230
 submit = CallableDict()
 GB = 1024 ** 3
+# shared arguments smaller than that are sent directly to the workers
+MIN_CACHED_SIZE = 16 * 1024
 # use only the "visible" cores, not the total system cores
 # if the underlying OS supports it (macOS does not)
 try:
@@ -349,6 +360,168 @@ def pickle_sequence(objects):
     return out
 
 
+class Cached(object):
+    """
+    A reference to a Pickled object shared by many tasks. The pickled
+    bytestring is written only once in the directory `cache_dir`, in a
+    file named after its hash; the workers read it at the first task
+    and keep the unpickled object in their :class:`WorkerCache`, so that
+    the subsequent tasks carry only the key.
+
+    :param pickled: a Pickled instance
+    :param cache_dir: a directory readable by the workers
+    """
+    def __init__(self, pickled, cache_dir):
+        self.clsname = pickled.clsname
+        self.calc_id = pickled.calc_id
+        self.size = len(pickled)  # size of the original pickle
+        self.key = hashlib.sha1(pickled.pik).hexdigest()
+        self.path = os.path.join(cache_dir, self.key)
+        if not os.path.exists(self.path):
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(pickled.pik)
+            os.replace(tmp, self.path)  # atomic, no partial reads
+        self.nbytes = 0
+        self.nbytes = len(pickle.dumps(self, pickle.HIGHEST_PROTOCOL))
+
+    def __repr__(self):
+        return '<Cached %s #%s %s>' % (
+            self.clsname, self.calc_id, humansize(self.size))
+
+    def __len__(self):
+        """Number of bytes actually sent"""
+        return self.nbytes
+
+    def unpickle(self):
+        """Return the cached object, reading it if needed"""
+        return worker_cache.get(self)
+
+
+class WorkerCache(object):
+    """
+    A LRU cache of the unpickled objects shared by many tasks, living
+    in each worker process. The size of the pickled objects is used as
+    a proxy for the memory occupation, which is kept below `maxbytes`.
+    Notice that the tasks must not mutate the shared objects, exactly as
+    when running with OQ_DISTRIBUTE=no.
+
+    :param maxbytes: memory cap for the cache
+    """
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.objs = collections.OrderedDict()  # key -> (obj, size)
+
+    def get(self, cached):
+        """
+        :param cached: a Cached instance
+        :returns: the underlying object
+        """
+        try:
+            obj, size = self.objs.pop(cached.key)
+        except KeyError:  # read the object
+            with open(cached.path, 'rb') as f:
+                obj = pickle.loads(f.read())
+            size = cached.size
+            self.nbytes += size
+        self.objs[cached.key] = obj, size  # most recently used at the end
+        while self.nbytes > self.maxbytes and len(self.objs) > 1:
+            _key, (_obj, sz) = self.objs.popitem(last=False)
+            self.nbytes -= sz
+        return obj
+
+    def __len__(self):
+        return len(self.objs)
+
+
+worker_cache = WorkerCache(int(config.memory.get('worker_cache', GB)))
+
+
+class SharedArray(object):
+    """
+    A numpy array copied in a block of shared memory. It is pickled as
+    a handle (the name of the block, the shape and the dtype), so that
+    the workers of the processpool can attach a read-only view without
+    copying the data. The master must call `.unlink()` at the end.
+
+    :param array: the array to share
+    """
+    def __init__(self, array):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(array.nbytes, 1))
+        self.name = self.shm.name
+        arr = numpy.ndarray(self.shape, self.dtype, self.shm.buf)
+        arr[:] = array
+        del arr  # otherwise the shared memory could not be closed
+
+    @property
+    def array(self):
+        """A read-only view over the shared memory"""
+        arr = numpy.ndarray(self.shape, self.dtype, self.shm.buf)
+        arr.flags.writeable = False
+        return arr
+
+    def __getstate__(self):
+        return dict(name=self.name, shape=self.shape, dtype=self.dtype)
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self.shm = attach_shared(self.name)
+
+    def unlink(self):
+        """Release the shared memory; to be called by the master"""
+        self.shm.close()
+        self.shm.unlink()
+
+    def __repr__(self):
+        return '<%s %s %s>' % (self.__class__.__name__, self.name,
+                               humansize(self.shm.size))
+
+
+shared_attached = {}  # name -> (SharedMemory, refcount), in the workers
+
+
+def attach_shared(name):
+    """
+    :param name: the name of a block of shared memory owned by the master
+    :returns: a SharedMemory instance, attached only once per process
+    """
+    try:
+        return shared_attached[name][0]
+    except KeyError:
+        pass
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name, track=False)
+    else:
+        # the block must not be registered with the resource tracker,
+        # otherwise the tracker could unlink it before the master does or
+        # warn about a leaked shared_memory object
+        with mock.patch.object(resource_tracker, 'register'):
+            shm = shared_memory.SharedMemory(name)
+    # the numpy arrays built on the block keep a reference to the mmap
+    shared_attached[name] = shm, sys.getrefcount(shm._mmap)
+    return shm
+
+
+def release_shared():
+    """
+    Close the blocks of shared memory attached by the current process,
+    except the ones still used by some array (for instance a site
+    collection in the worker_cache). Called at the end of each task.
+    """
+    if not shared_attached:
+        return
+    gc.collect()  # the site collections have reference cycles
+    for name, (shm, refcount) in list(shared_attached.items()):
+        # NB: closing a block still used by an array would cause a segfault
+        if sys.getrefcount(shm._mmap) <= refcount:
+            shm.close()
+            del shared_attached[name]
+
+
 class FakePickle:
     def __init__(self, sentbytes):
         self.sentbytes = sentbytes
@@ -368,6 +541,7 @@ class Result(object):
     :param msg: message string (default empty)
     """
     func = None
+    weight = 1  # weight of the subtask, if any
 
     def __init__(self, val, mon, tb_str='', msg=''):
         if isinstance(val, dict):
@@ -375,6 +549,7 @@ class Result(object):
             self.nbytes = {k: len(Pickled(v)) for k, v in val.items()}
         elif isinstance(val, tuple) and callable(val[0]):
             self.func = val[0]
+            self.weight = getattr(val[1], 'weight', 1)
             self.pik = pickle_sequence(val[1:])
             self.nbytes = {'args': sum(len(p) for p in self.pik)}
         elif msg == 'TASK_ENDED':
@@ -499,6 +674,8 @@ def safely_call(func, args, task_no=0, mon=dummy_mon):
             sentbytes += len(res.pik)
             if res.msg == 'TASK_ENDED':
                 break
+    del it, args
+    release_shared()
 
 
 if oq_distribute().startswith('celery'):
@@ -725,13 +902,18 @@ class Starmap(object):
         self.task_args = task_args
         self.progress = progress
         self.h5 = h5
-        self.task_queue = []
+        self.task_queue = []  # heap of (-weight, num, func, args)
         try:
             self.num_tasks = len(self.task_args)
         except TypeError:  # generators have no len
             self.num_tasks = None
         self.argnames = getargnames(task_func)
         self.sent = AccumDict(accum=AccumDict())  # fname -> argname -> nbytes
+        self.shared = {}  # hash -> None or Cached instance
+        # the workers must be able to read the directory of the h5 file
+        self.use_cache = self.distribute == 'processpool' or (
+            self.distribute == 'zmq' and bool(config.directory.shared_dir))
+        self.cache_dir = None  # created at the first Cached argument
         self.monitor.inject = (self.argnames[-1].startswith('mon') or
                                self.argnames[-1].endswith('mon'))
         self.receiver = 'tcp://%s:%s' % (
@@ -739,6 +921,7 @@ class Starmap(object):
         self.monitor.backurl = None  # overridden later
         self.tasks = []  # populated by .submit
         self.task_no = 0
+        self.num_queued = 0
         self.t0 = time.time()
         if self.distribute in 'zmq dask celery':  # add a check
             errors = ['The workerpool on %s is down' % host
@@ -785,18 +968,66 @@ class Starmap(object):
             pickled = isinstance(args[0], Pickled)
             if not pickled:
                 assert not isinstance(args[-1], Monitor)  # sanity check
-                args = pickle_sequence(args)
+                args = self.cache(pickle_sequence(args))
             if func is None:
                 fname = self.task_func.__name__
                 argnames = self.argnames[:-1]
             else:
                 fname = func.__name__
                 argnames = getargnames(func)[:-1]
-            self.sent[fname] += {a: len(p) for a, p in zip(argnames, args)}
+            sent = {a: len(p) for a, p in zip(argnames, args)}
+            saved = sum(p.size - len(p) for p in args
+                        if isinstance(p, Cached))
+            if saved:
+                sent['saved'] = saved
+            self.sent[fname] += sent
         res = submit[dist](self, func, args, monitor)
         self.task_no += 1
         self.tasks.append(res)
 
+    def cache(self, args):
+        """
+        Replace the big arguments (except the first) which are equal to
+        the arguments of a previous task with Cached instances.
+
+        :param args: a list of Pickled instances
+        :returns: a list of Pickled and Cached instances
+        """
+        if not self.use_cache:
+            return args
+        out = args[:1]
+        for pik in args[1:]:
+            if len(pik) >= MIN_CACHED_SIZE:
+                key = hashlib.sha1(pik.pik).digest()
+                if key not in self.shared:  # first time, send it directly
+                    self.shared[key] = None
+                else:
+                    if self.shared[key] is None:
+                        if self.cache_dir is None:
+                            fname = os.path.abspath(self.h5.filename)
+                            self.cache_dir = tempfile.mkdtemp(
+                                prefix=os.path.basename(fname)[:-5] + '_',
+                                dir=os.path.dirname(fname))
+                        self.shared[key] = Cached(pik, self.cache_dir)
+                    pik = self.shared[key]
+            out.append(pik)
+        return out
+
+    def add_task(self, func, args, weight=None):
+        """
+        Add a task to the queue; the heaviest tasks are submitted first,
+        tasks with the same weight in order of insertion.
+
+        :param func: task function
+        :param args: task arguments
+        :param weight: if None, use the weight of the first argument
+        """
+        if weight is None:
+            weight = getattr(args[0], 'weight', 1)
+        heapq.heappush(self.task_queue,
+                       (-weight, self.num_queued, func, args))
+        self.num_queued += 1
+
     def submit_all(self):
         """
         :returns: an IterResult object
@@ -805,8 +1036,8 @@ class Starmap(object):
             for args in self.task_args:
                 self.submit(args)
         else:  # build a task queue in advance
-            self.task_queue = [(self.task_func, args)
-                               for args in self.task_args]
+            for args in self.task_args:
+                self.add_task(self.task_func, args)
         return self.get_results()
 
     def get_results(self):
@@ -828,18 +1059,16 @@ class Starmap(object):
     def _submit_many(self, howmany):
         for _ in range(howmany):
             if self.task_queue:
-                # remove in LIFO order
-                func, args = self.task_queue[0]
-                del self.task_queue[0]
+                # remove the heaviest task
+                _w, _n, func, args = heapq.heappop(self.task_queue)
                 self.submit(args, func=func)
                 self.todo += 1
 
     def _loop(self):
         num_cores = self.num_cores or CT // 2
-        if self.task_queue:
-            first_args = self.task_queue[:num_cores]
-            self.task_queue[:] = self.task_queue[num_cores:]
-            for func, args in first_args:
+        for _ in range(num_cores):
+            if self.task_queue:
+                _w, _n, func, args = heapq.heappop(self.task_queue)
                 self.submit(args, func=func)
         if not hasattr(self, 'socket'):  # no submit was ever made
             return ()
@@ -851,6 +1080,7 @@ class Starmap(object):
 
         isocket = iter(self.socket)
         self.todo = len(self.tasks)
+        t_idle = None  # time when the first core became idle for good
         while self.todo:
             self.log_percent()
             res = next(isocket)
@@ -862,15 +1092,37 @@ class Starmap(object):
                 self._submit_many(1)
                 logging.debug('%d tasks todo, %d in queue',
                               self.todo, len(self.task_queue))
+                if t_idle is None and not self.task_queue and (
+                        self.todo < num_cores):
+                    t_idle = time.time()
                 yield res
             elif res.func:  # add subtask
-                self.task_queue.append((res.func, res.pik))
+                self.add_task(res.func, res.pik, res.weight)
                 self._submit_many(1)
+                t_idle = None  # a core has work to do again
             else:
                 yield res
         self.log_percent()
+        self.log_tail(t_idle)
         self.socket.__exit__(None, None, None)
         self.tasks.clear()
+        if self.cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def log_tail(self, t_idle):
+        """
+        Log the tail latency, i.e. the time passed from the moment some core
+        became idle, with no tasks in the queue, until the end of the
+        computation; a large tail means there are slow tasks to split
+        """
+        if t_idle is None or self.task_no < 2:
+            self.tail = 0
+            return
+        now = time.time()
+        self.tail = now - t_idle
+        total = now - self.t0
+        logging.info('%s tail latency: %d seconds, %d%% of the total time',
+                     self.name, self.tail, self.tail / total * 100)
 
 
 def sequential_apply(task, args, concurrent_tasks=CT,
@@ -893,31 +1145,44 @@ def count(word):
 
 
 def split_task(func, *args, duration=1000,
-               weight=operator.attrgetter('weight')):
+               weight=operator.attrgetter('weight'), task=None):
     """
     :param func: a task function with a monitor as last argument
     :param args: arguments of the task function
     :param duration: split the task if it exceeds the duration
     :param weight: weight function for the elements in args[0]
+    :param task: the task function for the subtasks (default func)
     :yields: a partial result, 0 or more task objects, 0 or 1 partial result
+
+    The heaviest elements, up to 10% of the total weight, are processed
+    first and used to estimate the time per unit of weight; then the
+    remaining elements fitting in the given duration are processed in a
+    single call in the current task, while the overflow is split in blocks
+    of the given duration, which are sent back as subtasks.
     """
-    elements = numpy.array(sorted(args[0], key=weight, reverse=True))
+    elements = sorted(args[0], key=weight, reverse=True)
     n = len(elements)
     # print('task_no=%d, num_elements=%d' % (args[-1].task_no, n))
     assert n > 0, 'Passed an empty sequence!'
     if n == 1:
         yield func(*args)
         return
-    first, *other = elements
-    first_weight = weight(first)
+    weights = numpy.array([weight(el) for el in elements])
+    cumsum = numpy.cumsum(weights)
+    # number of elements used to estimate the speed
+    k = min(numpy.searchsorted(cumsum, cumsum[-1] * .1) + 1, n - 1)
     t0 = time.time()
-    res = func(*([first],) + args[1:])
-    dt = (time.time() - t0) / first_weight  # time per unit of weight
+    res = func(*(elements[:k],) + args[1:])
+    # time per unit of weight
+    dt = (time.time() - t0) / (cumsum[k - 1] or 1) or 1E-9
     yield res
-    blocks = list(block_splitter(other, duration, lambda el: weight(el) * dt))
-    for block in blocks[:-1]:
-        yield (func, block) + args[1:-1]
-    yield func(*(blocks[-1],) + args[1:])
+    # number of remaining elements that can be processed in the duration
+    m = k + numpy.searchsorted(dt * (cumsum[k:] - cumsum[k - 1]), duration,
+                               'right')
+    for block in block_splitter(elements[m:], duration / dt, weight):
+        yield (task or func, block) + args[1:-1]
+    if m > k:
+        yield func(*(elements[k:m],) + args[1:])
 
 #                             start/stop workers                             #
 
@@ -19,7 +19,9 @@
 import os
 import unittest.mock as mock
 import time
+import heapq
 import shutil
+import pickle
 import unittest
 import itertools
 import tempfile
@@ -58,6 +60,23 @@ def supertask(text, monitor):
             yield get_length, k * v
 
 
+def sum_shared(i, array, monitor):
+    return {'n': array[i]}
+
+
+def sum_numbers(numbers, monitor):
+    return {'n': sum(numbers)}
+
+
+def sum_shared_array(shared, monitor):
+    return {'n': shared.array.sum()}
+
+
+def split_sum(numbers, monitor):
+    yield from parallel.split_task(
+        sum_numbers, numbers, monitor, duration=1E-9, weight=float)
+
+
 def countletters(text1, text2, monitor):
     for block in general.block_splitter(text1 + text2, 5):
         yield get_length, ''.join(block)
@@ -144,11 +163,112 @@ class StarmapTestCase(unittest.TestCase):
         smap = parallel.Starmap(countletters, data)
         self.assertEqual(smap.reduce(), {'n': 19})
 
+    def test_cached_args(self):
+        # the big array is sent directly only to the first task
+        array = numpy.arange(10_000)
+        smap = parallel.Starmap(sum_shared, [(i, array) for i in range(5)])
+        self.assertEqual(smap.reduce(), {'n': 10})
+        sent = smap.sent['sum_shared']
+        if smap.distribute == 'processpool':
+            self.assertGreater(sent['saved'], 4 * 0.9 * array.nbytes)
+            self.assertLess(sent['array'], 1.1 * array.nbytes)
+            self.assertFalse(os.path.exists(smap.cache_dir))
+
+    @unittest.skipUnless(parallel.shared_memory, 'requires Python 3.8+')
+    def test_shared_array(self):
+        sa = parallel.SharedArray(numpy.arange(10_000))
+        try:
+            smap = parallel.Starmap(sum_shared_array, [(sa,), (sa,)])
+            self.assertEqual(smap.reduce(), {'n': 99_990_000})
+            if smap.distribute == 'processpool':  # sent only the handle
+                self.assertLess(smap.sent['sum_shared_array']['shared'], 1000)
+        finally:
+            sa.unlink()
+
+    def test_heaviest_first(self):
+        smap = parallel.Starmap(get_length)
+        for w, data in [(1, 'a'), (3, 'b'), (2, 'c'), (3, 'd')]:
+            smap.add_task(get_length, (data,), w)
+        order = [heapq.heappop(smap.task_queue)[3][0] for _ in range(4)]
+        self.assertEqual(order, ['b', 'd', 'c', 'a'])
+
+    def test_split_task(self):
+        numbers = list(range(1, 21))  # total weight 210
+        res = list(parallel.split_task(sum_numbers, numbers, self.monitor,
+                                       duration=1E9, weight=float))
+        # the elements up to 10% of the weight, i.e. [20, 19], then the rest
+        self.assertEqual(res, [{'n': 39}, {'n': 171}])
+
+        res = list(parallel.split_task(sum_numbers, numbers, self.monitor,
+                                       duration=1E-9, weight=float))
+        self.assertEqual(res[0], {'n': 39})
+        subtasks = res[1:]  # there is no time to process anything else
+        self.assertEqual(len(subtasks), 18)
+        self.assertEqual(subtasks[0], (sum_numbers, [18]))
+
+        # 1 second per unit of weight, so [18, 17] fit in 40 seconds
+        with mock.patch.object(parallel.time, 'time', side_effect=[0, 39]):
+            res = list(parallel.split_task(sum_numbers, numbers,
+                                           self.monitor, duration=40,
+                                           weight=float))
+        self.assertEqual(res[0], {'n': 39})
+        self.assertEqual(res[1:-1], [(sum_numbers, [16, 15]),
+                                     (sum_numbers, [14, 13, 12]),
+                                     (sum_numbers, [11, 10, 9, 8]),
+                                     (sum_numbers, [7, 6, 5, 4, 3, 2, 1])])
+        self.assertEqual(res[-1], {'n': 35})
+
+    def test_split_sum(self):
+        numbers = list(range(1, 21))
+        smap = parallel.Starmap(split_sum, [(numbers,), (numbers,)])
+        self.assertEqual(smap.reduce(), {'n': 420})
+        if smap.distribute == 'processpool':  # there are subtasks
+            self.assertIn('sum_numbers', smap.sent)
+
     @classmethod
     def tearDownClass(cls):
         parallel.Starmap.shutdown()
 
 
+class SharedArrayTestCase(unittest.TestCase):
+    @unittest.skipUnless(parallel.shared_memory, 'requires Python 3.8+')
+    def test_attach(self):
+        sa = parallel.SharedArray(numpy.arange(10))
+        try:
+            with mock.patch.object(parallel.resource_tracker,
+                                   'register') as register:
+                sa1 = pickle.loads(pickle.dumps(sa))
+                sa2 = pickle.loads(pickle.dumps(sa))
+            self.assertFalse(register.called)  # owned by the master
+            self.assertIs(sa1.shm, sa2.shm)  # attached only once
+            arr = sa1.array
+            parallel.release_shared()  # the block is still in use
+            self.assertIn(sa.name, parallel.shared_attached)
+            numpy.testing.assert_equal(arr, numpy.arange(10))
+            del arr, sa1, sa2
+            parallel.release_shared()  # at the end of the task
+            self.assertNotIn(sa.name, parallel.shared_attached)
+        finally:
+            sa.unlink()
+
+
+class WorkerCacheTestCase(unittest.TestCase):
+    def test_lru(self):
+        tmpdir = tempfile.mkdtemp()
+        cache = parallel.WorkerCache(maxbytes=2 * 45_000)
+        cached = [parallel.Cached(parallel.Pickled(numpy.arange(5000) + i),
+                                  tmpdir) for i in range(3)]
+        for c in cached[:2]:
+            cache.get(c)
+        self.assertEqual(len(cache), 2)
+        cache.get(cached[0])  # now cached[1] is the least recently used
+        arr = cache.get(cached[2])
+        self.assertEqual(list(cache.objs), [cached[0].key, cached[2].key])
+        self.assertIs(cache.get(cached[2]), arr)  # not read again
+        numpy.testing.assert_equal(arr, numpy.arange(5000) + 2)
+        shutil.rmtree(tmpdir)
+
+
 class ThreadPoolTestCase(unittest.TestCase):
     def test(self):
         with mock.patch.dict(os.environ, {'OQ_DISTRIBUTE': 'threadpool'}):
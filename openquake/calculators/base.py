@@ -168,6 +168,7 @@ class BaseCalculator(metaclass=abc.ABCMeta):
         # NB: using h5=self.datastore.hdf5 would mean losing the performance
         # info about Calculator.run since the file will be closed later on
         self.oqparam = oqparam
+        self.shared_sitecols = []  # site collections in shared memory
 
     def pre_checks(self):
         """
@@ -275,6 +276,13 @@ class BaseCalculator(metaclass=abc.ABCMeta):
                 # remove temporary hdf5 file, if any
                 if os.path.exists(self.datastore.tempname) and remove:
                     os.remove(self.datastore.tempname)
+
+                # release the shared memory, unless used by the calling
+                # calculator, since the _tmp.hdf5 file can refer to it
+                if remove:
+                    for sitecol in self.shared_sitecols:
+                        sitecol._shared.unlink()
+                    self.shared_sitecols.clear()
         return getattr(self, 'exported', {})
 
     def core_task(*args):
@@ -400,15 +408,32 @@ class HazardCalculator(BaseCalculator):
     """
     def src_filter(self):
         """
-        :returns: a SourceFilter
+        :returns: a SourceFilter; with the processpool the site collection
+                  is sent to the workers via shared memory
         """
         oq = self.oqparam
         if getattr(self, 'sitecol', None):
             sitecol = self.sitecol.complete
+            if (parallel.oq_distribute() == 'processpool' and
+                    parallel.shared_memory):
+                sitecol = self.share(sitecol)
         else:  # can happen to the ruptures-only calculator
             sitecol = None
         return SourceFilter(sitecol, oq.maximum_distance)
 
+    def share(self, sitecol):
+        """
+        :param sitecol: a complete SiteCollection
+        :returns: a copy of it pickled as a handle to the shared memory
+        """
+        for shared in self.shared_sitecols:
+            if shared.array is sitecol.array:  # already shared
+                return shared
+        sa = parallel.SharedArray(sitecol.array)
+        shared = sitecol.shared(sa)
+        self.shared_sitecols.append(shared)
+        return shared
+
     @property
     def E(self):
         """
@@ -583,7 +608,8 @@ class HazardCalculator(BaseCalculator):
             calc.pre_checks = lambda: self.__class__.pre_checks(calc)
             calc.run(remove=False)
             for name in ('csm param sitecol assetcol crmodel realizations '
-                         'policy_name policy_dict full_lt').split():
+                         'policy_name policy_dict full_lt '
+                         'shared_sitecols').split():
                 if hasattr(calc, name):
                     setattr(self, name, getattr(calc, name))
         else:
@@ -17,6 +17,8 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import io
 import time
+import pickle
+import hashlib
 import psutil
 import pprint
 import logging
@@ -27,7 +29,7 @@ try:
 except ImportError:
     Image = None
 from openquake.baselib import parallel, hdf5, config
-from openquake.baselib.python3compat import encode
+from openquake.baselib.python3compat import encode, decode
 from openquake.baselib.general import (
     AccumDict, DictArray, block_splitter, groupby, humansize,
     get_nbytes_msg)
@@ -55,6 +57,22 @@ BUFFER = 1.5  # enlarge the pointsource_distance sphere to fix the weight
 get_weight = operator.attrgetter('weight')
 grp_extreme_dt = numpy.dtype([('et_id', U16), ('grp_trt', hdf5.vstr),
                              ('extreme_poe', F32)])
+# the checkpoints of the completed source groups
+checkpoint_dt = numpy.dtype([('grp_id', U16), ('checksum', hdf5.vstr),
+                             ('gstart', U16), ('gstop', U16)])
+ctime_dt = numpy.dtype([('grp_id', U16), ('source_id', hdf5.vstr),
+                        ('eff_rups', F32), ('eff_sites', F32),
+                        ('calc_time', F32)])
+# parameters affecting the PoEs of a source group
+GRP_PARAMS = ('imtls', 'truncation_level', 'maximum_distance',
+              'pointsource_distance', 'minimum_intensity',
+              'minimum_magnitude', 'ps_grid_spacing', 'point_rupture_bins',
+              'shift_hypo', 'collapse_level', 'amplification_method',
+              'amplification', 'reqv')
+# source attributes not affecting the PoEs; _geom and _nr are caches
+# filled by iter_ruptures/count_ruptures of the fault sources
+VOLATILE = {'id', 'grp_id', 'et_id', 'samples', 'checksum', 'ngsims',
+            'nsites', 'weight', '_geom', '_nr'}
 
 
 def get_source_id(src):  # used in submit_tasks
@@ -135,21 +153,88 @@ def run_preclassical(csm, oqparam, h5):
 
 def store_ctxs(dstore, rupdata, grp_id):
     """
-    Store contexts with the same magnitude in the datastore
+    Store the contexts in the datastore, one row per rupture
+
+    :param dstore: a DataStore instance
+    :param rupdata: a :class:`openquake.hazardlib.contexts.ContextBuffer`
+    :param grp_id: the source group ID
     """
-    nr = len(rupdata['mag'])
-    rupdata['nsites'] = numpy.array([len(s) for s in rupdata['sids_']])
-    rupdata['grp_id'] = numpy.repeat(grp_id, nr)
+    nr = len(rupdata)
+    if nr == 0:
+        return
+    array = rupdata.array
+    nsites = numpy.bincount(array['rup_id'], minlength=nr)
+    start = numpy.cumsum(nsites) - nsites
     nans = numpy.repeat(numpy.nan, nr)
     for par in dstore['rup']:
         n = 'rup/' + par
-        if par.endswith('_'):
-            if par in rupdata:
-                dstore.hdf5.save_vlen(n, rupdata[par])
+        if par == 'nsites':
+            hdf5.extend(dstore[n], nsites)
+        elif par == 'grp_id':
+            hdf5.extend(dstore[n], numpy.repeat(grp_id, nr))
+        elif par == 'probs_occur_':
+            dstore.hdf5.save_vlen(n, rupdata.probs_occur)
+        elif par.endswith('_'):
+            if par[:-1] in array.dtype.names:
+                dstore.hdf5.save_vlen(
+                    n, numpy.split(array[par[:-1]], start[1:]))
             else:  # add nr empty rows
                 dstore[n].resize((len(dstore[n]) + nr,))
+        elif par in array.dtype.names:
+            hdf5.extend(dstore[n], array[par][start])
+        else:
+            hdf5.extend(dstore[n], nans)
+
+
+def grp_checksum(srcs, gsims, sitecol, params):
+    """
+    :param srcs: the sources of a source group
+    :param gsims: the GSIMs associated to the group
+    :param sitecol: the complete site collection
+    :param params: a dictionary with the representation of the parameters
+    :returns: the hex digest of a hash of everything determining the PoEs
+              of the group; it does not depend on the position of the group
+              in the composite source model
+    """
+    h = hashlib.blake2b(sitecol.array.tobytes())
+    data = '\n'.join([repr(list(gsims))] + [
+        '%s = %s' % (key, params.get(key)) for key in GRP_PARAMS])
+    h.update(data.encode('utf8'))
+    for src in srcs:
+        dic = {k: v for k, v in vars(src).items() if k not in VOLATILE}
+        h.update(pickle.dumps(dic, protocol=4))
+    return h.hexdigest()
+
+
+def copy_ctxs(parent, dstore, old_grp, new_grp):
+    """
+    Copy the contexts of a source group from a parent datastore
+
+    :param parent: the datastore of the calculation to resume
+    :param dstore: the datastore of the current calculation
+    :param old_grp: the ID of the group in the parent calculation
+    :param new_grp: the ID of the group in the current calculation
+    """
+    if 'rup' not in parent:
+        return
+    idx, = numpy.where(parent['rup/grp_id'][()] == old_grp)
+    if len(idx) == 0:
+        return
+    for par in dstore['rup']:
+        n = 'rup/' + par
+        if par == 'grp_id':
+            hdf5.extend(dstore[n], numpy.repeat(U16(new_grp), len(idx)))
+        elif par.endswith('_'):  # variable-length arrays
+            # NB: h5py would convert arrays of the same length into a
+            # 2D array, so they are stored one at the time
+            dset = dstore[n]
+            start = len(dset)
+            dset.resize((start + len(idx),))
+            for i, val in enumerate(parent[n][idx], start):
+                if len(val):
+                    dset[i] = val
         else:
-            hdf5.extend(dstore[n], rupdata.get(par, nans))
+            hdf5.extend(dstore[n], parent[n][idx])
 
 
 #  ########################### task functions ############################ #
@@ -169,11 +254,13 @@ def preclassical(srcs, srcfilter, params, monitor):
     md = params['maximum_distance'](trt)
     pd = (params['pointsource_distance'](trt)
           if params['pointsource_distance'] else 0)
+    with monitor('filtering sources'):
+        indptr, _sids = srcfilter.get_close_sids(srcs)
     with monitor('splitting sources'):
         # this can be slow
-        for src in srcs:
+        for src, nsites in zip(srcs, numpy.diff(indptr)):
             t0 = time.time()
-            src.nsites = len(srcfilter.close_sids(src))
+            src.nsites = int(nsites)
             # NB: it is crucial to split only the close sources, for
             # performance reasons (think of Ecuador in SAM)
             splits = split_source(src) if (
@@ -214,10 +301,27 @@ def preclassical(srcs, srcfilter, params, monitor):
 
 def classical(srcs, rlzs_by_gsim, params, monitor):
     """
-    Read the SourceFilter and call the classical calculator in hazardlib
+    Read the SourceFilter and call the classical calculator in hazardlib.
+    If params['time_per_task'] is set, blocks of independent sources taking
+    more than time_per_task seconds are split and the overflowing sources
+    are sent back as subtasks.
     """
     srcfilter = monitor.read('srcfilter')
-    return hazclassical(srcs, srcfilter, rlzs_by_gsim, params, monitor)
+    duration = params.get('time_per_task')
+    if duration and not getattr(srcs, 'atomic', False):
+        yield from parallel.split_task(
+            lambda srcs, *args: _classical(srcs, srcfilter, *args),
+            srcs, rlzs_by_gsim, params, monitor,
+            duration=duration, task=classical)
+    else:
+        yield _classical(srcs, srcfilter, rlzs_by_gsim, params, monitor)
+
+
+def _classical(srcs, srcfilter, rlzs_by_gsim, params, monitor):
+    res = hazclassical(srcs, srcfilter, rlzs_by_gsim, params, monitor)
+    # the number of sources is used to know when a group is complete
+    res['extra']['num_srcs'] = len(srcs)
+    return res
 
 
 class Hazard:
@@ -289,26 +393,113 @@ class ClassicalCalculator(base.HazardCalculator):
             eff_rups += rec[0]
             if rec[0]:
                 eff_sites += rec[1] / rec[0]
+        # a split task can return more than one result
+        er, es, ids = self.by_task.get(extra['task_no'], (0, 0, ()))
         self.by_task[extra['task_no']] = (
-            eff_rups, eff_sites, sorted(srcids))
+            er + eff_rups, es + eff_sites, sorted(srcids.union(ids)))
         self.eff_ruptures[extra.pop('trt')] += eff_rups
-        if not pmap:
-            return acc
         grp_id = extra['grp_id']
-        if self.oqparam.disagg_by_src:
-            # store the poes for the given source
-            pmap.grp_id = grp_id
-            acc[extra['source_id'].split(':')[0]] = pmap
-        self.maxradius = max(self.maxradius, extra.pop('maxradius'))
-        with self.monitor('aggregate curves'):
-            if pmap:
+        if pmap:
+            if self.oqparam.disagg_by_src:
+                # store the poes for the given source
+                pmap.grp_id = grp_id
+                acc[extra['source_id'].split(':')[0]] = pmap
+            self.maxradius = max(self.maxradius, extra.pop('maxradius'))
+            with self.monitor('aggregate curves'):
                 acc[grp_id] |= pmap
-            # store rup_data if there are few sites
-            if self.few_sites:
-                store_ctxs(self.datastore, dic['rup_data'], grp_id)
-
+                # store rup_data if there are few sites
+                if self.few_sites:
+                    store_ctxs(self.datastore, dic['rup_data'], grp_id)
+        if grp_id in self.todo:
+            self.todo[grp_id] -= extra.get('num_srcs', 0)
+            if self.todo[grp_id] == 0:  # the group is complete
+                del self.todo[grp_id]
+                self.checkpoint(acc, grp_id)
         return acc
 
+    def checkpoint(self, acc, grp_id):
+        """
+        Store the PoEs of a complete source group and remove them from
+        the accumulator; then save the checkpoint, so that the group can be
+        reused by a calculation with `resume_calc_id`.
+        """
+        pmaps = {key: acc.pop(key) for key in list(acc)
+                 if key == grp_id or getattr(acc[key], 'grp_id', -1) == grp_id}
+        with self.monitor('saving probability maps'):
+            self.haz.store(self.oqparam.imtls, pmaps)
+            self.save_checkpoint(grp_id)
+
+    def save_checkpoint(self, grp_id):
+        """
+        Append the checksum and the calc_times of the given source group
+        to the checkpoint datasets and flush the datastore
+        """
+        slc = self.haz.slice_by_g[grp_id]
+        rec = (grp_id, self.checksums[grp_id], slc.start, slc.stop)
+        hdf5.extend(self.datastore['checkpoint/groups'],
+                    numpy.array([rec], checkpoint_dt))
+        ctimes = [(grp_id, src.source_id) + tuple(self.calc_times[src.id])
+                  for src in self.csm.src_groups[grp_id]
+                  if src.id in self.calc_times]
+        hdf5.extend(self.datastore['checkpoint/calc_times'],
+                    numpy.array(ctimes, ctime_dt))
+        self.datastore.flush()
+
+    def reuse_groups(self, calc_id):
+        """
+        Copy from the given calculation the PoEs of the source groups
+        which were completed there and have the same checksum
+
+        :returns: the set of the reused group IDs
+        """
+        oq = self.oqparam
+        reused = set()
+        if oq.disagg_by_src:
+            logging.warning('Cannot resume a calculation with '
+                            'disagg_by_src=true, recomputing everything')
+            return reused
+        with util.read(calc_id) as parent:
+            if 'checkpoint' not in parent:
+                logging.warning('There are no checkpoints in calculation '
+                                '#%d, recomputing everything', calc_id)
+                return reused
+            old = {decode(rec['checksum']): rec
+                   for rec in parent['checkpoint/groups'][()]}
+            poes = parent['_poes']
+            N, L = self.N, oq.imtls.size
+            ctimes = parent['checkpoint/calc_times'][()]
+            src_id = {src.source_id: src.id for sg in self.csm.src_groups
+                      for src in sg}
+            sids = self.sitecol.complete.sids
+            for grp_id, checksum in enumerate(self.checksums):
+                if checksum not in old:
+                    continue
+                rec = old[checksum]
+                slc = self.haz.slice_by_g[grp_id]
+                if (poes.shape[:2] != (N, L) or rec['gstop'] - rec['gstart']
+                        != slc.stop - slc.start):
+                    logging.warning(
+                        'The PoEs of group #%d in calculation #%d have an '
+                        'incompatible shape, recomputing them',
+                        rec['grp_id'], calc_id)
+                    continue
+                array = poes[:, :, rec['gstart']:rec['gstop']]
+                pmap = ProbabilityMap.from_array(array, sids)
+                trt = self.full_lt.trt_by_et[self.haz.et_ids[grp_id][0]]
+                for ct in ctimes[ctimes['grp_id'] == rec['grp_id']]:
+                    source_id = decode(ct['source_id'])
+                    self.calc_times[src_id[source_id]] += [
+                        ct['eff_rups'], ct['eff_sites'], ct['calc_time']]
+                    self.eff_ruptures[trt] += ct['eff_rups']
+                if self.few_sites:
+                    copy_ctxs(parent, self.datastore, rec['grp_id'], grp_id)
+                self.haz.store(oq.imtls, {grp_id: pmap})
+                self.save_checkpoint(grp_id)
+                reused.add(grp_id)
+        logging.info('Reused %d source group(s) out of %d from calculation '
+                     '#%d', len(reused), len(self.checksums), calc_id)
+        return reused
+
     def create_dsets(self):
         """
         Store some empty datasets in the datastore
@@ -342,6 +533,8 @@ class ClassicalCalculator(base.HazardCalculator):
                     dt = F32
                 descr.append((param, dt))
             self.datastore.create_dframe('rup', descr, 'gzip')
+        self.datastore.create_dset('checkpoint/groups', checkpoint_dt)
+        self.datastore.create_dset('checkpoint/calc_times', ctime_dt)
         self.by_task = {}  # task_no => src_ids
         self.maxradius = 0
         self.Ns = len(self.csm.source_info)
@@ -443,20 +636,33 @@ class ClassicalCalculator(base.HazardCalculator):
             return
 
         self.create_dsets()  # create the rup/ datasets BEFORE swmr_on()
-        grp_ids = numpy.arange(len(self.csm.src_groups))
         self.calc_times = AccumDict(accum=numpy.zeros(3, F32))
         weights = [rlz.weight for rlz in self.realizations]
         pgetter = getters.PmapGetter(
             self.datastore, weights, self.sitecol.sids, oq.imtls)
         srcidx = {rec[0]: i for i, rec in enumerate(
             self.csm.source_info.values())}
-        hazard = Hazard(self.datastore, self.full_lt, pgetter, srcidx)
+        self.haz = hazard = Hazard(
+            self.datastore, self.full_lt, pgetter, srcidx)
+        params = dict(oq.to_params())
+        for key in ('amplification', 'reqv'):
+            params[key] = repr(oq.inputs.get(key))
+        self.checksums = [
+            grp_checksum(sg, hazard.rlzs_by_gsim_list[grp_id],
+                         self.sitecol.complete, params)
+            for grp_id, sg in enumerate(self.csm.src_groups)]
+        reused = (self.reuse_groups(oq.resume_calc_id)
+                  if oq.resume_calc_id else ())
+        grp_ids = [grp_id for grp_id in range(len(self.csm.src_groups))
+                   if grp_id not in reused]
         blocks = list(block_splitter(grp_ids, self.groups_per_block))
         for b, block in enumerate(blocks, 1):
             args, pmaps = self.get_args_pmaps(block, hazard)
             logging.info('Sending bunch #%d of %d, %d tasks',
                          b, len(blocks), len(args))
-            smap = parallel.Starmap(classical, args, h5=self.datastore.hdf5)
+            smap = parallel.Starmap(classical, h5=self.datastore.hdf5)
+            for arg in args:  # the most expensive tasks are sent first
+                smap.add_task(classical, arg, self.est_cost(arg[0]))
             smap.monitor.save('srcfilter', self.src_filter())
             self.datastore.swmr_on()
             smap.h5 = self.datastore.hdf5
@@ -548,8 +754,35 @@ class ClassicalCalculator(base.HazardCalculator):
             collapse_level=oq.collapse_level, hint=hint,
             max_sites_disagg=oq.max_sites_disagg,
             split_sources=oq.split_sources, af=self.af)
+        if not oq.disagg_by_src:  # the blocks by source cannot be split
+            self.params['time_per_task'] = oq.time_per_task
         return psd
 
+    def get_speed(self):
+        """
+        :returns: a dictionary source code -> seconds per unit of weight,
+                  estimated from the calc_times of the computed sources
+        """
+        weight = AccumDict(accum=0)  # src.id -> weight
+        code = {}  # src.id -> source code
+        for sg in self.csm.src_groups:
+            for src in sg:
+                if src.id in self.calc_times:
+                    weight[src.id] += src.weight
+                    code[src.id] = src.code
+        tot = AccumDict(accum=numpy.zeros(2))  # code -> (time, weight)
+        for src_id, w in weight.items():
+            tot[code[src_id]] += [self.calc_times[src_id][2], w]
+        return {c: t / w for c, (t, w) in tot.items() if w}
+
+    def est_cost(self, srcs):
+        """
+        :returns: the weight of the sources rescaled by the speed of their
+                  typology, as measured on the sources already computed
+        """
+        avg = numpy.mean(list(self.speed.values())) if self.speed else 1
+        return sum(src.weight * self.speed.get(src.code, avg) for src in srcs)
+
     def get_args_pmaps(self, grp_ids, hazard):
         """
         :returns: (Starmap arguments, Pmap dictionary)
@@ -578,6 +811,7 @@ class ClassicalCalculator(base.HazardCalculator):
         self.params['max_weight'] = max_weight
         logging.info('tot_weight={:_d}, max_weight={:_d}'.format(
             int(tot_weight), int(max_weight)))
+        self.todo = {}  # grp_id -> number of sources still to compute
         for grp_id in grp_ids:
             rlzs_by_gsim = hazard.rlzs_by_gsim_list[grp_id]
             sg = src_groups[grp_id]
@@ -596,8 +830,9 @@ class ClassicalCalculator(base.HazardCalculator):
                     logging.debug('Sending %d source(s) with weight %d',
                                   len(block), sum(src.weight for src in block))
                     allargs.append((block, rlzs_by_gsim, self.params))
-        allargs.sort(key=lambda args: sum(src.weight for src in args[0]),
-                     reverse=True)
+            self.todo[grp_id] = len(sg)
+        self.speed = self.get_speed()
+        allargs.sort(key=lambda args: self.est_cost(args[0]), reverse=True)
         return allargs, pmapdic
 
     def save_hazard(self, acc, pmap_by_kind):
@@ -25,8 +25,7 @@ import pandas
 
 from openquake.baselib import datastore, hdf5, parallel, general
 from openquake.risklib.scientific import AggLossTable, InsuredLosses
-from openquake.risklib.riskinput import (
-    cache_epsilons, get_assets_by_taxo, get_output)
+from openquake.risklib.riskinput import cache_epsilons, get_outputs
 from openquake.commonlib import logs
 from openquake.calculators import base, event_based, getters
 from openquake.calculators.post_risk import PostRiskCalculator
@@ -38,6 +37,7 @@ F32 = numpy.float32
 F64 = numpy.float64
 TWO16 = 2 ** 16
 TWO32 = 2 ** 32
+MAXPAIRS = 10_000_000  # max number of (asset, event) pairs in a block
 get_n_occ = operator.itemgetter(1)
 
 gmf_info_dt = numpy.dtype([('rup_id', U32), ('task_no', U16),
@@ -49,6 +49,8 @@ def calc_risk(df, param, monitor):
     :param df: a DataFrame of GMFs with fields sid, eid, gmv_...
     :param param: a dictionary of parameters coming from the job.ini
     :param monitor: a Monitor instance
+    :yields: partial dictionaries with key alt, if the agg_loss_table
+             exceeds the agg_loss_table_maxsize
     :returns: a dictionary of arrays with keys alt, losses_by_A
     """
     mon_risk = monitor('computing risk', measuremem=False)
@@ -65,34 +67,41 @@ def calc_risk(df, param, monitor):
     tempname = param['tempname']
     aggby = param['aggregate_by']
     mal = param['minimum_asset_loss']
-    haz_by_sid = {s: d for s, d in df.groupby('sid')}
     losses_by_A = numpy.zeros((len(assets_df), len(alt.loss_names)), F32)
     acc['avg_gmf'] = avg_gmf = {}
     for col in df.columns:
         if col not in 'sid eid rlz':
             avg_gmf[col] = numpy.zeros(param['N'], F32)
 
-    for sid, asset_df in assets_df.groupby('site_id'):
-        try:
-            haz = haz_by_sid[sid]
-        except KeyError:  # no hazard here
-            continue
+    # the sites are split in blocks to avoid storing too many losses
+    nevents = df.sid.value_counts()  # sid -> number of events
+    for block in general.block_splitter(
+            assets_df.groupby('site_id'), MAXPAIRS,
+            lambda item: len(item[1]) * nevents.get(item[0], 0)):
         with mon_risk:
-            assets = asset_df.to_records()  # fast
-            acc['events_per_sid'] += len(haz)
-            assets_by_taxo = get_assets_by_taxo(assets, tempname)  # fast
-            out = get_output(crmodel, assets_by_taxo, haz)  # slow
-        with mon_agg:
-            alt.aggregate(out, mal, aggby)
-            # NB: after the aggregation out contains losses, not loss_ratios
-        ws = weights[haz['rlz']]
-        for col in df.columns:
-            if col not in 'sid eid rlz':
-                avg_gmf[col][sid] = haz[col] @ ws
-        if param['avg_losses']:
-            with mon_avg:
-                for lni, ln in enumerate(alt.loss_names):
-                    losses_by_A[assets['ordinal'], lni] += out[ln] @ ws
+            assets = pandas.concat([adf for sid, adf in block]).to_records()
+            haz = df[df.sid.isin([sid for sid, adf in block])]
+            outs = list(get_outputs(  # slow
+                crmodel, assets, haz, tempname, monitor,
+                param['counter_based_rng']))
+        for out in outs:
+            sid = out.assets['site_id'][0]
+            acc['events_per_sid'] += len(out.eids)
+            with mon_agg:
+                alt.aggregate(out, mal, aggby)
+                # NB: after the aggregation out contains losses, not ratios
+            if alt.nbytes > alt.maxsize / 2:  # send a partial table
+                yield dict(alt=alt.to_dframe())
+                alt.clear()
+            ws = weights[out.haz['rlz']]
+            for col in df.columns:
+                if col not in 'sid eid rlz':
+                    avg_gmf[col][sid] = out.haz[col] @ ws
+            if param['avg_losses']:
+                with mon_avg:
+                    for lni, ln in enumerate(alt.loss_names):
+                        losses_by_A[out.assets['ordinal'], lni] += (
+                            out[ln] @ ws)
     if len(df):
         acc['events_per_sid'] /= len(df)
     acc['alt'] = alt.to_dframe()
@@ -116,7 +125,7 @@ def start_ebrisk(rgetter, param, monitor):
             print(msg)
         yield ebrisk, rg, param
     if rgetters:
-        yield ebrisk(rgetters[-1], param, monitor)
+        yield from ebrisk(rgetters[-1], param, monitor)
 
 
 def ebrisk(rupgetter, param, monitor):
@@ -139,21 +148,18 @@ def ebrisk(rupgetter, param, monitor):
             data, time_by_rup = c.compute_all(gg.min_iml, gg.rlzs_by_gsim)
             if len(data):
                 for key, val in data.items():
-                    alldata[key].extend(data[key])
+                    alldata[key].append(val)
                 nbytes = len(data['sid']) * len(data) * 4
                 gmf_info.append((c.ebrupture.id, mon_haz.task_no, len(c.sids),
                                  nbytes, mon_haz.dt))
     if not alldata:
-        return {}
-    for key, val in sorted(alldata.items()):
-        if key in 'eid sid rlz':
-            alldata[key] = U32(alldata[key])
-        else:
-            alldata[key] = F32(alldata[key])
-    res = calc_risk(pandas.DataFrame(alldata), param, monitor)
+        return
+    df = pandas.DataFrame({key: numpy.concatenate(arrays)
+                           for key, arrays in alldata.items()})
+    res = yield from calc_risk(df, param, monitor)
     if gmf_info:
         res['gmf_info'] = numpy.array(gmf_info, gmf_info_dt)
-    return res
+    yield res
 
 
 @base.calculators.add('ebrisk')
@@ -177,9 +183,11 @@ class EbriskCalculator(event_based.EventBasedCalculator):
         if not hasattr(self, 'aggkey'):
             self.aggkey = self.assetcol.tagcol.get_aggkey(oq.aggregate_by)
         self.param['alt'] = alt = AggLossTable.new(
-            self.aggkey, oq.loss_dt().names, sec_losses)
+            self.aggkey, oq.loss_dt().names, sec_losses,
+            oq.agg_loss_table_maxsize)
         self.param['ses_ratio'] = oq.ses_ratio
         self.param['aggregate_by'] = oq.aggregate_by
+        self.param['counter_based_rng'] = oq.counter_based_rng
         ct = oq.concurrent_tasks or 1
         self.param['maxweight'] = int(oq.ebrisk_maxsize / ct)
         self.A = A = len(self.assetcol)
@@ -209,9 +217,10 @@ class EbriskCalculator(event_based.EventBasedCalculator):
     def execute(self):
         self.datastore.flush()  # just to be sure
         oq = self.oqparam
+        # with the counter-based generator the epsilons are not stored
         self.set_param(
             hdf5path=self.datastore.filename,
-            tempname=cache_epsilons(
+            tempname=None if oq.counter_based_rng else cache_epsilons(
                 self.datastore, oq, self.assetcol, self.crmodel, self.E))
         srcfilter = self.src_filter()
         logging.info(
@@ -247,6 +256,8 @@ class EbriskCalculator(event_based.EventBasedCalculator):
             for name in df.columns:
                 dset = self.datastore['agg_loss_table/' + name]
                 hdf5.extend(dset, df[name].to_numpy())
+        if 'events_per_sid' not in dic:  # partial agg_loss_table
+            return
         if self.oqparam.avg_losses:
             with self.monitor('saving avg_losses'):
                 self.datastore['avg_losses-stats'][:, 0] += dic['losses_by_A']
@@ -133,10 +133,8 @@ class PmapGetter(object):
 
         # populate _pmap
         dset = dstore['_poes']  # NLG_
-        L, G = dset.shape[1:]
-        self._pmap = probability_map.ProbabilityMap.build(L, G, self.sids)
-        for sid, array in zip(self.sids, dset[list(self.sids)]):
-            self._pmap[sid].array = array
+        self._pmap = probability_map.ProbabilityMap.from_array(
+            dset[list(self.sids)], self.sids)
         self.nbytes = self._pmap.nbytes
         dstore.close()
         return self._pmap
@@ -290,7 +288,9 @@ class GmfGetter(object):
                     computer = calc.gmf.GmfComputer(
                         ebr, sitecol, self.cmaker,
                         self.oqparam.truncation_level, self.correl_model,
-                        self.amplifier, self.sec_perils)
+                        self.amplifier, self.sec_perils,
+                        self.oqparam.counter_based_rng,
+                        self.oqparam.gmf_threads)
                 except FarAwayRupture:
                     continue
                 # due to numeric errors ruptures within the maximum_distance
@@ -322,13 +322,9 @@ class GmfGetter(object):
                 self.min_iml, self.rlzs_by_gsim, self.sig_eps)
             self.times.append((computer.ebrupture.id, len(computer.sids), dt))
             for key in data:
-                alldata[key].extend(data[key])
-        for key, val in sorted(alldata.items()):
-            if key in 'eid sid rlz':
-                alldata[key] = U32(alldata[key])
-            else:
-                alldata[key] = F32(alldata[key])
-        return pandas.DataFrame(alldata)
+                alldata[key].append(data[key])
+        return pandas.DataFrame({key: numpy.concatenate(arrays)
+                                 for key, arrays in alldata.items()})
 
     # not called by the engine
     def get_hazard(self, gsim=None):
@@ -21,7 +21,8 @@ import logging
 import itertools
 import numpy
 
-from openquake.baselib import general, datastore, parallel, python3compat
+from openquake.baselib import (
+    general, datastore, hdf5, parallel, python3compat)
 from openquake.hazardlib.stats import set_rlzs_stats
 from openquake.risklib import scientific
 from openquake.calculators import base, views
@@ -29,6 +30,7 @@ from openquake.calculators import base, views
 F32 = numpy.float32
 U16 = numpy.uint16
 U32 = numpy.uint32
+I64 = numpy.int64
 
 
 def reagg_idxs(num_tags, tagnames):
@@ -114,14 +116,94 @@ def get_src_loss_table(dstore, L):
     return zip(*sorted(acc.items()))
 
 
-def post_risk(builder, kr_losses, monitor):
+def store_sorted_alt(dstore, tempname, loss_names, K, R, idxs=None):
     """
-    :returns: dictionary kr -> L loss curves
+    Store in the file `tempname` the agg_loss_table sorted by the index
+    kr = agg_id * R + rlz_id, without reading it all in memory: the table
+    is read in chunks of MAX_ROWS rows, each chunk is sorted and appended,
+    and the positions of the kr indices in each chunk are stored in the
+    dataset alt/offsets of shape (num_chunks, KR + 1).
+
+    :param dstore: a DataStore with an agg_loss_table and events
+    :param tempname: path to the temporary file
+    :param loss_names: the names of the loss columns
+    :param K: the number of aggregation keys
+    :param R: the number of realizations
+    :param idxs: if given, the reaggregation indices, an array of size K + 1
+    :returns: an array with the number of rows for each kr index
+    """
+    alt = dstore['agg_loss_table']
+    rlz_id = dstore['events']['rlz_id']
+    KR = (K + 1) * R
+    counts = numpy.zeros(KR, I64)
+    L = len(loss_names)
+    nrows = len(alt['event_id'])
+    with hdf5.File(tempname, 'a') as h5:
+        if 'alt' in h5:  # from a previous post_risk
+            del h5['alt']
+        eids_dset = hdf5.create(h5, 'alt/event_id', U32)
+        kr_dset = hdf5.create(h5, 'alt/kr', I64)
+        losses_dset = hdf5.create(h5, 'alt/losses', F32, (None, L))
+        offsets_dset = hdf5.create(h5, 'alt/offsets', I64, (None, KR + 1))
+        start = 0
+        for slc in general.gen_slices(0, nrows, datastore.MAX_ROWS):
+            eids = alt['event_id'][slc]
+            aggids = alt['agg_id'][slc]
+            if idxs is not None:
+                aggids = idxs[aggids]
+            kr = aggids.astype(I64) * R + rlz_id[eids]
+            order = numpy.argsort(kr, kind='stable')
+            kr = kr[order]
+            losses = numpy.zeros((len(kr), L), F32)
+            for lni, ln in enumerate(loss_names):
+                losses[:, lni] = alt[ln][slc][order]
+            hdf5.extend(eids_dset, eids[order])
+            hdf5.extend(kr_dset, kr)
+            hdf5.extend(losses_dset, losses)
+            offsets = start + numpy.searchsorted(kr, numpy.arange(KR + 1))
+            hdf5.extend(offsets_dset, offsets.reshape(1, -1))
+            counts += numpy.bincount(kr, minlength=KR)
+            start += len(kr)
+    return counts
+
+
+def post_risk(builder, tempname, krs, R, monitor):
+    """
+    :param builder: a LossCurvesMapsBuilder instance
+    :param tempname: path to the file with the sorted agg_loss_table
+    :param krs: a slice of kr indices
+    :param R: the number of realizations
+    :returns: dictionary kr -> (L total losses, L loss curves)
     """
-    res = {}
-    for k, r, losses in kr_losses:
-        res[k, r] = builder.build_curves(losses, r)
-    return res
+    with monitor('reading agg_loss_table'), hdf5.File(tempname, 'r') as h5:
+        eids, kr, losses = [], [], []
+        for start, stop in h5['alt/offsets'][:, [krs.start, krs.stop]]:
+            eids.append(h5['alt/event_id'][start:stop])
+            kr.append(h5['alt/kr'][start:stop])
+            losses.append(h5['alt/losses'][start:stop])
+    eids = numpy.concatenate(eids)
+    kr = numpy.concatenate(kr)
+    losses = numpy.concatenate(losses)
+    order = numpy.lexsort((eids, kr))
+    eids, kr, losses = eids[order], kr[order], losses[order]
+    # there are duplicated events if partial tables were stored
+    # or if the losses were reaggregated
+    new = numpy.ones(len(kr), bool)
+    new[1:] = (kr[1:] != kr[:-1]) | (eids[1:] != eids[:-1])
+    if not new.all():
+        summed = numpy.zeros((new.sum(), losses.shape[1]), F32)
+        numpy.add.at(summed, numpy.cumsum(new) - 1, losses)
+        kr, losses = kr[new], summed
+    uniq, starts = numpy.unique(kr, return_index=True)
+    totals = numpy.add.reduceat(losses, starts)  # shape (G, L)
+    # build the curves for all the G x L groups of losses at once
+    M, L = losses.shape
+    offsets = numpy.concatenate(
+        [starts + lni * M for lni in range(L)] + [[L * M]])
+    curves = builder.build_all_curves(
+        losses.T.flatten(), offsets, numpy.tile(uniq % R, L))
+    curves = curves.reshape(L, len(uniq), -1).transpose(1, 0, 2)
+    return dict(zip(uniq, zip(totals, curves)))
 
 
 @base.calculators.add('post_risk')
@@ -171,45 +253,38 @@ class PostRiskCalculator(base.RiskCalculator):
         builder = get_loss_builder(self.datastore)
         K = len(self.aggkey) if oq.aggregate_by else 0
         P = len(builder.return_periods)
-        # do everything in process since it is really fast
-        rlz_id = self.datastore['events']['rlz_id']
-        alt_df = self.datastore.read_df('agg_loss_table')
         if self.reaggreate:
             idxs = numpy.concatenate([
                 reagg_idxs(self.num_tags, oq.aggregate_by),
                 numpy.array([K], int)])
-            alt_df['agg_id'] = idxs[alt_df['agg_id'].to_numpy()]
-            alt_df = alt_df.groupby(['event_id', 'agg_id']).sum().reset_index()
-        alt_df['rlz_id'] = rlz_id[alt_df.event_id.to_numpy()]
+        else:
+            idxs = None
+        tempname = self.datastore.tempname
+        with self.monitor('sorting agg_loss_table', measuremem=True):
+            counts = store_sorted_alt(
+                self.datastore, tempname, oq.loss_names, K, self.R, idxs)
         units = self.datastore['cost_calculator'].get_units(oq.loss_names)
         dist = ('no' if os.environ.get('OQ_DISTRIBUTE') == 'no'
                 else 'processpool')  # use only the local cores
         smap = parallel.Starmap(post_risk, h5=self.datastore.hdf5,
                                 distribute=dist)
-        # producing concurrent_tasks/2 = num_cores tasks
-        blocksize = int(numpy.ceil(
-            (K + 1) * self.R / (oq.concurrent_tasks // 2 or 1)))
-        kr_losses = []
+        # producing concurrent_tasks/2 = num_cores tasks, each one reading
+        # its own slice of kr indices from the temporary file
+        ntasks = oq.concurrent_tasks // 2 or 1
+        cumcounts = numpy.cumsum(counts)
+        maxrows = numpy.ceil(cumcounts[-1] / ntasks)
+        edges = numpy.searchsorted(
+            cumcounts, numpy.arange(1, ntasks) * maxrows, 'right')
+        edges = numpy.unique(numpy.concatenate([[0], edges, [len(counts)]]))
+        for kr0, kr1 in zip(edges[:-1], edges[1:]):
+            if counts[kr0:kr1].any():
+                smap.submit((builder, tempname, slice(kr0, kr1), self.R))
         agg_losses = numpy.zeros((K + 1, self.R, self.L), F32)
         agg_curves = numpy.zeros((K + 1, self.R, self.L, P), F32)
-        gb = alt_df.groupby([alt_df.agg_id, alt_df.rlz_id])
-        # NB: in the future we may use multiprocessing.shared_memory
-        for (k, r), df in gb:
-            arr = numpy.zeros((self.L, len(df)), F32)
-            for lni, ln in enumerate(oq.loss_names):
-                arr[lni] = df[ln].to_numpy()
-            agg_losses[k, r] = arr.sum(axis=1)
-            kr_losses.append((k, r, arr))
-            if len(kr_losses) >= blocksize:
-                size = sum(ls.nbytes for k, r, ls in kr_losses)
-                logging.info('Sending %s of losses',
-                             general.humansize(size))
-                smap.submit((builder, kr_losses))
-                kr_losses[:] = []
-        if kr_losses:
-            smap.submit((builder, kr_losses))
-        for (k, r), curve in smap.reduce().items():
-            agg_curves[k, r] = curve
+        for kr, (losses, curves) in smap.reduce().items():
+            k, r = divmod(kr, self.R)
+            agg_losses[k, r] = losses
+            agg_curves[k, r] = curves
         self.datastore['agg_losses-rlzs'] = agg_losses * oq.ses_ratio
         set_rlzs_stats(self.datastore, 'agg_losses',
                        agg_id=K + 1, loss_types=oq.loss_names, units=units)
@@ -131,7 +131,8 @@ class EventBasedRiskCalculator(base.RiskCalculator):
         self.num_events = numpy.bincount(self.rlzs)  # events by rlz
         aggkey = self.assetcol.tagcol.get_aggkey(oq.aggregate_by)
         self.param['alt'] = self.acc = scientific.AggLossTable.new(
-            aggkey, oq.loss_names, sec_losses=[])
+            aggkey, oq.loss_names, sec_losses=[],
+            maxsize=oq.agg_loss_table_maxsize)
         L = len(oq.loss_names)
         self.avglosses = numpy.zeros((len(self.assetcol), self.R, L), F32)
         if oq.investigation_time:  # event_based
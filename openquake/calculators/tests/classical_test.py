@@ -21,7 +21,14 @@ import gzip
 import unittest
 import numpy
 from openquake.baselib import parallel, general, config
-from openquake.hazardlib import lt
+from openquake.hazardlib import lt, site
+from openquake.hazardlib.geo import Line, Point
+from openquake.hazardlib.mfd import EvenlyDiscretizedMFD
+from openquake.hazardlib.scalerel import WC1994
+from openquake.hazardlib.tom import PoissonTOM
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from openquake.hazardlib.source import SimpleFaultSource, ComplexFaultSource
+from openquake.calculators import classical
 from openquake.calculators.views import view
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
@@ -381,6 +388,23 @@ hazard_uhs-std.csv
         self.assertEqual(list(df.columns),
                          ['site_id', 'stat', 'imt', 'value'])
 
+    def test_case_20_resume(self):
+        # the 7 source groups are checkpointed and reused by a second run
+        self.run_calc(case_20.__file__, 'job.ini', disagg_by_src='false')
+        ds = self.calc.datastore
+        poes = ds['_poes'][()]
+        num_ctxs = len(ds['rup/grp_id'])
+        self.assertEqual(len(ds['checkpoint/groups']), 7)
+        self.run_calc(case_20.__file__, 'job.ini', disagg_by_src='false',
+                      resume_calc_id=str(ds.calc_id))
+        ds2 = self.calc.datastore
+        self.assertNotIn('by_task', ds2)  # nothing was recomputed
+        self.assertEqual(len(ds2['checkpoint/groups']), 7)
+        self.assertEqual(len(ds2['rup/grp_id']), num_ctxs)
+        aac(ds2['_poes'][()], poes)
+        aac(ds2['source_info']['eff_ruptures'],
+            ds['source_info']['eff_ruptures'])
+
     def test_case_21(self):
         # Simple fault dip and MFD enumeration
         self.assert_curves_ok([
@@ -865,3 +889,46 @@ hazard_uhs-std.csv
         self.run_calc(case_62.__file__, 'job.ini')
         [f] = export(('hcurves/mean', 'csv'), self.calc.datastore)
         self.assertEqualFiles('expected/hcurve-mean.csv', f)    
+
+
+class GrpChecksumTestCase(unittest.TestCase):
+    def test_geometry_cache(self):
+        # the checksum must not depend on the cached fault geometry
+        mfd = EvenlyDiscretizedMFD(6.5, 0.5, [1.0, 0.5])
+        trace = Line([Point(30.0, 30.0), Point(30.5, 30.0)])
+        bottom = Line([Point(30.0, 29.9, 20.0), Point(30.5, 29.9, 20.0)])
+        simple = SimpleFaultSource(
+            'sf', 'sf', 'Active Shallow Crust', mfd, 2.0, WC1994(), 1.0,
+            PoissonTOM(50.), 0., 20., trace, 45., 90.)
+        complex_ = ComplexFaultSource(
+            'cf', 'cf', 'Active Shallow Crust', mfd, 2.0, WC1994(), 1.0,
+            PoissonTOM(50.), [trace, bottom], 90.)
+        sitecol = site.SiteCollection.from_points([30.2, 30.3], [30.1, 30.])
+        gsims = [BooreAtkinson2008()]
+        args = [simple, complex_], gsims, sitecol, {'truncation_level': 3}
+        checksum = classical.grp_checksum(*args)
+        for src in args[0]:
+            list(src.iter_ruptures())  # build the geometry cache
+            self.assertIn('_geom', vars(src))
+        self.assertEqual(classical.grp_checksum(*args), checksum)
+        for src in args[0]:
+            src.count_ruptures()
+        self.assertEqual(classical.grp_checksum(*args), checksum)
+
+    def test_digest(self):
+        mfd = EvenlyDiscretizedMFD(6.5, 0.5, [1.0, 0.5])
+        trace = Line([Point(30.0, 30.0), Point(30.5, 30.0)])
+        src = SimpleFaultSource(
+            'sf', 'sf', 'Active Shallow Crust', mfd, 2.0, WC1994(), 1.0,
+            PoissonTOM(50.), 0., 20., trace, 45., 90.)
+        sitecol = site.SiteCollection.from_points([30.2, 30.3], [30.1, 30.])
+        gsims = [BooreAtkinson2008()]
+        checksum = classical.grp_checksum([src], gsims, sitecol, {})
+        self.assertEqual(len(checksum), 128)  # hex digest of blake2b
+        self.assertNotEqual(
+            classical.grp_checksum([src], gsims, sitecol.filtered([0]), {}),
+            checksum)
+        self.assertNotEqual(
+            classical.grp_checksum([src], gsims, sitecol,
+                                   {'truncation_level': 2}),
+            checksum)
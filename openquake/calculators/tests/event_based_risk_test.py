@@ -17,12 +17,16 @@
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 import os
 import logging
+import unittest
 from unittest import mock
 import numpy
 
+from openquake.baselib import parallel
 from openquake.baselib.general import gettemp
 from openquake.baselib.hdf5 import read_csv
+from openquake.hazardlib.calc.filters import SourceFilter
 from openquake.commonlib import logs
+from openquake.calculators import base
 from openquake.calculators.views import view, rst_table
 from openquake.calculators.tests import CalculatorTestCase, strip_calc_id
 from openquake.calculators.export import export
@@ -42,6 +46,21 @@ def aae(data, expected):
                 numpy.testing.assert_almost_equal(got, numpy.float32(exp))
 
 
+shared_names = []  # names of the shared memory blocks created in the tests
+
+
+class SharedArray(parallel.SharedArray):
+    def __init__(self, array):
+        super().__init__(array)
+        shared_names.append(self.name)
+
+
+def src_filter(calc):
+    # share the site collection, as it happens with the processpool
+    return SourceFilter(calc.share(calc.sitecol.complete),
+                        calc.oqparam.maximum_distance)
+
+
 class EventBasedRiskTestCase(CalculatorTestCase):
 
     def assert_stats_ok(self, pkg, job_ini):
@@ -243,6 +262,20 @@ class EventBasedRiskTestCase(CalculatorTestCase):
             self.assertEqualFiles('expected/' + strip_calc_id(fname),
                                   fname, delta=1E-5)
 
+    @unittest.skipUnless(parallel.shared_memory, 'requires Python 3.8+')
+    def test_shared_sitecol(self):
+        # the site collection shared by the event_based precalculator is
+        # inherited by the risk calculator, which must unlink it at the end
+        del shared_names[:]
+        with mock.patch.object(parallel, 'SharedArray', SharedArray), \
+                mock.patch.object(base.HazardCalculator, 'src_filter',
+                                  src_filter):
+            self.run_calc(occupants.__file__, 'job.ini')
+        self.assertEqual(len(shared_names), 1)  # shared only once
+        self.assertEqual(self.calc.shared_sitecols, [])
+        with self.assertRaises(FileNotFoundError):  # really unlinked
+            parallel.shared_memory.SharedMemory(shared_names[0])
+
     def test_case_master1(self):
         # needs a large tolerance: https://github.com/gem/oq-engine/issues/5825
         # it looks like the cholesky decomposition is OS-dependent, so
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2021, GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy
+import pandas
+from openquake.baselib import hdf5, datastore
+from openquake.baselib.performance import Monitor
+from openquake.risklib import scientific
+from openquake.calculators.post_risk import store_sorted_alt, post_risk
+
+aac = numpy.testing.assert_allclose
+F32 = numpy.float32
+LOSS_NAMES = ['structural', 'nonstructural']
+
+
+def inmemory_post_risk(alt_df, rlz_id, builder, idxs=None):
+    # the in-memory implementation used up to engine 3.11, based on
+    # pandas; the duplicated (event_id, agg_id) rows are summed, as it
+    # was done in the reaggregation case
+    if idxs is not None:
+        alt_df['agg_id'] = idxs[alt_df['agg_id'].to_numpy()]
+    alt_df = alt_df.groupby(['event_id', 'agg_id']).sum().reset_index()
+    alt_df['rlz_id'] = rlz_id[alt_df.event_id.to_numpy()]
+    res = {}
+    for (k, r), df in alt_df.groupby([alt_df.agg_id, alt_df.rlz_id]):
+        arr = numpy.zeros((len(LOSS_NAMES), len(df)), F32)
+        for lni, ln in enumerate(LOSS_NAMES):
+            arr[lni] = df[ln].to_numpy()
+        res[k, r] = arr.sum(axis=1), builder.build_curves(arr, r)
+    return res
+
+
+class PostRiskTestCase(unittest.TestCase):
+    # the out-of-core reduction of the agg_loss_table must give the same
+    # losses and loss curves of the in-memory pandas groupby
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        rng = numpy.random.RandomState(42)
+        E, R, K = 200, 3, 4  # 4 aggregation keys + the total
+        cls.R = R
+        cls.rlz_id = rng.randint(0, R, E)
+        eids, aggids = [], []
+        for eid in range(E):
+            for agg_id in range(K):
+                if rng.random() < .6:
+                    eids.append(eid)
+                    aggids.append(agg_id)
+            eids.append(eid)
+            aggids.append(K)
+        # duplicate 20% of the rows, as it happens with partial tables
+        dupl = rng.random(len(eids)) < .2
+        eids = numpy.array(eids + list(numpy.array(eids)[dupl]))
+        aggids = numpy.array(aggids + list(numpy.array(aggids)[dupl]))
+        order = rng.permutation(len(eids))
+        cls.alt = dict(event_id=eids[order].astype(numpy.uint32),
+                       agg_id=aggids[order].astype(numpy.uint16))
+        for ln in LOSS_NAMES:
+            cls.alt[ln] = rng.lognormal(0, 2, len(eids)).astype(F32)
+        cls.fname = os.path.join(cls.tmpdir, 'calc.hdf5')
+        events = numpy.zeros(E, [('id', numpy.uint32), ('rlz_id', 'u2')])
+        events['id'] = numpy.arange(E)
+        events['rlz_id'] = cls.rlz_id
+        with hdf5.File(cls.fname, 'w') as h5:
+            h5['events'] = events
+            for col, values in cls.alt.items():
+                h5['agg_loss_table/' + col] = values
+        cls.builder = scientific.LossCurvesMapsBuilder(
+            [], numpy.array([5, 10, 20, 50, 100]), None, numpy.ones(R) / R,
+            dict(enumerate(numpy.bincount(cls.rlz_id))), 100, 50)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def check(self, K, idxs=None):
+        tempname = os.path.join(self.tmpdir, 'calc_tmp.hdf5')
+        # small chunks, to test the merging of the sorted chunks
+        with mock.patch.object(datastore, 'MAX_ROWS', 100), \
+                hdf5.File(self.fname, 'r') as h5:
+            counts = store_sorted_alt(
+                h5, tempname, LOSS_NAMES, K, self.R, idxs)
+        self.assertEqual(counts.sum(), len(self.alt['event_id']))
+        # two tasks, each one reading half of the kr indices
+        KR = (K + 1) * self.R
+        res = {}
+        for krs in slice(0, KR // 2), slice(KR // 2, KR):
+            res.update(post_risk(self.builder, tempname, krs, self.R,
+                                 Monitor()))
+        expected = inmemory_post_risk(
+            pandas.DataFrame(self.alt), self.rlz_id, self.builder, idxs)
+        self.assertEqual(sorted(res), sorted(k * self.R + r
+                                             for k, r in expected))
+        for (k, r), (losses, curves) in expected.items():
+            aac(res[k * self.R + r][0], losses, rtol=1E-5)
+            aac(res[k * self.R + r][1], curves, rtol=1E-5)
+
+    def test_duplicates(self):
+        self.check(K=4)
+
+    def test_reaggregate(self):
+        # aggregation keys 0, 2 -> 0 and 1, 3 -> 1; the total stays last
+        self.check(K=2, idxs=numpy.array([0, 1, 0, 1, 2]))
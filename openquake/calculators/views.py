@@ -288,14 +288,16 @@ def view_job_info(token, dstore):
     Determine the amount of data transferred from the controller node
     to the workers and back in a classical calculation.
     """
-    data = [['task', 'sent', 'received']]
+    data = [['task', 'sent', 'saved', 'received']]
     task_info = dstore['task_info'][()]
     task_sent = ast.literal_eval(dstore['task_sent'][()])
     for task, dic in task_sent.items():
+        saved = dic.pop('saved', 0)  # bytes not sent thanks to the cache
         sent = sorted(dic.items(), key=operator.itemgetter(1), reverse=True)
         sent = ['%s=%s' % (k, humansize(v)) for k, v in sent[:3]]
         recv = get_array(task_info, taskname=encode(task))['received'].sum()
-        data.append((task, ' '.join(sent), humansize(recv)))
+        data.append((task, ' '.join(sent), humansize(saved),
+                     humansize(recv)))
     return rst_table(data)
 
 
@@ -85,6 +85,7 @@ def main(
         run=None,
         delete_calculation: int = None,
         hazard_calculation_id: int = None,
+        resume: int = None,
         list_outputs: int = None,
         show_log=None,
         export_output=None,
@@ -157,6 +158,8 @@ def main(
             pars['cachedir'] = datadir
         if hc_id:
             pars['hazard_calculation_id'] = str(hc_id)
+        if resume:
+            pars['resume_calc_id'] = str(get_job_id(resume))
         log_file = os.path.expanduser(log_file) \
             if log_file is not None else None
         job_inis = [os.path.expanduser(f) for f in run]
@@ -247,6 +250,9 @@ main.delete_calculation = dict(
     metavar='CALCULATION_ID')
 main.hazard_calculation_id = dict(
     abbrev='--hc', help='Use the given job as input for the next job')
+main.resume = dict(
+    help='Reuse the source groups already computed by the given job',
+    metavar='CALCULATION_ID')
 main.list_outputs = dict(
     abbrev='--lo', help='List outputs for the specified calculation',
     metavar='CALCULATION_ID')
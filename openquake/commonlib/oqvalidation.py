@@ -115,6 +115,7 @@ class OqParam(valid.ParamSet):
         valid.positiveint, multiprocessing.cpu_count() * 2)  # by M. Simionato
     conditional_loss_poes = valid.Param(valid.probabilities, [])
     continuous_fragility_discretization = valid.Param(valid.positiveint, 20)
+    counter_based_rng = valid.Param(valid.boolean, False)
     cross_correlation = valid.Param(valid.Choice('yes', 'no', 'full'), 'yes')
     cachedir = valid.Param(valid.utf8, '')
     description = valid.Param(valid.utf8_not_empty)
@@ -129,6 +130,7 @@ class OqParam(valid.ParamSet):
     export_dir = valid.Param(valid.utf8, '.')
     export_multi_curves = valid.Param(valid.boolean, False)
     exports = valid.Param(valid.export_formats, ())
+    gmf_threads = valid.Param(valid.positiveint, 1)
     ground_motion_correlation_model = valid.Param(
         valid.NoneOr(valid.Choice(*GROUND_MOTION_CORRELATION_MODELS)), None)
     ground_motion_correlation_params = valid.Param(valid.dictionary, {})
@@ -198,6 +200,7 @@ class OqParam(valid.ParamSet):
     rupture_mesh_spacing = valid.Param(valid.positivefloat, 5.0)
     complex_fault_mesh_spacing = valid.Param(
         valid.NoneOr(valid.positivefloat), None)
+    resume_calc_id = valid.Param(valid.NoneOr(valid.positiveint), None)
     return_periods = valid.Param(valid.positiveints, None)
     ruptures_per_block = valid.Param(valid.positiveint, 500)  # for UCERF
     sampling_method = valid.Param(
@@ -224,12 +227,15 @@ class OqParam(valid.ParamSet):
     specific_assets = valid.Param(valid.namelist, [])
     split_sources = valid.Param(valid.boolean, True)
     ebrisk_maxsize = valid.Param(valid.positivefloat, 2E10)  # used in ebrisk
+    # max size in bytes of the partial agg_loss_table kept in memory
+    agg_loss_table_maxsize = valid.Param(valid.positivefloat, 1E9)
     # NB: you cannot increase too much min_weight otherwise too few tasks will
     # be generated in cases like Ecuador inside full South America
     min_weight = valid.Param(valid.positiveint, 200)  # used in classical
     max_weight = valid.Param(valid.positiveint, 1E6)  # used in classical
     taxonomies_from_model = valid.Param(valid.boolean, False)
     time_event = valid.Param(str, None)
+    time_per_task = valid.Param(valid.positivefloat, 0)  # in seconds
     truncation_level = valid.Param(valid.NoneOr(valid.positivefloat), None)
     uniform_hazard_spectra = valid.Param(valid.boolean, False)
     vs30_tolerance = valid.Param(valid.positiveint, 0)
@@ -404,6 +410,14 @@ class OqParam(valid.ParamSet):
             raise ValueError('asset_correlation != {0, 1} is no longer'
                              ' supported')
 
+        # checks for the counter-based random generator
+        if self.counter_based_rng and self.asset_correlation not in (0, 1):
+            raise InvalidFile('%s: asset_correlation != {0, 1} is not '
+                              'supported with counter_based_rng' % job_ini)
+        if self.gmf_threads > 1 and not self.counter_based_rng:
+            raise InvalidFile('%s: gmf_threads > 1 requires '
+                              'counter_based_rng = true' % job_ini)
+
         # checks for ebrisk
         if self.calculation_mode == 'ebrisk':
             if self.risk_investigation_time is None:
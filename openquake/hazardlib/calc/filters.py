@@ -24,6 +24,8 @@ import numpy
 from scipy.spatial import cKDTree
 
 from openquake.baselib.python3compat import raise_
+from openquake.baselib.general import block_splitter
+from openquake.baselib.performance import Monitor
 from openquake.hazardlib import site
 from openquake.hazardlib.geo.utils import (
     KM_TO_DEGREES, angular_distance, fix_lon, get_bounding_box,
@@ -31,6 +33,7 @@ from openquake.hazardlib.geo.utils import (
 
 U32 = numpy.uint32
 MAX_DISTANCE = 2000  # km, ultra big distance used if there is no filter
+MAX_CANDIDATES = 10_000_000  # max number of (source, site) pairs per query
 et_id = operator.attrgetter('et_id')
 
 
@@ -246,6 +249,24 @@ def split_source(src):
     return splits
 
 
+kdtrees = {}  # shared memory name -> cKDTree, populated in the workers
+
+
+def get_kdtree(sitecol):
+    """
+    :param sitecol: a SiteCollection
+    :returns: a cKDTree on the site coordinates; for site collections
+              in shared memory the tree is built only once per process
+    """
+    shared = sitecol.__dict__.get('_shared')
+    if shared is None:
+        return cKDTree(sitecol.xyz)
+    if shared.name not in kdtrees:
+        kdtrees.clear()  # keep only the tree of the last site collection
+        kdtrees[shared.name] = cKDTree(sitecol.xyz)
+    return kdtrees[shared.name]
+
+
 class SourceFilter(object):
     """
     Filter objects have a .filter method yielding filtered sources
@@ -263,6 +284,12 @@ class SourceFilter(object):
             else MagDepDistance(integration_distance))
         self.slc = slice(None)
 
+    def __getstate__(self):
+        # the kd-tree and the grid of the sites are not sent to the workers,
+        # they are rebuilt if needed
+        return {k: v for k, v in vars(self).items()
+                if k not in ('kdt', 'grid')}
+
     def split_in_tiles(self, hint):
         """
         Split the SourceFilter by splitting the site collection in tiles
@@ -303,6 +330,98 @@ class SourceFilter(object):
             raise exc.__class__('source %s: %s' % (src.source_id, exc))
         return (fix_lon(bbox[0]), bbox[1], fix_lon(bbox[2]), bbox[3])
 
+    def get_enlarged_boxes(self, sources, maxdist=None):
+        """
+        :param sources: a sequence of n sources
+        :param maxdist: a scalar maximum distance (or None)
+        :returns: an array of shape (n, 4) with the enlarged bounding boxes;
+                  the rows are NaN for the sources that cannot be filtered
+        """
+        boxes = numpy.zeros((len(sources), 4))
+        for i, src in enumerate(sources):
+            try:
+                boxes[i] = self.get_enlarged_box(src, maxdist)
+            except BBoxError:  # do not filter
+                boxes[i] = numpy.nan
+        return boxes
+
+    def _get_grid(self, width):
+        # sites sorted by (longitude cell, latitude), cached for a cell width
+        grid = getattr(self, 'grid', None)
+        if grid is None or grid[0] != width:
+            lons = fix_lon(self.sitecol['lon'])
+            lats = self.sitecol['lat']
+            keys = (lons + 180) // width * 256 + lats + 90
+            idx = numpy.argsort(keys)
+            self.grid = grid = width, idx, keys[idx], lons[idx], lats[idx]
+        return grid
+
+    def get_close_sids(self, sources, maxdist=None):
+        """
+        Find the sites within the enlarged bounding boxes of all the
+        sources with a single batched query on a grid of longitude cells,
+        in which the sites are sorted by latitude.
+
+        :param sources: a sequence of n sources
+        :param maxdist: a scalar maximum distance (or None)
+        :returns:
+            a pair of arrays (indptr, indices) such that the indices of the
+            sites close to the i-th source are indices[indptr[i]:indptr[i+1]]
+        """
+        n = len(sources)
+        if self.sitecol is None:
+            return numpy.zeros(n + 1, U32), numpy.zeros(0, U32)
+        N = len(self.sitecol)
+        if not self.integration_distance:  # do not filter
+            return (numpy.arange(n + 1) * N,
+                    numpy.tile(numpy.arange(N, dtype=U32), n))
+        boxes = self.get_enlarged_boxes(sources, maxdist)
+        nofilter = numpy.isnan(boxes[:, 0])
+        min_lon, min_lat, max_lon, max_lat = boxes.T
+        cross = min_lon > max_lon  # crossing the international date line
+        # the width of the cells is a power of 2 close to 1/4 of the
+        # typical width of the boxes
+        widths = (max_lon - min_lon)[~nofilter] % 360
+        width = 2. ** numpy.clip(numpy.floor(numpy.log2(
+            numpy.median(widths) / 4 if len(widths) else 1)), -6, 6)
+        width, idx, keys, lons, lats = self._get_grid(width)
+        ncells = int(numpy.ceil(360 / width))
+        # find the cells touched by each box, including the ones
+        # after the date line; the unfiltered boxes get all the sites
+        c0 = numpy.where(nofilter, 0, (min_lon + 180) // width)
+        c1 = numpy.where(nofilter, 0, (max_lon + 180) // width)
+        ncs = U32((c1 - c0) % ncells + 1)
+        src = numpy.repeat(numpy.arange(n), ncs)
+        cells = (numpy.repeat(c0 - numpy.cumsum(ncs) + ncs, ncs) +
+                 numpy.arange(ncs.sum())) % ncells * 256
+        eps = 1E-6  # the exact check on the latitudes is done below
+        start = numpy.searchsorted(keys, cells + min_lat[src] + 90 - eps)
+        stop = numpy.searchsorted(keys, cells + max_lat[src] + 90 + eps)
+        start[nofilter[src]] = 0
+        stop[nofilter[src]] = N
+        counts = stop - start
+        # the (source, site) candidates are processed in chunks
+        chunk = numpy.cumsum(counts) // MAX_CANDIDATES
+        found = []
+        for c in numpy.unique(chunk):
+            ok = chunk == c
+            cnt = counts[ok]
+            offset = numpy.repeat(start[ok] - numpy.cumsum(cnt) + cnt, cnt)
+            rows = offset + numpy.arange(cnt.sum())
+            s = numpy.repeat(src[ok], cnt)
+            lon, lat = lons[rows], lats[rows]
+            inlon = numpy.where(
+                cross[s], (min_lon[s] < lon) | (lon < max_lon[s]),
+                (min_lon[s] < lon) & (lon < max_lon[s]))
+            close = nofilter[s] | (
+                inlon & (min_lat[s] < lat) & (lat < max_lat[s]))
+            found.append(s[close].astype(numpy.int64) * N + idx[rows[close]])
+        # sort by source and then by site ID
+        found = numpy.sort(numpy.concatenate(found))
+        indptr = numpy.zeros(n + 1, U32)
+        indptr[1:] = numpy.cumsum(numpy.bincount(found // N, minlength=n))
+        return indptr, U32(found % N)
+
     def get_rectangle(self, src):
         """
         :param src: a source object
@@ -320,15 +439,22 @@ class SourceFilter(object):
         if source_indices:
             return self.sitecol.filtered(source_indices[0][1])
 
-    def split(self, sources):
+    def split(self, sources, mon=None):
         """
+        :param sources: a sequence of sources
+        :param mon: a Monitor for the time spent in filtering (or None)
         :yields: pairs (split, sites)
         """
-        for src, _indices in self.filter(sources):
-            for s in split_source(src):
-                sites = self.get_close_sites(s)
-                if sites is not None:
-                    yield s, sites
+        mon = mon or Monitor()
+        with mon:
+            close = list(self.filter(sources))
+        for src, _indices in close:
+            # the splits are filtered in blocks, to keep the memory low
+            for block in block_splitter(split_source(src), 1000):
+                with mon:
+                    pairs = list(self.filter(block))
+                for s, indices in pairs:
+                    yield s, self.sitecol.filtered(indices)
 
     # used in source and rupture prefiltering: it should not discard too much
     def close_sids(self, src_or_rec, trt=None, maxdist=None):
@@ -356,16 +482,11 @@ class SourceFilter(object):
             # even if within the maximum_distance
             return self._close_sids(lon, lat, dep, dist)
         else:  # source
-            trt = src_or_rec.tectonic_region_type
-            try:
-                bbox = self.get_enlarged_box(src_or_rec, maxdist)
-            except BBoxError:  # do not filter
-                return self.sitecol.sids
-            return self.sitecol.within_bbox(bbox)
+            return self.get_close_sids([src_or_rec], maxdist)[1]
 
     def _close_sids(self, lon, lat, dep, dist):
         if not hasattr(self, 'kdt'):
-            self.kdt = cKDTree(self.sitecol.xyz)
+            self.kdt = get_kdtree(self.sitecol)
         xyz = spherical_to_cartesian(lon, lat, dep)
         sids = U32(self.kdt.query_ball_point(xyz, dist, eps=.001))
         sids.sort()
@@ -380,10 +501,11 @@ class SourceFilter(object):
             for src in sources:
                 yield src, None
             return
-        for src in sources:
-            sids = self.close_sids(src)
-            if len(sids):
-                yield src, sids
+        sources = list(sources)
+        indptr, indices = self.get_close_sids(sources)
+        for i, src in enumerate(sources):
+            if indptr[i + 1] > indptr[i]:
+                yield src, indices[indptr[i]:indptr[i + 1]]
 
     def __getitem__(self, slc):
         if slc.start is None and slc.stop is None:
@@ -21,10 +21,12 @@ Module :mod:`~openquake.hazardlib.calc.gmf` exports
 :func:`ground_motion_fields`.
 """
 import time
+import multiprocessing.dummy
 import numpy
+import scipy.special
 import scipy.stats
 
-from openquake.baselib.general import AccumDict
+from openquake.baselib.general import AccumDict, counter_uniform, gen_slices
 from openquake.hazardlib.const import StdDev
 from openquake.hazardlib.gsim.base import ContextMaker
 from openquake.hazardlib.gsim.multi import MultiGMPE
@@ -32,6 +34,7 @@ from openquake.hazardlib.imt import from_string
 
 U32 = numpy.uint32
 F32 = numpy.float32
+MIN_THREADED_SIZE = 1_000_000  # minimum number of GMVs to use threads
 
 
 class CorrelationButNoInterIntraStdDevs(Exception):
@@ -92,6 +95,20 @@ class GmfComputer(object):
 
     :param amplifier:
         None or an instance of Amplifier
+
+    :param sec_perils:
+        a tuple of secondary perils
+
+    :param counter_based:
+        if True, sample the residuals with a counter-based random generator
+        keyed by (rupture seed, IMT, event ID, site ID), so that any subset
+        of events and sites can be generated independently; otherwise use
+        the global numpy random state seeded with the rupture seed
+
+    :param num_threads:
+        if greater than 1 and counter_based is set, the GMFs of large
+        ruptures are computed by a pool of threads, splitting by IMT and
+        by blocks of events; the results do not depend on the split
     """
     # The GmfComputer is called from the OpenQuake Engine. In that case
     # the rupture is an higher level containing a
@@ -102,7 +119,8 @@ class GmfComputer(object):
     # seed is extracted from the underlying rupture.
     def __init__(self, rupture, sitecol, cmaker,
                  truncation_level=None, correlation_model=None,
-                 amplifier=None, sec_perils=()):
+                 amplifier=None, sec_perils=(), counter_based=False,
+                 num_threads=1):
         if len(sitecol) == 0:
             raise ValueError('No sites')
         elif len(cmaker.imtls) == 0:
@@ -115,6 +133,8 @@ class GmfComputer(object):
         self.correlation_model = correlation_model
         self.amplifier = amplifier
         self.sec_perils = sec_perils
+        self.counter_based = counter_based
+        self.num_threads = num_threads
         # `rupture` is an EBRupture instance in the engine
         if hasattr(rupture, 'source_id'):
             self.ebrupture = rupture
@@ -139,7 +159,7 @@ class GmfComputer(object):
 
     def compute_all(self, min_iml, rlzs_by_gsim, sig_eps=None):
         """
-        :returns: (dict with fields eid, sid, gmv_...), dt
+        :returns: (dict with fields eid, sid, rlz, gmv_... as arrays), dt
         """
         t0 = time.time()
         sids = self.sids
@@ -153,97 +173,153 @@ class GmfComputer(object):
             # NB: the trick for performance is to keep the call to
             # .compute outside of the loop over the realizations;
             # it is better to have few calls producing big arrays
-            array, sig, eps = self.compute(gs, num_events)
+            eids = numpy.concatenate([eids_by_rlz[rlz] for rlz in rlzs])
+            array, sig, eps = self.compute(gs, num_events, eids)
             M = len(array)
             array = array.transpose(1, 0, 2)  # from M, N, E to N, M, E
             for i, miniml in enumerate(min_iml.values()):  # gmv < minimum
                 arr = array[:, i, :]
                 arr[arr < miniml] = 0
-            n = 0
-            for rlz in rlzs:
-                eids = eids_by_rlz[rlz]
-                for ei, eid in enumerate(eids):
-                    gmfa = array[:, :, n + ei]  # shape (N, M)
-                    tot = gmfa.sum(axis=0)  # shape (M,)
-                    if not tot.sum():
-                        continue
-                    if sig_eps is not None:
-                        tup = tuple([eid, rlz] + list(sig[:, n + ei]) +
-                                    list(eps[:, n + ei]))
-                        sig_eps.append(tup)
-                    items = []
+            rlzi = numpy.repeat(rlzs, [len(eids_by_rlz[rlz]) for rlz in rlzs])
+            # gmv can be zero due to the minimum_intensity, coming
+            # from the job.ini or from the vulnerability functions;
+            # the events with all zeros and the zero sites are discarded
+            gmvsum = array.sum(axis=1)  # shape (N, E)
+            ok = (gmvsum != 0) & (gmvsum.sum(axis=0) != 0)
+            # the rows are ordered by event and then by site
+            eidx, sidx = ok.T.nonzero()
+            if len(eidx) == 0:
+                continue
+            data['sid'].append(U32(sids[sidx]))
+            data['eid'].append(U32(eids[eidx]))
+            data['rlz'].append(U32(rlzi[eidx]))
+            for m in range(M):
+                data[f'gmv_{m}'].append(array[sidx, m, eidx])
+            events = numpy.unique(eidx)
+            if sig_eps is not None:
+                for e in events:
+                    sig_eps.append(tuple([eids[e], rlzi[e]] + list(sig[:, e])
+                                         + list(eps[:, e])))
+            if self.sec_perils:
+                outs = {outkey: numpy.zeros(len(eidx), F32)
+                        for sp in self.sec_perils for outkey in sp.outputs}
+                counts = ok.sum(axis=0)[events]
+                stops = numpy.cumsum(counts)
+                for e, start, stop in zip(events, stops - counts, stops):
+                    slc = slice(start, stop)
+                    gmfa = array[:, :, e]  # shape (N, M)
                     for sp in self.sec_perils:
                         o = sp.compute(mag, zip(self.imts, gmfa.T), self.sctx)
                         for outkey, outarr in zip(sp.outputs, o):
-                            items.append((outkey, outarr))
-                    for i, gmv in enumerate(gmfa):
-                        if gmv.sum():
-                            data['sid'].append(sids[i])
-                            data['eid'].append(eid)
-                            data['rlz'].append(rlz)
-                            for m in range(M):
-                                data[f'gmv_{m}'].append(gmv[m])
-                            for outkey, outarr in items:
-                                data[outkey].append(outarr[i])
-                        # gmv can be zero due to the minimum_intensity, coming
-                        # from the job.ini or from the vulnerability functions
-                n += len(eids)
-        return data, time.time() - t0
-
-    def compute(self, gsim, num_events):
+                            outs[outkey][slc] = outarr[sidx[slc]]
+                for outkey, outarr in outs.items():
+                    data[outkey].append(outarr)
+        return ({key: numpy.concatenate(arrays)
+                 for key, arrays in data.items()}, time.time() - t0)
+
+    def compute(self, gsim, num_events, eids=None):
         """
         :param gsim: a GSIM instance
         :param num_events: the number of seismic events
+        :param eids: the event IDs, required if counter_based is set
         :returns:
             a 32 bit array of shape (num_imts, num_sites, num_events) and
             two arrays with shape (num_imts, num_events): sig for stddev_inter
             and eps for the random part
         """
-        result = numpy.zeros((len(self.imts), len(self.sids), num_events), F32)
-        sig = numpy.zeros((len(self.imts), num_events), F32)
-        eps = numpy.zeros((len(self.imts), num_events), F32)
-        numpy.random.seed(self.seed)
+        M, N = len(self.imts), len(self.sids)
+        result = numpy.zeros((M, N, num_events), F32)
+        sig = numpy.zeros((M, num_events), F32)
+        eps = numpy.zeros((M, num_events), F32)
+        if self.counter_based:
+            assert len(eids) == num_events, (len(eids), num_events)
+        else:
+            numpy.random.seed(self.seed)
+        # the threads are used only if the results do not depend on the
+        # order of the calls, i.e. with the counter-based generator
+        threaded = (self.num_threads > 1 and self.counter_based and
+                    M * N * num_events >= MIN_THREADED_SIZE and not getattr(
+                        self.correlation_model, 'uncertainty_multiplier', 0))
+        if threaded:
+            blocksize = -(-num_events // self.num_threads)  # ceil division
+        blocks = []  # (imti, gsim, mean_stds, slice)
         for imti, imt in enumerate(self.imts):
             if isinstance(gsim, MultiGMPE):
                 gs = gsim[str(imt)]  # MultiGMPE
             else:
                 gs = gsim  # regular GMPE
             try:
-                result[imti], sig[imti], eps[imti] = self._compute(
-                     gs, num_events, imt)
+                if threaded:  # the sampling is performed below
+                    mean_stds = self._get_mean_stds(gs, imt)
+                    for slc in gen_slices(0, num_events, blocksize):
+                        blocks.append((imti, gs, mean_stds, slc))
+                else:
+                    result[imti], sig[imti], eps[imti] = self._compute(
+                        gs, num_events, imt, eids)
             except Exception as exc:
                 raise exc.__class__(
                     '%s for %s, %s, source_id=%s' %
                     (exc, gs, imt, self.source_id)
                 ).with_traceback(exc.__traceback__)
+
+        def sample(block):
+            # fill the block of events of the given IMT
+            imti, gs, mean_stds, slc = block
+            result[imti, :, slc], sig[imti, slc], eps[imti, slc] = (
+                self._sample(self.imts[imti], mean_stds, slc.stop - slc.start,
+                             eids[slc]))
+        if blocks:  # numpy releases the GIL, so the threads run in parallel
+            with multiprocessing.dummy.Pool(self.num_threads) as pool:
+                pool.map(sample, blocks)
         if self.amplifier:
             self.amplifier.amplify_gmfs(
                 self.sctx.ampcode, result, self.imts, self.seed)
         return result, sig, eps
 
-    def _compute(self, gsim, num_events, imt):
+    def _rvs(self, imt, eids, *size):
+        # sample (N, E) intra-event or (E,) inter-event normalized residuals
+        if not self.counter_based:
+            return rvs(self.distribution, *size)
+        # each IMT has two independent streams, for the intra and inter part
+        m = 2 * self.imts.index(imt)
+        if len(size) == 2:
+            u = counter_uniform(self.seed, m, eids, self.sids[:, None])
+        else:
+            u = counter_uniform(self.seed, m + 1, eids)
+        if self.truncation_level is None:
+            return scipy.special.ndtri(u)
+        # inverse CDF of the truncated normal, much faster than truncnorm.ppf
+        lo = scipy.special.ndtr(-self.truncation_level)
+        return scipy.special.ndtri(lo + u * (1. - 2. * lo))
+
+    def _compute(self, gsim, num_events, imt, eids=None):
         """
         :param gsim: a GSIM instance
         :param num_events: the number of seismic events
         :param imt: an IMT instance
+        :param eids: the event IDs, used only if counter_based is set
         :returns: (gmf(num_sites, num_events), stddev_inter(num_events),
                    epsilons(num_events))
         """
+        return self._sample(
+            imt, self._get_mean_stds(gsim, imt), num_events, eids)
+
+    def _get_mean_stds(self, gsim, imt):
+        """
+        :param gsim: a GSIM instance
+        :param imt: an IMT instance
+        :returns:
+            the mean and a list with zero standard deviations (if the
+            truncation level is zero), the total standard deviation or the
+            inter and intra event standard deviations, all of shape (N, 1)
+        """
         dctx = self.dctx.roundup(gsim.minimum_distance)
         if self.distribution is None:
             if self.correlation_model:
                 raise ValueError('truncation_level=0 requires '
                                  'no correlation model')
-            mean, _stddevs = gsim.get_mean_and_stddevs(
-                self.sctx, self.rctx, dctx, imt, stddev_types=[])
-            gmf = to_imt_unit_values(mean, imt)
-            gmf.shape += (1, )
-            gmf = gmf.repeat(num_events, axis=1)
-            return (gmf,
-                    numpy.zeros(num_events, F32),
-                    numpy.zeros(num_events, F32))
-        num_sids = len(self.sids)
-        if gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES == {StdDev.TOTAL}:
+            stddev_types = []
+        elif gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES == {StdDev.TOTAL}:
             # If the GSIM provides only total standard deviation, we need
             # to compute mean and total standard deviation at the sites
             # of interest.
@@ -251,27 +327,43 @@ class GmfComputer(object):
             if self.correlation_model:
                 raise CorrelationButNoInterIntraStdDevs(
                     self.correlation_model, gsim)
+            stddev_types = [StdDev.TOTAL]
+        else:
+            stddev_types = [StdDev.INTER_EVENT, StdDev.INTRA_EVENT]
+        mean, stddevs = gsim.get_mean_and_stddevs(
+            self.sctx, self.rctx, dctx, imt, stddev_types)
+        return (mean.reshape(mean.shape + (1, )),
+                [std.reshape(std.shape + (1, )) for std in stddevs])
 
-            mean, [stddev_total] = gsim.get_mean_and_stddevs(
-                self.sctx, self.rctx, dctx, imt, [StdDev.TOTAL])
-            stddev_total = stddev_total.reshape(stddev_total.shape + (1, ))
-            mean = mean.reshape(mean.shape + (1, ))
-
-            total_residual = stddev_total * rvs(
-                self.distribution, num_sids, num_events)
+    def _sample(self, imt, mean_stds, num_events, eids=None):
+        """
+        :param imt: an IMT instance
+        :param mean_stds: a pair returned by :meth:`_get_mean_stds`
+        :param num_events: the number of seismic events
+        :param eids: the event IDs, used only if counter_based is set
+        :returns: (gmf(num_sites, num_events), stddev_inter(num_events),
+                   epsilons(num_events))
+        """
+        mean, stddevs = mean_stds
+        if not stddevs:  # truncation_level = 0
+            gmf = to_imt_unit_values(mean, imt)
+            gmf = gmf.repeat(num_events, axis=1)
+            return (gmf,
+                    numpy.zeros(num_events, F32),
+                    numpy.zeros(num_events, F32))
+        num_sids = len(self.sids)
+        if len(stddevs) == 1:  # total standard deviation
+            [stddev_total] = stddevs
+            total_residual = stddev_total * self._rvs(
+                imt, eids, num_sids, num_events)
             gmf = to_imt_unit_values(mean + total_residual, imt)
             stdi = numpy.nan
             epsilons = numpy.empty(num_events, F32)
             epsilons.fill(numpy.nan)
         else:
-            mean, [stddev_inter, stddev_intra] = gsim.get_mean_and_stddevs(
-                self.sctx, self.rctx, dctx, imt,
-                [StdDev.INTER_EVENT, StdDev.INTRA_EVENT])
-            stddev_intra = stddev_intra.reshape(stddev_intra.shape + (1, ))
-            stddev_inter = stddev_inter.reshape(stddev_inter.shape + (1, ))
-            mean = mean.reshape(mean.shape + (1, ))
-            intra_residual = stddev_intra * rvs(
-                self.distribution, num_sids, num_events)
+            stddev_inter, stddev_intra = stddevs
+            intra_residual = stddev_intra * self._rvs(
+                imt, eids, num_sids, num_events)
 
             if self.correlation_model is not None:
                 intra_residual = self.correlation_model.apply_correlation(
@@ -280,7 +372,7 @@ class GmfComputer(object):
                 if len(sh) == 1:  # a vector
                     intra_residual = intra_residual.reshape(sh + (1,))
 
-            epsilons = rvs(self.distribution, num_events)
+            epsilons = self._rvs(imt, eids, num_events)
             inter_residual = stddev_inter * epsilons
 
             gmf = to_imt_unit_values(
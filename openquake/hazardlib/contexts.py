@@ -34,11 +34,14 @@ from openquake.baselib.general import (
     AccumDict, DictArray, groupby, block_splitter)
 from openquake.baselib.performance import Monitor
 from openquake.hazardlib import imt as imt_module
-from openquake.hazardlib.tom import PoissonTOM
+from openquake.hazardlib.tom import PoissonTOM, get_pnes
 from openquake.hazardlib.calc.filters import MagDepDistance
 from openquake.hazardlib.probability_map import ProbabilityMap
-from openquake.hazardlib.geo.surface import PlanarSurface
+from openquake.hazardlib.geo.surface import PlanarSurface, planar
+from openquake.hazardlib.site import site_param_dt
 
+U32 = numpy.uint32
+F64 = numpy.float64
 KNOWN_DISTANCES = frozenset(
     'rrup rx ry0 rjb rhypo repi rcdpp azimuth azimuth_cp rvolc closest_point'
     .split())
@@ -130,38 +133,196 @@ def get_num_distances(gsims):
     return len(dists)
 
 
+def stack_ctxs(ctxs, rup_params, dist_params, site_params):
+    """
+    Concatenate a list of contexts into a single stacked context, i.e.
+    a numpy.recarray with one row per (rupture, site) pair and fields
+    for the rupture parameters, the distances, the site parameters and
+    the site IDs. The rupture parameters are repeated on each row.
+
+    :param ctxs: a list of C contexts with N sites in total
+    :param rup_params: names of the required rupture parameters
+    :param dist_params: names of the required distances
+    :param site_params: names of the required site parameters
+    :returns: a recarray of length N
+    """
+    nsites = numpy.array([len(ctx.sids) for ctx in ctxs])
+    arrays = {'rup_id': numpy.repeat(numpy.arange(len(ctxs), dtype=U32),
+                                     nsites)}
+    for par in sorted(rup_params):
+        arrays[par] = numpy.repeat(
+            numpy.float64([getattr(ctx, par) for ctx in ctxs]), nsites)
+    for par in sorted(dist_params):
+        arrays[par] = numpy.concatenate(
+            [numpy.asarray(getattr(ctx, par), numpy.float64) for ctx in ctxs])
+    for par in sorted(site_params) + ['sids']:
+        arrays[par] = numpy.concatenate([getattr(ctx, par) for ctx in ctxs])
+    return numpy.rec.fromarrays(list(arrays.values()), names=list(arrays))
+
+
+def split_ctxs(array):
+    """
+    Split a stacked context into RuptureContexts, one per rupture
+
+    :param array: a stacked context with contiguous `rup_id`s
+    :returns: a list of RuptureContexts with scalar rupture parameters
+    """
+    per_site = KNOWN_DISTANCES | set(site_param_dt) | {'clon', 'clat'}
+    rup_id = array['rup_id']
+    start = numpy.concatenate(
+        [[0], numpy.where(rup_id[1:] != rup_id[:-1])[0] + 1, [len(array)]])
+    ctxs = []
+    for i, j in zip(start[:-1], start[1:]):
+        rows = array[i:j]
+        ctx = RuptureContext()
+        for par in array.dtype.names:
+            setattr(ctx, par, rows[par] if par in per_site else rows[par][0])
+        ctxs.append(ctx)
+    return ctxs
+
+
 # used only in contexts_test.py
 def _make_pmap(ctxs, cmaker):
     RuptureContext.temporal_occurrence_model = PoissonTOM(
         cmaker.investigation_time)
     # easy case of independent ruptures, useful for debugging
     pmap = ProbabilityMap(cmaker.loglevels.size, len(cmaker.gsims))
-    for ctx, poes in cmaker.gen_ctx_poes(ctxs):
-        pnes = ctx.get_probability_no_exceedance(poes)  # (N, L, G)
-        for sid, pne in zip(ctx.sids, pnes):
-            pmap.setdefault(sid, 1.).array *= pne
+    pnes = _get_pnes(ctxs, cmaker.get_poes(ctxs))  # (N, L, G)
+    pmap.multiply_at(numpy.concatenate([ctx.sids for ctx in ctxs]), pnes)
     return ~pmap
 
 
+def _get_pnes(ctxs, poes):
+    """
+    :param ctxs: a list of C context objects with N sites in total
+    :param poes: an array of shape (N, L, G)
+    :returns: the probabilities of no exceedance, with shape (N, L, G)
+
+    The computation is vectorized on all contexts if the ruptures are
+    nonparametric or Poissonian with the same time span, otherwise it
+    is performed context by context.
+    """
+    nsites, rates, probs_occur, spans = [], [], [], set()
+    nonparametric = False
+    for ctx in ctxs:
+        nsites.append(len(ctx.sids))
+        rates.append(ctx.occurrence_rate)
+        if numpy.isnan(ctx.occurrence_rate):
+            probs_occur.append(ctx.probs_occur)
+            nonparametric = True
+        elif type(ctx.temporal_occurrence_model) is PoissonTOM:
+            probs_occur.append(())
+            spans.add(ctx.temporal_occurrence_model.time_span)
+        else:  # other temporal occurrence models
+            spans.add(None)
+    if len(spans) > 1 or None in spans:
+        pnes = []
+        s = 0
+        for ctx, n in zip(ctxs, nsites):
+            pnes.append(ctx.get_probability_no_exceedance(poes[s:s+n]))
+            s += n
+        return numpy.concatenate(pnes)
+    rate = numpy.repeat(rates, nsites)
+    # the time span is not used if there are no Poissonian ruptures
+    time_span = spans.pop() if spans else 1.
+    if not nonparametric:
+        return get_pnes(rate, None, poes, time_span)
+    probs = numpy.zeros((len(ctxs), max(len(p) for p in probs_occur)))
+    for c, probs_occ in enumerate(probs_occur):
+        probs[c, :len(probs_occ)] = probs_occ
+    return get_pnes(rate, numpy.repeat(probs, nsites, axis=0), poes, time_span)
+
+
+class ContextBuffer(object):
+    """
+    A growable record array storing contexts in columnar form, with one
+    row per (rupture, site) pair: the rupture parameters are repeated on
+    each row and the rows of the same rupture share the same `rup_id`.
+    The `.array` attribute can be passed directly to the vectorized GSIMs.
+    The probabilities of occurrence of the nonparametric ruptures, having
+    variable length, are kept in a list with an element per rupture.
+
+    :param dtlist: a list of pairs (column name, dtype)
+    :param size: the initial number of rows
+    """
+    def __init__(self, dtlist, size=1000):
+        self.dt = numpy.dtype(dtlist)
+        self._array = numpy.zeros(size, self.dt)
+        self.nrows = 0
+        self.probs_occur = []  # one array per rupture
+        self._cols = [n for n in self.dt.names if n != 'rup_id']
+
+    def add(self, ctx):
+        """
+        Append the rows associated to the sites of the given context
+        """
+        n = len(ctx.sids)
+        start, stop = self.nrows, self.nrows + n
+        if stop > len(self._array):  # double the size
+            array = numpy.zeros(max(stop, 2 * len(self._array)), self.dt)
+            array[:start] = self._array[:start]
+            self._array = array
+        rows = self._array[start:stop]
+        rows['rup_id'] = len(self.probs_occur)
+        for name in self._cols:
+            rows[name] = getattr(ctx, name)
+        self.probs_occur.append(
+            numpy.asarray(getattr(ctx, 'probs_occur', ()), numpy.float64))
+        self.nrows = stop
+
+    @property
+    def array(self):
+        """
+        The filled part of the buffer, as a recarray
+        """
+        return self._array[:self.nrows].view(numpy.recarray)
+
+    def __len__(self):
+        return len(self.probs_occur)
+
+    def __getstate__(self):
+        return dict(dt=self.dt, _array=self.array.view(numpy.ndarray),
+                    nrows=self.nrows, probs_occur=self.probs_occur,
+                    _cols=self._cols)
+
+
+def read_ctx_array(dstore, slc=slice(None), req_site_params=None):
+    """
+    :returns: the ruptures in the given slice as a record array with one
+              row per (rupture, site) pair, in the format of
+              :class:`ContextBuffer`, and the rupture parameters
+    """
+    sitecol = dstore['sitecol'].complete
+    params = {n: dstore['rup/' + n][slc] for n in dstore['rup']}
+    nsites = numpy.array([len(sids) for sids in params['sids_']])
+    arrays = {'rup_id': numpy.repeat(numpy.arange(len(nsites), dtype=U32),
+                                     nsites)}
+    for par, arr in params.items():
+        if par == 'probs_occur_':  # kept as a rupture parameter
+            continue
+        elif par.endswith('_'):
+            arrays[par[:-1]] = (numpy.concatenate(arr) if len(arr)
+                                else numpy.zeros(0))
+        else:
+            arrays[par] = numpy.repeat(arr, nsites)
+    arrays['sids'] = numpy.uint32(arrays['sids'])
+    for par in req_site_params or sitecol.array.dtype.names:
+        if par != 'sids':
+            arrays[par] = sitecol[par][arrays['sids']]
+    return numpy.rec.fromarrays(list(arrays.values()),
+                                names=list(arrays)), params
+
+
 def read_ctxs(dstore, slc=slice(None), req_site_params=None):
     """
      :returns: a list of contexts
     """
     sitecol = dstore['sitecol'].complete
-    site_params = {par: sitecol[par]
-                   for par in req_site_params or sitecol.array.dtype.names}
-    params = {n: dstore['rup/' + n][slc] for n in dstore['rup']}
-    ctxs = []
-    for u in range(len(params['mag'])):
-        ctx = RuptureContext()
-        for par, arr in params.items():
-            if par.endswith('_'):
-                par = par[:-1]
-            setattr(ctx, par, arr[u])
-        for par, arr in site_params.items():
-            setattr(ctx, par, arr[ctx.sids])
+    array, params = read_ctx_array(dstore, slc, req_site_params)
+    ctxs = split_ctxs(array)
+    for ctx, probs_occur in zip(ctxs, params['probs_occur_']):
+        ctx.probs_occur = probs_occur
         ctx.idx = {sid: idx for idx, sid in enumerate(ctx.sids)}
-        ctxs.append(ctx)
     close_ctxs = [[] for sid in sitecol.sids]
     for ctx in ctxs:
         for sid in ctx.idx:
@@ -174,6 +335,8 @@ class ContextMaker(object):
     A class to manage the creation of contexts for distances, sites, rupture.
     """
     REQUIRES = ['DISTANCES', 'SITES_PARAMETERS', 'RUPTURE_PARAMETERS']
+    #: maximum number of (rupture, site) pairs in :meth:`gen_ctxs_planar`
+    MAX_PAIRS = 100_000
 
     def __init__(self, trt, gsims, param=None, monitor=Monitor()):
         param = param or {}  # empty in the gmpe-smtk
@@ -184,6 +347,8 @@ class ContextMaker(object):
         self.gsims = gsims
         self.single_site_opt = numpy.array(
             [hasattr(gsim, 'get_mean_std1') for gsim in gsims])
+        self.vectorized = numpy.array(
+            [getattr(gsim, 'vectorized', False) for gsim in gsims])
         self.maximum_distance = (
             param.get('maximum_distance') or MagDepDistance({}))
         self.investigation_time = param.get('investigation_time')
@@ -244,43 +409,84 @@ class ContextMaker(object):
         ctx.ctxs = ctxs
         return ctx
 
-    def gen_ctx_poes(self, ctxs):
+    def recarray(self, ctxs):
         """
-        :param ctxs: a list of C context objects
-        :yields: C pairs (ctx, poes of shape (N, L, G))
+        :params ctxs: a list of contexts
+        :returns: a stacked context with the parameters required by the
+                  vectorized GSIMs
+        """
+        reqs = [set(), set(), set()]
+        for gsim, vec in zip(self.gsims, self.vectorized):
+            if vec:
+                reqs[0].update(gsim.REQUIRES_RUPTURE_PARAMETERS)
+                reqs[1].update(gsim.REQUIRES_DISTANCES)
+                reqs[2].update(gsim.REQUIRES_SITES_PARAMETERS)
+        return stack_ctxs(ctxs, *reqs)
+
+    def get_poes(self, ctxs, buffer=None):
+        """
+        :param ctxs: a list of C context objects with N sites in total
+        :param buffer: a reusable array of shape (G, N', L) or None
+        :returns: poes of shape (N, L, G)
+
+        If N' >= N the poes are a view over the buffer, which
+        is overwritten at the next call.
         """
         nsites = numpy.array([len(ctx.sids) for ctx in ctxs])
         C = len(ctxs)
         N = nsites.sum()
-        poes = numpy.zeros((N, self.loglevels.size, len(self.gsims)))
+        if buffer is not None and buffer.shape[1] >= N:
+            arr = buffer[:, :N]
+        else:
+            arr = numpy.empty((len(self.gsims), N, self.loglevels.size))
         if self.single_site_opt.any():
             ctx = self.multi(ctxs)
+        if self.vectorized.any():
+            with self.gmf_mon:
+                recarr = self.recarray(ctxs)
         for g, gsim in enumerate(self.gsims):
             with self.gmf_mon:
                 # builds mean_std of shape (2, N, M)
                 if self.single_site_opt[g] and C > 1 and (nsites == 1).all():
                     mean_std = gsim.get_mean_std1(ctx, self.imts)
+                elif self.vectorized[g]:
+                    mean_std = gsim.get_mean_std(recarr, self.imts)
                 else:
                     mean_std = gsim.get_mean_std(ctxs, self.imts)
             with self.poe_mon:
-                # builds poes of shape (N, L, G)
-                poes[:, :, g] = gsim.get_poes(
-                    mean_std, self.loglevels, self.trunclevel, self.af, ctxs)
+                # fills the contiguous slice of shape (N, L)
+                gsim.get_poes(mean_std, self.loglevels, self.trunclevel,
+                              self.af, ctxs, arr[g])
+        return arr.transpose(1, 2, 0)  # shape (N, L, G)
+
+    def gen_ctx_poes(self, ctxs, buffer=None):
+        """
+        :param ctxs: a list of C context objects
+        :param buffer: a reusable array of shape (G, N', L) or None
+        :yields: C pairs (ctx, poes of shape (N, L, G))
+        """
+        poes = self.get_poes(ctxs, buffer)
         s = 0
-        for ctx, n in zip(ctxs, nsites):
+        for ctx in ctxs:
+            n = len(ctx.sids)
             yield ctx, poes[s:s+n]
             s += n
 
-    def get_ctx_params(self):
+    def ctx_dt(self):
         """
-        :returns: the interesting attributes of the context
+        :returns: the list of columns of the :class:`ContextBuffer`
+                  storing the contexts of the ContextMaker
         """
-        params = {'occurrence_rate', 'sids_', 'src_id',
-                  'probs_occur_', 'clon_', 'clat_', 'rrup_'}
-        params.update(self.REQUIRES_RUPTURE_PARAMETERS)
-        for dparam in self.REQUIRES_DISTANCES:
-            params.add(dparam + '_')
-        return params
+        dtlist = [('rup_id', U32), ('src_id', U32), ('sids', U32),
+                  ('occurrence_rate', F64), ('clon', F64), ('clat', F64),
+                  ('rrup', F64)]
+        for par in sorted(self.REQUIRES_RUPTURE_PARAMETERS):
+            dtlist.append((par, F64))
+        for par in sorted(self.REQUIRES_DISTANCES - {'rrup'}):
+            dtlist.append((par, F64))
+        for par in sorted(self.REQUIRES_SITES_PARAMETERS):
+            dtlist.append((par, site_param_dt[par]))
+        return dtlist
 
     def from_srcs(self, srcs, site1):  # used in disagg.disaggregation
         """
@@ -370,6 +576,11 @@ class ContextMaker(object):
         for param in self.REQUIRES_DISTANCES - {'rrup'}:
             distances = get_distances(rupture, sites, param)
             setattr(dctx, param, distances)
+        self._set_reqv(rupture, dctx)
+        return self.make_rctx(rupture), sites, dctx
+
+    def _set_reqv(self, rupture, dctx):
+        # replace rjb and rrup with the equivalent distances, if any
         reqv_obj = (self.reqv.get(self.trt) if self.reqv else None)
         if reqv_obj and isinstance(rupture.surface, PlanarSurface):
             reqv = reqv_obj.get(dctx.repi, rupture.mag)
@@ -377,7 +588,19 @@ class ContextMaker(object):
                 dctx.rjb = reqv
             if 'rrup' in self.REQUIRES_DISTANCES:
                 dctx.rrup = numpy.sqrt(reqv**2 + rupture.hypocenter.depth**2)
-        return self.make_rctx(rupture), sites, dctx
+
+    def _fill_ctx(self, ctx, rup, r_sites, dctx, src_id, sites, fewsites):
+        # add the site parameters and the distances to the context
+        for par in self.REQUIRES_SITES_PARAMETERS:
+            setattr(ctx, par, r_sites[par])
+        ctx.sids = r_sites.sids
+        ctx.src_id = src_id
+        for par in self.REQUIRES_DISTANCES | {'rrup'}:
+            setattr(ctx, par, getattr(dctx, par))
+        if fewsites:
+            closest = rup.surface.get_closest_points(sites.complete)
+            ctx.clon = closest.lons[ctx.sids]
+            ctx.clat = closest.lats[ctx.sids]
 
     def gen_ctxs(self, ruptures, sites, src_id, mon=Monitor()):
         """
@@ -400,18 +623,74 @@ class ContextMaker(object):
                         getattr(rup, 'sites', sites), rup)
                 except FarAwayRupture:
                     continue
-                for par in self.REQUIRES_SITES_PARAMETERS:
-                    setattr(ctx, par, r_sites[par])
-                ctx.sids = r_sites.sids
-                ctx.src_id = src_id
-                for par in self.REQUIRES_DISTANCES | {'rrup'}:
-                    setattr(ctx, par, getattr(dctx, par))
-                if fewsites:
-                    closest = rup.surface.get_closest_points(sites.complete)
-                    ctx.clon = closest.lons[ctx.sids]
-                    ctx.clat = closest.lats[ctx.sids]
+                self._fill_ctx(ctx, rup, r_sites, dctx, src_id, sites,
+                               fewsites)
             yield ctx
 
+    def gen_ctxs_planar(self, ruptures, sites, src_id, mon=Monitor()):
+        """
+        Same as :meth:`gen_ctxs`, but the distances are computed for
+        blocks of planar ruptures at once, with
+        :func:`openquake.hazardlib.geo.surface.planar.get_distances_planar`.
+        Ruptures with non-planar surfaces or GSIMs requiring other distances
+        are managed by :meth:`gen_ctxs`.
+
+        :param ruptures:
+            a list of ruptures generated by the same point-like source
+        :param sites:
+            a (filtered) SiteCollection
+        :param src_id:
+            the ID of the source (for debugging purposes)
+        :param mon:
+            a Monitor object
+        :yields:
+            fat RuptureContexts
+        """
+        params = self.REQUIRES_DISTANCES | {'rrup'}
+        if not params <= planar.PLANAR_DISTANCES:
+            yield from self.gen_ctxs(ruptures, sites, src_id, mon)
+            return
+        fewsites = len(sites.complete) <= self.max_sites_disagg
+        for _, rups in itertools.groupby(
+                ruptures, lambda rup: id(getattr(rup, 'sites', sites))):
+            # blocks of ruptures on the same sites, with a number of
+            # (rupture, site) pairs around MAX_PAIRS to keep the memory low
+            rups = list(rups)
+            r_sites = getattr(rups[0], 'sites', sites)
+            size = max(int(self.MAX_PAIRS / len(r_sites)), 1)
+            for block in block_splitter(rups, size):
+                if not all(isinstance(rup.surface, PlanarSurface)
+                           for rup in block):
+                    yield from self.gen_ctxs(block, r_sites, src_id, mon)
+                    continue
+                with mon:
+                    ctxs = self._planar_ctxs(
+                        block, r_sites, src_id, sites, fewsites)
+                yield from ctxs
+
+    def _planar_ctxs(self, rups, r_sites, src_id, sites, fewsites):
+        arr = planar.build_planar_array(
+            [rup.surface for rup in rups], [rup.hypocenter for rup in rups])
+        dists = planar.get_distances_planar(
+            arr, r_sites, self.REQUIRES_DISTANCES | {'rrup'})
+        ctxs = []
+        for u, rup in enumerate(rups):
+            mask = dists['rrup'][u] <= self.maximum_distance(
+                self.trt, rup.mag)
+            if not mask.any():
+                continue
+            dctx = DistancesContext()
+            for par, dist in dists.items():
+                dist = dist[u, mask]
+                dist.flags.writeable = False
+                setattr(dctx, par, dist)
+            self._set_reqv(rup, dctx)
+            ctx = self.make_rctx(rup)
+            self._fill_ctx(ctx, rup, r_sites.filter(mask), dctx, src_id,
+                           sites, fewsites)
+            ctxs.append(ctx)
+        return ctxs
+
     def collapse_the_ctxs(self, ctxs):
         """
         Collapse contexts with similar parameters and distances.
@@ -550,9 +829,13 @@ class PmapMaker(object):
         self.rup_indep = getattr(group, 'rup_interdep', None) != 'mutex'
         self.fewsites = self.N <= cmaker.max_sites_disagg
         self.pne_mon = cmaker.mon('composing pnes', measuremem=False)
+        self.filter_mon = cmaker.mon('filtering sources', measuremem=False)
         # NB: if maxsites is too big or too small the performance of
         # get_poes can easily become 2-3 times worse!
         self.maxsites = 512000 / len(self.gsims) / self.imtls.size
+        # buffer of 4 MB reused by all the blocks of contexts
+        self.poes_buf = numpy.zeros(
+            (len(self.gsims), int(self.maxsites), self.imtls.size))
 
     def _update_pmap(self, ctxs, pmap=None):
         # compute PoEs and update pmap
@@ -563,43 +846,48 @@ class PmapMaker(object):
         # generated has size N x L x G x 8 = 4 MB
         for block in block_splitter(
                 ctxs, self.maxsites, lambda ctx: len(ctx.sids)):
-            for ctx, poes in self.cmaker.gen_ctx_poes(block):
-                with self.pne_mon:
-                    # pnes and poes of shape (N, L, G)
-                    pnes = ctx.get_probability_no_exceedance(poes)
-                    for sid, pne in zip(ctx.sids, pnes):
-                        probs = pmap.setdefault(sid, rup_indep).array
-                        if rup_indep:
-                            probs *= pne
-                        else:  # rup_mutex
-                            probs += (1. - pne) * ctx.weight
+            poes = self.cmaker.get_poes(block, self.poes_buf)
+            with self.pne_mon:
+                # pnes and poes of shape (N, L, G) for all the contexts
+                pnes = _get_pnes(block, poes)
+                sids = numpy.concatenate([ctx.sids for ctx in block])
+                if rup_indep:
+                    pmap.multiply_at(sids, pnes)
+                else:  # rup_mutex
+                    weight = numpy.repeat([ctx.weight for ctx in block],
+                                          [len(ctx.sids) for ctx in block])
+                    pmap.add_at(sids, (1. - pnes) * weight[:, None, None])
 
     def _ruptures(self, src, filtermag=None):
         return src.iter_ruptures(
             shift_hypo=self.shift_hypo, mag=filtermag)
 
-    def _gen_ctxs(self, rups, sites, srcid):
+    def _gen_ctxs(self, rups, sites, src):
         # yield context objects to save memory
-        ctxs = self.cmaker.gen_ctxs(rups, sites, srcid, self.ctx_mon)
+        if src.code in b'PpAM':  # point-like sources with planar ruptures
+            ctxs = self.cmaker.gen_ctxs_planar(
+                rups, sites, src.id, self.ctx_mon)
+        else:
+            ctxs = self.cmaker.gen_ctxs(rups, sites, src.id, self.ctx_mon)
         if self.collapse_level > 1:
             ctxs = self.cmaker.collapse_the_ctxs(list(ctxs))
         for ctx in ctxs:
             self.numsites += len(ctx.sids)
             self.numctxs += 1
-            if self.fewsites:  # keep the contexts in memory
-                self.rupdata.append(ctx)
+            if self.fewsites:  # store the contexts in the buffer
+                self.rupdata.add(ctx)
             yield ctx
 
     def _make_src_indep(self):
         # sources with the same ID
-        for src, sites in self.srcfilter.split(self.group):
+        for src, sites in self.srcfilter.split(self.group, self.filter_mon):
             if self.fewsites:
                 sites = sites.complete
             t0 = time.time()
             self.numctxs = 0
             self.numsites = 0
             rups = self._gen_rups(src, sites)
-            self._update_pmap(self._gen_ctxs(rups, sites, src.id))
+            self._update_pmap(self._gen_ctxs(rups, sites, src))
             dt = time.time() - t0
             self.calc_times[src.id] += numpy.array(
                 [self.numctxs, self.numsites, dt])
@@ -608,7 +896,9 @@ class PmapMaker(object):
         return ~self.pmap if self.rup_indep else self.pmap
 
     def _make_src_mutex(self):
-        for src, indices in self.srcfilter.filter(self.group):
+        with self.filter_mon:
+            pairs = list(self.srcfilter.filter(self.group))
+        for src, indices in pairs:
             t0 = time.time()
             sites = self.srcfilter.sitecol.filtered(indices)
             self.numctxs = 0
@@ -616,7 +906,7 @@ class PmapMaker(object):
             rups = self._ruptures(src)
             L, G = self.cmaker.imtls.size, len(self.cmaker.gsims)
             pmap = ProbabilityMap(L, G)
-            self._update_pmap(self._gen_ctxs(rups, sites, src.id), pmap)
+            self._update_pmap(self._gen_ctxs(rups, sites, src), pmap)
             p = pmap
             if self.rup_indep:
                 p = ~p
@@ -629,16 +919,9 @@ class PmapMaker(object):
                        self.cmaker.task_no)
         return self.pmap
 
-    def dictarray(self, ctxs):
-        dic = {}  # par -> array
-        z = numpy.zeros(0)
-        for par in self.cmaker.get_ctx_params():
-            pa = par[:-1] if par.endswith('_') else par
-            dic[par] = numpy.array([getattr(ctx, pa, z) for ctx in ctxs])
-        return dic
-
     def make(self):
-        self.rupdata = []
+        self.rupdata = ContextBuffer(
+            self.cmaker.ctx_dt(), 1000 if self.fewsites else 0)
         imtls = self.cmaker.imtls
         L, G = imtls.size, len(self.gsims)
         self.pmap = ProbabilityMap(L, G)
@@ -648,8 +931,7 @@ class PmapMaker(object):
             pmap = self._make_src_mutex()
         else:
             pmap = self._make_src_indep()
-        rupdata = self.dictarray(self.rupdata)
-        return pmap, rupdata, self.calc_times
+        return pmap, self.rupdata, self.calc_times
 
     def _gen_rups(self, src, sites):
         # yield ruptures, each one with a .sites attribute
@@ -18,14 +18,30 @@ Module :mod:`openquake.hazardlib.correlation` defines correlation models for
 spatially-distributed ground-shaking intensities.
 """
 import abc
+import threading
 import numpy
 
+from openquake.hazardlib.geo.geodetic import geodetic_distance
+
 
 class BaseCorrelationModel(metaclass=abc.ABCMeta):
     """
     Base class for correlation models for spatially-distributed ground-shaking
     intensities.
+
+    The decomposed correlation matrices are kept in a LRU cache keyed by
+    IMT and site subset, containing at most `cachesize` matrices.
+    If `tolerance` is positive, instead of the full Cholesky decomposition
+    a low-rank pivoted Cholesky decomposition is used, stopping when the
+    variance not explained by the factor is below the tolerance for all
+    sites; the missing variance is added as an uncorrelated term, so that
+    the residuals keep their variance. This requires O(N k) memory
+    instead of O(N^2), where k is the rank of the approximation.
     """
+    tolerance = 0
+    cachesize = 10
+    _lock = threading.Lock()  # the cache can be used by many threads
+
     def apply_correlation(self, sites, imt, residuals, stddev_intra=0):
         """
         Apply correlation to randomly sampled residuals.
@@ -46,51 +62,39 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
             Array of the same structure and semantics as ``residuals``
             but with correlations applied.
 
-        NB: the correlation matrix is cached. It is computed only once
-        per IMT for the complete site collection and then the portion
-        corresponding to the sites is multiplied by the residuals.
+        NB: the decomposition of the correlation matrix of the sites
+        is cached, see :meth:`get_factor`.
         """
         # intra-event residual for a single relization is a product
         # of lower-triangle decomposed correlation matrix and vector
         # of N random numbers (where N is equal to number of sites).
         # we need to do that multiplication once per realization
         # with the same matrix and different vectors.
-        try:
-            corma = self.cache[imt]
-        except KeyError:
-            corma = self.get_lower_triangle_correlation_matrix(
-                sites.complete, imt)
-            self.cache[imt] = corma
-        # if N is the length of the complete site collection, then the
-        # correlation matrix has shape (N, N) and the residuals (N, s),
-        # where s is the number of samples
-        N = len(sites.complete)
-        n = len(sites)
-        if n < N:  # filtered site collection
-            res = numpy.zeros((N, residuals.shape[1]))
-            res[sites.sids] = residuals
-            return (corma @ res)[sites.sids, :]  # shape (n, s)
-        else:  # complete site collection
-            return corma @ residuals  # shape (N, s)
-
+        return correlate(self.get_factor(sites, imt), residuals)
 
-class JB2009CorrelationModel(BaseCorrelationModel):
-    """
-    "Correlation model for spatially distributed ground-motion intensities"
-    by Nirmal Jayaram and Jack W. Baker. Published in Earthquake Engineering
-    and Structural Dynamics 2009; 38, pages 1687-1708.
-
-    :param vs30_clustering:
-        Boolean value to indicate whether "Case 1" or "Case 2" from page 1700
-        should be applied. ``True`` value means that Vs 30 values show or are
-        expected to show clustering ("Case 2"), ``False`` means otherwise.
-    """
-    def __init__(self, vs30_clustering):
-        self.vs30_clustering = vs30_clustering
-        self.cache = {}  # imt -> correlation model
-
-    def _get_correlation_matrix(self, sites, imt):
-        return jbcorrelation(sites, imt, self.vs30_clustering)
+    def get_factor(self, sites, imt):
+        """
+        :param sites: a (possibly filtered) site collection
+        :param imt: an IMT instance
+        :returns:
+            the lower-triangle Cholesky factor of the correlation matrix
+            of the sites or a triple (factor, pivots, residual variances)
+            if the tolerance is positive
+        """
+        key = (str(imt), sites.sids.tobytes())
+        with self._lock:
+            try:
+                factor = self.cache.pop(key)  # to be reinserted as last
+            except KeyError:
+                if self.tolerance:
+                    factor = self.get_low_rank_factor(sites, imt)
+                else:
+                    factor = self.get_lower_triangle_correlation_matrix(
+                        sites, imt)
+            self.cache[key] = factor
+            if len(self.cache) > self.cachesize:  # discard the oldest
+                del self.cache[next(iter(self.cache))]
+        return factor
 
     def get_lower_triangle_correlation_matrix(self, sites, imt):
         """
@@ -115,6 +119,77 @@ class JB2009CorrelationModel(BaseCorrelationModel):
         """
         return numpy.linalg.cholesky(self._get_correlation_matrix(sites, imt))
 
+    def get_low_rank_factor(self, sites, imt):
+        """
+        Pivoted Cholesky decomposition of the correlation matrix, computed
+        column by column without building the full matrix.
+
+        :param sites: a (possibly filtered) site collection
+        :param imt: an IMT instance
+        :returns: (factor of shape (N, k), k pivots, N residual variances)
+        """
+        lons, lats = sites.lons, sites.lats
+        N = len(sites)
+        diag = numpy.ones(N)  # variance not explained by the factor
+        factor = numpy.zeros((N, min(N, 16)))
+        pivots = []
+        while len(pivots) < N:
+            p = diag.argmax()
+            if diag[p] <= self.tolerance:
+                break
+            k = len(pivots)
+            if k == factor.shape[1]:  # double the rank
+                factor = numpy.concatenate(
+                    [factor, numpy.zeros((N, min(k, N - k)))], axis=1)
+            dists = geodetic_distance(lons[p], lats[p], lons, lats)
+            col = self._get_correlation_matrix(dists, imt)
+            col -= factor[:, :k] @ factor[p, :k]
+            col /= numpy.sqrt(diag[p])
+            factor[:, k] = col
+            diag -= col ** 2
+            diag[p] = 0
+            pivots.append(p)
+        numpy.clip(diag, 0, None, diag)
+        return factor[:, :len(pivots)], numpy.array(pivots, int), diag
+
+
+def correlate(factor, residuals):
+    """
+    :param factor: a matrix of shape (N, N) or a triple from
+                   :meth:`BaseCorrelationModel.get_low_rank_factor`
+    :param residuals: uncorrelated residuals of shape (N, s)
+    :returns: correlated residuals of shape (N, s)
+    """
+    if isinstance(factor, tuple):  # low-rank decomposition
+        lowrank, pivots, diag = factor
+        # diag is zero on the pivots, so the two terms are independent
+        return (lowrank @ residuals[pivots] +
+                numpy.sqrt(diag)[:, None] * residuals)
+    return factor @ residuals
+
+
+class JB2009CorrelationModel(BaseCorrelationModel):
+    """
+    "Correlation model for spatially distributed ground-motion intensities"
+    by Nirmal Jayaram and Jack W. Baker. Published in Earthquake Engineering
+    and Structural Dynamics 2009; 38, pages 1687-1708.
+
+    :param vs30_clustering:
+        Boolean value to indicate whether "Case 1" or "Case 2" from page 1700
+        should be applied. ``True`` value means that Vs 30 values show or are
+        expected to show clustering ("Case 2"), ``False`` means otherwise.
+    :param tolerance:
+        If positive, use a low-rank approximation of the correlation matrix
+        explaining the variance of each site up to the given tolerance
+    """
+    def __init__(self, vs30_clustering, tolerance=0):
+        self.vs30_clustering = vs30_clustering
+        self.tolerance = tolerance
+        self.cache = {}  # (imt, sids) -> decomposed correlation matrix
+
+    def _get_correlation_matrix(self, sites, imt):
+        return jbcorrelation(sites, imt, self.vs30_clustering)
+
 
 def jbcorrelation(sites_or_distances, imt, vs30_clustering=False):
     """
@@ -159,11 +234,16 @@ class HM2018CorrelationModel(BaseCorrelationModel):
         Value to be multiplied by the uncertainty in the correlation parameter
         beta. If uncertainty_multiplier = 0 (default), the median value is
         used as a constant value.
+    :param tolerance:
+        If positive, use a low-rank approximation of the correlation matrix
+        explaining the variance of each site up to the given tolerance;
+        used only if uncertainty_multiplier = 0
     """
-    def __init__(self, uncertainty_multiplier=0):
+    def __init__(self, uncertainty_multiplier=0, tolerance=0):
         self.uncertainty_multiplier = uncertainty_multiplier
+        self.tolerance = tolerance
         self.distance_matrix = {}
-        self.cache = {}
+        self.cache = {}  # (imt, sids) -> decomposed correlation matrix
 
     def _get_correlation_matrix(self, sites, imt):
         return hmcorrelation(sites, imt, self.uncertainty_multiplier)
@@ -176,12 +256,15 @@ class HM2018CorrelationModel(BaseCorrelationModel):
         """
         # stddev_intra is repeated if it is only 1 value for all the residuals
         if stddev_intra.shape[0] == 1:
-            stddev_intra = numpy.matlib.repmat(
-                stddev_intra, len(sites.complete), 1)
+            stddev_intra = numpy.matlib.repmat(stddev_intra, len(sites), 1)
         # Reshape 'stddev_intra' if needed
         stddev_intra = stddev_intra.squeeze()
         if not stddev_intra.shape:
             stddev_intra = stddev_intra[None]
+        # stddev_intra is given for the (possibly filtered) sites, but
+        # it could also be given for the complete site collection
+        if len(stddev_intra) != len(sites):
+            stddev_intra = stddev_intra[sites.sids]
 
         if self.uncertainty_multiplier == 0:   # No uncertainty
 
@@ -190,23 +273,14 @@ class HM2018CorrelationModel(BaseCorrelationModel):
             # normalized, sampled from a standard normal distribution.
             # For this, every row of 'residuals' (every site) is divided by its
             # corresponding standard deviation element.
-            residuals_norm = residuals / stddev_intra[sites.sids, None]
+            residuals_norm = residuals / stddev_intra[:, None]
 
-            # Lower diagonal of the Cholesky decomposition from/to cache
-            try:
-                cormaLow = self.cache[imt]
-            except KeyError:
-                # Note that instead of computing the whole correlation matrix
-                # corresponding to sites.complete, here we compute only the
-                # correlation matrix corresponding to sites.
-                cormaLow = numpy.linalg.cholesky(
-                       numpy.diag(stddev_intra[sites.sids]) @
-                       self._get_correlation_matrix(sites, imt) @
-                       numpy.diag(stddev_intra[sites.sids]))
-                self.cache[imt] = cormaLow
-
-            # Apply correlation
-            return numpy.dot(cormaLow, residuals_norm)
+            # Apply correlation; since the covariance matrix is
+            # diag(s) @ C @ diag(s) its Cholesky factor is diag(s) @ L,
+            # where L is the factor of the correlation matrix C, cached
+            # for the given sites and independent from the stddevs
+            return stddev_intra[:, None] * correlate(
+                self.get_factor(sites, imt), residuals_norm)
 
         else:   # Variability (uncertainty) is included
             nsim = len(residuals[1])
@@ -216,8 +290,8 @@ class HM2018CorrelationModel(BaseCorrelationModel):
             residuals_correlated = residuals * 0
             for isim in range(0, nsim):
                 corma = self._get_correlation_matrix(sites, imt)
-                cov = (numpy.diag(stddev_intra[sites.sids]) @ corma @
-                       numpy.diag(stddev_intra[sites.sids]))
+                cov = (numpy.diag(stddev_intra) @ corma @
+                       numpy.diag(stddev_intra))
                 residuals_correlated[0:, isim] = (
                     numpy.random.multivariate_normal(
                         numpy.zeros(nsites), cov, 1))
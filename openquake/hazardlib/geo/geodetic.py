@@ -21,6 +21,7 @@ Module :mod:`openquake.hazardlib.geo.geodetic` contains functions for geodetic
 transformations, optimized for massive calculations.
 """
 import numpy
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 from openquake.baselib.python3compat import round
 
@@ -30,6 +31,12 @@ EARTH_RADIUS = 6371.0
 #: Maximum elevation on Earth in km.
 EARTH_ELEVATION = -8.848
 
+#: Maximum size of the distance matrices computed by brute force
+MAX_DISTANCE_MATRIX = 1_000_000
+
+#: Minimum number of points in a mesh to justify building a KD-tree
+MIN_KDTREE_SIZE = 100
+
 
 def geodetic_distance(lons1, lats1, lons2, lats2, diameter=2*EARTH_RADIUS):
     """
@@ -221,19 +228,58 @@ def spherical_to_cartesian(lons, lats, depths=None):
     return arr
 
 
-def min_geodetic_distance(a, b):
+def use_kdtree(m, n):
+    """
+    :param m: the number of points of the first set
+    :param n: the number of queried points
+    :returns: True if building a KD-tree on the first set is convenient
+    """
+    return m >= MIN_KDTREE_SIZE and m * n > MAX_DISTANCE_MATRIX
+
+
+def min_distance_idx(a, b, kdtree=None):
+    """
+    Find the closest point of the first set for each point of the second
+    set. If a KD-tree built on the first set is passed, it is used for the
+    nearest-neighbour queries; otherwise the distance matrix is computed in
+    chunks of at most MAX_DISTANCE_MATRIX elements, so that the memory
+    occupation is O(N) in any case.
+
+    :param a: an array of M cartesian coordinates of shape (M, 3)
+    :param b: an array of N cartesian coordinates of shape (N, 3)
+    :param kdtree: a :class:`scipy.spatial.cKDTree` built on ``a`` or None
+    :returns: the N minimum distances and the N indices of the closest points
+    """
+    if kdtree is not None:
+        return kdtree.query(b)
+    N = len(b)
+    dists = numpy.zeros(N)
+    idxs = numpy.zeros(N, int)
+    size = max(MAX_DISTANCE_MATRIX // len(a), 1)
+    for start in range(0, N, size):
+        slc = slice(start, start + size)
+        matrix = cdist(a, b[slc])
+        idxs[slc] = idx = matrix.argmin(axis=0)
+        dists[slc] = matrix[idx, numpy.arange(len(idx))]
+    return dists, idxs
+
+
+def min_geodetic_distance(a, b, kdtree=None):
     """
     Compute the minimum distance between first mesh and each point
     of the second mesh when both are defined on the earth surface.
 
     :param a: a pair of (lons, lats) or an array of cartesian coordinates
     :param b: a pair of (lons, lats) or an array of cartesian coordinates
+    :param kdtree: a :class:`scipy.spatial.cKDTree` built on ``a`` or None
     """
     if isinstance(a, tuple):
         a = spherical_to_cartesian(a[0].flatten(), a[1].flatten())
     if isinstance(b, tuple):
         b = spherical_to_cartesian(b[0].flatten(), b[1].flatten())
-    return cdist(a, b).min(axis=0)
+    if kdtree is None and use_kdtree(len(a), len(b)):
+        kdtree = cKDTree(a)
+    return min_distance_idx(a, b, kdtree)[0]
 
 
 def distance_matrix(lons, lats, diameter=2*EARTH_RADIUS):
@@ -21,7 +21,7 @@ Module :mod:`openquake.hazardlib.geo.mesh` defines classes :class:`Mesh` and
 its subclass :class:`RectangularMesh`.
 """
 import numpy
-from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 import shapely.geometry
 import shapely.ops
 
@@ -171,6 +171,32 @@ class Mesh(object):
         return geo_utils.spherical_to_cartesian(
             self.lons.flat, self.lats.flat, self.depths.flat)
 
+    def __getstate__(self):
+        # the KD-trees are not pickled, they are rebuilt on demand
+        return {k: v for k, v in vars(self).items()
+                if k not in ('_kdtrees', '_queried')}
+
+    def _get_kdtree(self, xyz, npoints, kind='3d'):
+        """
+        :param xyz: the cartesian coordinates of the points of the mesh
+        :param npoints: the number of points to query
+        :param kind: '3d' for the mesh, '2d' for its surface projection
+        :returns: a :class:`scipy.spatial.cKDTree` on ``xyz`` or None
+
+        The KD-tree is built (and cached) only when the number of pairs
+        (mesh point, queried point), accumulated over all the queries on
+        the mesh, exceeds MAX_DISTANCE_MATRIX; for less pairs the brute
+        force is faster than building the tree.
+        """
+        trees = self.__dict__.setdefault('_kdtrees', {})
+        if kind in trees:
+            return trees[kind]
+        queried = self.__dict__.setdefault('_queried', {})
+        queried[kind] = queried.get(kind, 0) + npoints
+        if geodetic.use_kdtree(len(xyz), queried[kind]):
+            trees[kind] = cKDTree(xyz)
+            return trees[kind]
+
     def __iter__(self):
         """
         Generate :class:`~openquake.hazardlib.geo.point.Point` objects the mesh
@@ -246,7 +272,8 @@ class Mesh(object):
         this mesh to each point of the target mesh and returns the lowest found
         for each.
         """
-        return cdist(self.xyz, mesh.xyz).min(axis=0)
+        kdtree = self._get_kdtree(self.xyz, len(mesh))
+        return geodetic.min_distance_idx(self.xyz, mesh.xyz, kdtree)[0]
 
     def get_closest_points(self, mesh):
         """
@@ -256,7 +283,9 @@ class Mesh(object):
             :class:`Mesh` object of the same shape as `mesh` with closest
             points from this one at respective indices.
         """
-        min_idx = cdist(self.xyz, mesh.xyz).argmin(axis=0)  # lose shape
+        kdtree = self._get_kdtree(self.xyz, len(mesh))
+        min_idx = geodetic.min_distance_idx(
+            self.xyz, mesh.xyz, kdtree)[1]  # lose shape
         if hasattr(mesh, 'shape'):
             min_idx = min_idx.reshape(mesh.shape)
         lons = self.lons.take(min_idx)
@@ -339,8 +368,11 @@ class Mesh(object):
         # depends on mesh spacing. but the difference can be neglected
         # if calculated geodetic distance is over some threshold.
         # get the highest slice from the 3D mesh
+        xyz = geo_utils.spherical_to_cartesian(
+            self.lons.flatten(), self.lats.flatten())
+        kdtree = self._get_kdtree(xyz, len(mesh), '2d')
         distances = geodetic.min_geodetic_distance(
-            (self.lons, self.lats), (mesh.lons, mesh.lats))
+            xyz, (mesh.lons, mesh.lats), kdtree)
         # here we find the points for which calculated mesh-to-mesh
         # distance is below a threshold. this threshold is arbitrary:
         # lower values increase the maximum possible error, higher
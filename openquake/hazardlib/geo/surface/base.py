@@ -123,6 +123,18 @@ class BaseSurface:
     def __init__(self, mesh=None):
         self.mesh = mesh
 
+    def __getstate__(self):
+        # the cached finite mesh (and its KD-tree) is not pickled
+        return {k: v for k, v in vars(self).items() if k != '_fmesh'}
+
+    def _get_fmesh(self):
+        # the finite part of the mesh, cached so that its KD-tree is
+        # built only once per surface
+        cache = self.__dict__.get('_fmesh')
+        if cache is None or cache[0] is not self.mesh:
+            cache = self._fmesh = (self.mesh, _get_finite_mesh(self.mesh))
+        return cache[1]
+
     def get_min_distance(self, mesh):
         """
         Compute and return the minimum distance from the surface to each point
@@ -134,7 +146,7 @@ class BaseSurface:
         :returns:
             A numpy array of distances in km.
         """
-        fmesh = _get_finite_mesh(self.mesh)
+        fmesh = self._get_fmesh()
         return fmesh.get_min_distance(mesh)
 
     def get_closest_points(self, mesh):
@@ -148,7 +160,7 @@ class BaseSurface:
             :class:`~openquake.hazardlib.geo.mesh.Mesh` of the same shape as
             ``mesh`` with closest surface's points on respective indices.
         """
-        fmesh = _get_finite_mesh(self.mesh)
+        fmesh = self._get_fmesh()
         return fmesh.get_closest_points(mesh)
 
     def get_joyner_boore_distance(self, mesh):
@@ -163,7 +175,7 @@ class BaseSurface:
             Numpy array of closest distances between the projections of surface
             and each point of the ``mesh`` to the earth surface.
         """
-        fmesh = _get_finite_mesh(self.mesh)
+        fmesh = self._get_fmesh()
         return fmesh.get_joyner_boore_distance(mesh)
 
     def get_ry0_distance(self, mesh):
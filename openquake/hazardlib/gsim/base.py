@@ -32,7 +32,8 @@ from scipy.stats import norm
 from openquake.baselib.general import DeprecationWarning
 from openquake.hazardlib import imt as imt_module
 from openquake.hazardlib import const
-from openquake.hazardlib.contexts import KNOWN_DISTANCES
+from openquake.hazardlib.contexts import (
+    KNOWN_DISTANCES, stack_ctxs, split_ctxs)
 from openquake.hazardlib.contexts import *  # for backward compatibility
 
 
@@ -85,22 +86,39 @@ def gsim_imt_dt(sorted_gsims, sorted_imts):
 
 
 # this is the critical function for the performance of the classical calculator
-# it is dominated by memory allocations (i.e. _truncnorm_sf is ultra-fast)
-# the only way to speedup is to reduce the maximum_distance, then the array
+# it used to be dominated by memory allocations, so now it writes directly
+# into a preallocated array, broadcasting the levels of each IMT over
+# the sites and computing the survival function in-place; the only way to
+# speedup further is to reduce the maximum_distance, then the array
 # will become shorter in the N dimension (number of affected sites), or to
-# collapse the ruptures, then _get_poes will be called less times
-def _get_poes(mean_std, loglevels, truncation_level):
+# collapse the ruptures, then _set_poes will be called less times
+def _set_poes(mean_std, loglevels, truncation_level, out):
+    # out is an array of shape (N, L), possibly a non-contiguous view
     mean, stddev = mean_std  # shape (N, M) each
-    out = numpy.zeros((len(mean), loglevels.size))  # shape (N, L)
-    lvl = 0
     for m, imt in enumerate(loglevels):
-        for iml in loglevels[imt]:
-            if truncation_level == 0:  # just compare imls to mean
-                out[:, lvl] = iml <= mean[:, m]
-            else:
-                out[:, lvl] = (iml - mean[:, m]) / stddev[:, m]
-            lvl += 1
-    return _truncnorm_sf(truncation_level, out)
+        slc = loglevels(imt)
+        if truncation_level == 0:  # just compare imls to mean
+            out[:, slc] = loglevels[imt] <= mean[:, m, None]
+        else:
+            arr = out[:, slc]  # a view, so the operations below are in-place
+            numpy.subtract(loglevels[imt], mean[:, m, None], arr)
+            arr /= stddev[:, m, None]
+    if truncation_level is None:
+        numpy.negative(out, out)
+        ndtr(out, out)
+    elif truncation_level:
+        # see _truncnorm_sf for the meaning of this formula
+        phi_b = ndtr(truncation_level)
+        ndtr(out, out)
+        out -= phi_b
+        out /= 1. - phi_b * 2  # that is -z
+        numpy.clip(out, 0., 1., out)
+    return out
+
+
+def _get_poes(mean_std, loglevels, truncation_level):
+    out = numpy.empty((len(mean_std[0]), loglevels.size))  # shape (N, L)
+    return _set_poes(mean_std, loglevels, truncation_level, out)
 
 
 def _get_poes_site(mean_std, loglevels, truncation_level, ampfun, ctxs):
@@ -313,6 +331,14 @@ class GroundShakingIntensityModel(metaclass=MetaGSIM):
     #: object attributes with same names. Values are in kilometers.
     REQUIRES_DISTANCES = abc.abstractproperty()
 
+    #: If True, :meth:`GMPE.get_mean_std` calls :meth:`GMPE.compute` once
+    #: on a stacked context (see :func:`openquake.hazardlib.contexts.
+    #: stack_ctxs`), i.e. :meth:`get_mean_and_stddevs` must accept arrays
+    #: of rupture parameters; otherwise it is called once per context and
+    #: IMT. Subclasses of a vectorized GSIM relying on scalar rupture
+    #: parameters must set it to False.
+    vectorized = False
+
     _toml = ''  # set by valid.gsim
     minimum_distance = 0  # set by valid.gsim
     superseded_by = None
@@ -546,8 +572,14 @@ class GMPE(GroundShakingIntensityModel):
 
     def get_mean_std(self, ctxs, imts):
         """
+        :param ctxs: a list of contexts or a stacked context
+        :param imts: a list of M intensity measure types
         :returns: an array of shape (2, N, M) with means and stddevs
         """
+        if self.vectorized:
+            return self._get_mean_std_vectorized(ctxs, imts)
+        if isinstance(ctxs, numpy.recarray):
+            ctxs = split_ctxs(ctxs)
         N = sum(len(ctx.sids) for ctx in ctxs)
         M = len(imts)
         arr = numpy.zeros((2, N, M))
@@ -568,7 +600,39 @@ class GMPE(GroundShakingIntensityModel):
             start = stop
         return arr
 
-    def get_poes(self, mean_std, loglevels, trunclevel, af=None, ctxs=()):
+    def compute(self, ctx, imts, mean, sig):
+        """
+        Fill the arrays of shape (M, N) `mean` and `sig` for a stacked
+        context with the total standard deviation, by calling
+        :meth:`get_mean_and_stddevs` once per IMT. Used by
+        :meth:`get_mean_std` for the vectorized GSIMs.
+        """
+        for m, imt in enumerate(imts):
+            mean[m], [sig[m]] = self.get_mean_and_stddevs(
+                ctx, ctx, ctx, imt, [const.StdDev.TOTAL])
+
+    def _get_mean_std_vectorized(self, ctxs, imts):
+        # called by get_mean_std for the vectorized GSIMs
+        if isinstance(ctxs, numpy.recarray):
+            ctx = ctxs
+        else:
+            ctx = stack_ctxs(ctxs, self.REQUIRES_RUPTURE_PARAMETERS,
+                             self.REQUIRES_DISTANCES,
+                             self.REQUIRES_SITES_PARAMETERS)
+        if self.minimum_distance:
+            ctx = ctx.copy()  # the stacked context can be shared
+            for par in self.REQUIRES_DISTANCES:
+                numpy.maximum(ctx[par], self.minimum_distance, ctx[par])
+        arr = numpy.zeros((2, len(imts), len(ctx)))
+        num_tables = CoeffsTable.num_instances
+        self.compute(ctx, imts, arr[0], arr[1])
+        if CoeffsTable.num_instances > num_tables:
+            raise RuntimeError('Instantiating CoeffsTable inside '
+                               '%s.compute' % self.__class__.__name__)
+        return arr.transpose(0, 2, 1)  # shape (2, N, M)
+
+    def get_poes(self, mean_std, loglevels, trunclevel, af=None, ctxs=(),
+                 out=None):
         """
         Calculate and return probabilities of exceedance (PoEs) of one or more
         intensity measure levels (IMLs) of one intensity measure type (IMT)
@@ -602,6 +666,8 @@ class GMPE(GroundShakingIntensityModel):
             None or an instance of AmplFunction
         :param ctxs:
             Context object used to compute mean_std
+        :param out:
+            if given, a preallocated array of shape (N, L) to fill
         :returns:
             array of PoEs of shape (N, L)
         :raises ValueError:
@@ -632,8 +698,13 @@ class GMPE(GroundShakingIntensityModel):
                 arr += w * _get_poes(mean_stdi, loglevels, trunclevel)
         elif af:  # kernel amplification function
             arr = _get_poes_site(mean_std, loglevels, trunclevel, af, ctxs)
+        elif out is not None:  # regular case, no allocations
+            arr = _set_poes(mean_std, loglevels, trunclevel, out)
         else:  # regular case
             arr = _get_poes(mean_std, loglevels, trunclevel)
+        if out is not None and arr is not out:
+            out[:] = arr
+            arr = out
         imtweight = getattr(self, 'weight', None)  # ImtWeight or None
         for imt in loglevels:
             if imtweight and imtweight.dic.get(imt) == 0:
@@ -21,6 +21,9 @@ class SInterCan15Mid(ZhaoEtAl2006SInter):
     the 2015 version of the Canada national hazard model developed by NRCan.
     """
 
+    #: the overridden terms work on a scalar magnitude
+    vectorized = False
+
     #: Supported tectonic region type is subduction interface
     DEFINED_FOR_TECTONIC_REGION_TYPE = const.TRT.SUBDUCTION_INTERFACE
 
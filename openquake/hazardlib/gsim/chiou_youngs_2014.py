@@ -40,6 +40,9 @@ class ChiouYoungs2014(GMPE):
     DOI: 10.1193/072813EQS219M
 
     """
+    #: get_mean_and_stddevs works on stacked contexts
+    vectorized = True
+
     #: Supported tectonic region type is active shallow crust
     DEFINED_FOR_TECTONIC_REGION_TYPE = const.TRT.ACTIVE_SHALLOW_CRUST
 
@@ -141,7 +144,7 @@ class ChiouYoungs2014(GMPE):
         Returns the between-event variability described in equation 13, line 2
         """
         # eq. 13 to calculate inter-event standard error
-        mag_test = min(max(mag, 5.0), 6.5) - 5.0
+        mag_test = np.clip(mag, 5.0, 6.5) - 5.0
         return C['tau1'] + ((C['tau2'] - C['tau1']) / 1.5) * mag_test
 
     def get_phi(self, C, mag, sites, nl0):
@@ -152,7 +155,7 @@ class ChiouYoungs2014(GMPE):
         phi[sites.vs30measured] = 0.7
         phi = np.sqrt(phi + ((1.0 + nl0) ** 2.))
         mdep = C["sig1"] + (((C["sig2"] - C["sig1"]) / 1.5) *
-                            (min(max(mag, 5.0), 6.5) - 5.0))
+                            (np.clip(mag, 5.0, 6.5) - 5.0))
         return mdep * phi
 
     def get_stress_scaling(self, C):
@@ -176,7 +179,7 @@ class ChiouYoungs2014(GMPE):
         """
         # Get the near-field magnitude scaling
         return self.CONSTANTS["c4"] * np.log(
-            rrup + C["c5"] * np.cosh(C["c6"] * max(mag - C["chm"], 0.0)))
+            rrup + C["c5"] * np.cosh(C["c6"] * np.maximum(mag - C["chm"], 0.)))
 
     def get_far_field_distance_scaling(self, C, mag, rrup):
         """
@@ -187,7 +190,7 @@ class ChiouYoungs2014(GMPE):
         f_r = (self.CONSTANTS["c4a"] - self.CONSTANTS["c4"]) * np.log(
             np.sqrt(rrup ** 2. + self.CONSTANTS["crb"] ** 2.))
         # Get the magnitude dependent term
-        f_rm = C["cg1"] + (C["cg2"] / np.cosh(max(mag - C["cg3"], 0.0)))
+        f_rm = C["cg1"] + (C["cg2"] / np.cosh(np.maximum(mag - C["cg3"], 0.)))
         return f_r + f_rm * rrup
 
     def get_source_scaling_terms(self, C, rup, delta_ztor):
@@ -195,15 +198,12 @@ class ChiouYoungs2014(GMPE):
         Returns additional source scaling parameters related to style of
         faulting, dip and top of rupture depth
         """
-        f_src = 0.0
-        coshm = np.cosh(2.0 * max(rup.mag - 4.5, 0.0))
+        coshm = np.cosh(2.0 * np.maximum(rup.mag - 4.5, 0.0))
         # Style of faulting term
-        if 30 <= rup.rake <= 150:
-            # reverse faulting flag
-            f_src += (C["c1a"] + (C["c1c"] / coshm))
-        elif -120 <= rup.rake <= -60:
-            # normal faulting flag
-            f_src += (C["c1b"] + (C["c1d"] / coshm))
+        reverse = (30 <= rup.rake) & (rup.rake <= 150)
+        normal = (-120 <= rup.rake) & (rup.rake <= -60)
+        f_src = np.where(reverse, C["c1a"] + (C["c1c"] / coshm),
+                         np.where(normal, C["c1b"] + (C["c1d"] / coshm), 0.))
         # Top of rupture term
         f_src += ((C["c7"] + (C["c7b"] / coshm)) * delta_ztor)
         # Dip term
@@ -215,15 +215,11 @@ class ChiouYoungs2014(GMPE):
         """
         Returns the hanging wall term
         """
-        fhw = np.zeros(dists.rrup.shape)
-        idx = dists.rx >= 0.0
-        if np.any(idx):
-            fdist = 1.0 - (np.sqrt(dists.rjb[idx] ** 2. + rup.ztor ** 2.) /
-                           (dists.rrup[idx] + 1.0))
-            fdist *= (C["c9a"] + (1.0 - C["c9a"]) * np.tanh(dists.rx[idx] /
-                                                            C["c9b"]))
-            fhw[idx] += (C["c9"] * np.cos(np.radians(rup.dip)) * fdist)
-        return fhw
+        fdist = 1.0 - (np.sqrt(dists.rjb ** 2. + rup.ztor ** 2.) /
+                       (dists.rrup + 1.0))
+        fdist *= (C["c9a"] + (1.0 - C["c9a"]) * np.tanh(dists.rx / C["c9b"]))
+        return np.where(dists.rx >= 0.0,
+                        C["c9"] * np.cos(np.radians(rup.dip)) * fdist, 0.)
 
     def get_directivity(self, C, rup, dists):
         """
@@ -239,7 +235,7 @@ class ChiouYoungs2014(GMPE):
             # No directivity term
             return 0.0
         f_dir = np.exp(-C["c8a"] * ((rup.mag - C["c8b"]) ** 2.)) * cdpp
-        f_dir *= min((max(rup.mag - 5.5, 0.0) / 0.8), 1.)
+        f_dir *= np.clip((rup.mag - 5.5) / 0.8, 0., 1.)
         rrup_max = dists.rrup - 40.
         rrup_max[rrup_max < 0.0] = 0.0
         rrup_max = 1.0 - (rrup_max / 30.)
@@ -286,13 +282,14 @@ class ChiouYoungs2014(GMPE):
         Get ztor centered on the M- dependent avarage ztor(km)
         by different fault types.
         """
-        if 30 <= rup.rake <= 150:
-            # Reverse and reverse-oblique faulting
-            mean_ztor = max(2.704 - 1.226 * max(rup.mag - 5.849, 0.0), 0.) ** 2
-        else:
-            # Strike-slip and normal faulting
-            mean_ztor = max(2.673 - 1.136 * max(rup.mag - 4.970, 0.0), 0.) ** 2
-        return rup.ztor - mean_ztor
+        # Reverse and reverse-oblique faulting
+        rev_ztor = np.maximum(
+            2.704 - 1.226 * np.maximum(rup.mag - 5.849, 0.0), 0.) ** 2
+        # Strike-slip and normal faulting
+        oth_ztor = np.maximum(
+            2.673 - 1.136 * np.maximum(rup.mag - 4.970, 0.0), 0.) ** 2
+        reverse = (30 <= rup.rake) & (rup.rake <= 150)
+        return rup.ztor - np.where(reverse, rev_ztor, oth_ztor)
 
     def _get_centered_cdpp(self, dists):
         """
@@ -343,6 +340,9 @@ class ChiouYoungs2014Japan(ChiouYoungs2014):
     Japan far-field distance attuation scaling and site model
     """
 
+    #: the overridden terms work on a scalar magnitude
+    vectorized = False
+
     def get_far_field_distance_scaling(self, C, mag, rrup):
         """
         Returns the far-field distance scaling term - both magnitude and
@@ -388,6 +388,9 @@ class ChiouYoungs2014Italy(ChiouYoungs2014):
     Adaption of the Chiou & Youngs (2014) GMPE for the the Italy far-field
     attenuation scaling, but assuming the California site amplification model
     """
+    #: the overridden terms work on a scalar magnitude
+    vectorized = False
+
     def get_far_field_distance_scaling(self, C, mag, rrup):
         """
         Returns the far-field distance scaling term - both magnitude and
@@ -414,6 +417,9 @@ class ChiouYoungs2014Wenchuan(ChiouYoungs2014):
     is calibrated only for the M7.9 Wenchuan earthquake, so application to
     other scenarios is at the user's own risk
     """
+    #: the overridden terms work on a scalar magnitude
+    vectorized = False
+
     def get_far_field_distance_scaling(self, C, mag, rrup):
         """
         Returns the far-field distance scaling term - both magnitude and
@@ -123,11 +123,15 @@ class AvgPoeGMPE(GMPE):
         return res
 
     def get_poes(self, mean_std, loglevels, trunclevel,
-                 af=None, ctxs=()):
+                 af=None, ctxs=(), out=None):
         """
         :returns: an array of shape (N, L)
         """
         poes = [gsim.get_poes(
             mean_std[:, :, :, g], loglevels, trunclevel, af, ctxs)
                 for g, gsim in enumerate(self.gsims)]
-        return numpy.average(poes, 0, self.weights)
+        avg = numpy.average(poes, 0, self.weights)
+        if out is None:
+            return avg
+        out[:] = avg
+        return out
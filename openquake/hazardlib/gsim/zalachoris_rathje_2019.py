@@ -37,6 +37,9 @@ class ZalachorisRathje2019(BooreEtAl2014):
     distances between 4 and 500km. PGA, PGV, SA(0-10s)
     version: Apr 28, 2020. Verified with margin 1%
     """
+    #: the overridden terms work on a scalar magnitude
+    vectorized = False
+
     #: The GMPE is derived from induced earthquakes
     DEFINED_FOR_TECTONIC_REGION_TYPE = const.TRT.INDUCED
 
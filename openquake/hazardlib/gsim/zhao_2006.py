@@ -40,6 +40,9 @@ class ZhaoEtAl2006Asc(GMPE):
     This class implements the equations for 'Active Shallow Crust'
     (that's why the class name ends with 'Asc').
     """
+    #: get_mean_and_stddevs works on stacked contexts
+    vectorized = True
+
     #: Supported tectonic region type is active shallow crust, this means
     #: that factors SI, SS and SSL are assumed 0 in equation 1, p. 901.
     DEFINED_FOR_TECTONIC_REGION_TYPE = const.TRT.ACTIVE_SHALLOW_CRUST
@@ -146,9 +149,7 @@ class ZhaoEtAl2006Asc(GMPE):
         Compute fourth term in equation 1, p. 901.
         """
         # p. 901. "(i.e, depth is capped at 125 km)".
-        focal_depth = hypo_depth
-        if focal_depth > 125.0:
-            focal_depth = 125.0
+        focal_depth = np.minimum(hypo_depth, 125.0)
 
         # p. 902. "We used the value of 15 km for the
         # depth coefficient hc ...".
@@ -156,7 +157,7 @@ class ZhaoEtAl2006Asc(GMPE):
 
         # p. 901. "When h is larger than hc, the depth terms takes
         # effect ...". The next sentence specifies h>=hc.
-        return float(focal_depth >= hc) * C['e'] * (focal_depth - hc)
+        return (focal_depth >= hc) * C['e'] * (focal_depth - hc)
 
     def _compute_faulting_style_term(self, C, rake):
         """
@@ -165,7 +166,7 @@ class ZhaoEtAl2006Asc(GMPE):
         # p. 900. "The differentiation in focal mechanism was
         # based on a rake angle criterion, with a rake of +/- 45
         # as demarcation between dip-slip and strike-slip."
-        return float(rake > 45.0 and rake < 135.0) * C['FR']
+        return ((rake > 45.0) & (rake < 135.0)) * C['FR']
 
     def _compute_site_class_term(self, C, vs30):
         """
@@ -468,6 +469,9 @@ class ZhaoEtAl2006SSlabNSHMP2014(ZhaoEtAl2006SSlab):
     For the 2014 US National Seismic Hazard Maps the magnitude of Zhao et al.
     (2006) for the subduction inslab events is capped at magnitude Mw 7.8
     """
+    #: the overridden terms work on a scalar magnitude
+    vectorized = False
+
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
         See :meth:`superclass method
@@ -60,6 +60,9 @@ class ZhaoEtAl2006AscSWISS05(ZhaoEtAl2006Asc):
     Model implemented by laurentiu.danciu@gmail.com
     """
 
+    #: the overridden terms work on a scalar magnitude
+    vectorized = False
+
     # Supported standard deviation type is only total, but reported as a
     # combination of mean and magnitude/distance single station sigma
     DEFINED_FOR_STANDARD_DEVIATION_TYPES = set([const.StdDev.TOTAL])
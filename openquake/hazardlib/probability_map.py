@@ -15,9 +15,11 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
-from openquake.baselib.python3compat import zip
+from collections.abc import Mapping
 import numpy
 
+U32 = numpy.uint32
+I32 = numpy.int32
 F32 = numpy.float32
 F64 = numpy.float64
 BYTES_PER_FLOAT = 8
@@ -29,6 +31,19 @@ class AllEmptyProbabilityMaps(ValueError):
     """
 
 
+def _reduceat(ufunc, sids, array):
+    # reduce the rows of the array with the same site ID; this is much
+    # faster than ufunc.at, which is unbuffered
+    sids = numpy.asarray(sids, U32)
+    order = numpy.argsort(sids, kind='stable')
+    ssids = sids[order]
+    start = numpy.concatenate([[0], numpy.where(
+        ssids[1:] != ssids[:-1])[0] + 1])
+    if len(start) >= len(sids):  # the sids are distinct
+        return sids, array
+    return ssids[start], ufunc.reduceat(array[order], start)
+
+
 class ProbabilityCurve(object):
     """
     This class is a small wrapper over an array of PoEs associated to
@@ -106,9 +121,10 @@ class ProbabilityCurve(object):
         return curve[0]
 
 
-class ProbabilityMap(dict):
+class ProbabilityMap(Mapping):
     """
-    A dictionary site_id -> ProbabilityCurve. It defines the complement
+    A mapping site_id -> ProbabilityCurve backed by a single array of
+    shape (N, L, I) plus a site index. It defines the complement
     operator `~`, performing the complement on each curve
 
     ~p = 1 - p
@@ -118,11 +134,14 @@ class ProbabilityMap(dict):
     m = m1 | m2 = {sid: m1[sid] | m2[sid] for sid in all_sids}
 
     Such operators are implemented efficiently at the numpy level, by
-    dispatching on the underlying array. Moreover there is a classmethod
+    working on the underlying array. Moreover there is a classmethod
     .build(L, I, sids, initvalue) to build initialized instances of
     :class:`ProbabilityMap`. The map can be represented as 3D array of shape
     (shape_x, shape_y, shape_z) = (N, L, I), where N is the number of site IDs,
     L the total number of hazard levels and I the number of GSIMs.
+
+    NB: the curves returned by `pmap[sid]` are views over the underlying
+    array, valid until new sites are added to the map.
     """
     @classmethod
     def build(cls, shape_y, shape_z, sids, initvalue=0., dtype=F64):
@@ -134,8 +153,7 @@ class ProbabilityMap(dict):
         :returns: a ProbabilityMap dictionary
         """
         dic = cls(shape_y, shape_z)
-        for sid in sids:
-            dic.setdefault(sid, initvalue, dtype)
+        dic._add(list(sids), initvalue, dtype)
         return dic
 
     @classmethod
@@ -152,13 +170,97 @@ class ProbabilityMap(dict):
         if len(array.shape) == 2:  # shape (N, L) -> (N, L, 1)
             array = array.reshape(array.shape + (1,))
         self = cls(*array.shape[1:])
-        for sid, poes in zip(sids, array):
-            self[sid] = ProbabilityCurve(poes)
+        self._set(sids, numpy.array(array))
         return self
 
     def __init__(self, shape_y, shape_z=1):
         self.shape_y = shape_y
         self.shape_z = shape_z
+        self._n = 0  # number of sites stored
+        self._sids = numpy.zeros(0, U32)  # row -> site ID
+        self._sidx = numpy.zeros(0, I32)  # site ID -> row or -1
+        self._array = None  # allocated at the first insertion
+
+    def _get_idx(self, sids):
+        # the rows associated to the given site IDs (-1 if missing)
+        sids = numpy.asarray(sids, U32)
+        idx = numpy.full(len(sids), -1, I32)
+        ok = sids < len(self._sidx)
+        idx[ok] = self._sidx[sids[ok]]
+        return idx
+
+    def _add(self, sids, value, dtype=F64):
+        # returns the rows associated to the given site IDs, adding rows
+        # filled with the given value for the missing sites
+        sids = numpy.asarray(sids, U32)
+        idx = self._get_idx(sids)
+        missing = sids[idx < 0]
+        # remove duplicates, preserving the insertion order
+        missing = missing[numpy.sort(numpy.unique(
+            missing, return_index=True)[1])]
+        k = len(missing)
+        if k == 0:
+            return idx
+        n = self._n
+        if self._array is None:
+            self._array = numpy.empty(
+                (k, self.shape_y, self.shape_z), dtype)
+            self._sids = numpy.empty(k, U32)
+        elif n + k > len(self._array):  # grow the arrays
+            size = max(n + k, 2 * len(self._array))
+            array = numpy.empty((size,) + self._array.shape[1:],
+                                self._array.dtype)
+            array[:n] = self._array[:n]
+            self._array = array
+            sids_ = numpy.empty(size, U32)
+            sids_[:n] = self._sids[:n]
+            self._sids = sids_
+        maxsid = missing.max() + 1
+        if maxsid > len(self._sidx):
+            sidx = numpy.full(max(maxsid, 2 * len(self._sidx)), -1, I32)
+            sidx[:len(self._sidx)] = self._sidx
+            self._sidx = sidx
+        self._array[n:n + k] = value
+        self._sids[n:n + k] = missing
+        self._sidx[missing] = numpy.arange(n, n + k)
+        self._n = n + k
+        return self._sidx[sids]
+
+    def _set(self, sids, array):
+        # set the curves for the given site IDs
+        idx = self._add(sids, 0., array.dtype)
+        self._array[idx] = array
+
+    def _items(self):
+        # site IDs and curves as arrays of shape (N,) and (N, L, I)
+        if self._n == 0:
+            return (numpy.zeros(0, U32),
+                    numpy.zeros((0, self.shape_y, self.shape_z)))
+        return self._sids[:self._n], self._array[:self._n]
+
+    def __getitem__(self, sid):
+        if sid in self:
+            return ProbabilityCurve(self._array[self._sidx[sid]])
+        raise KeyError(sid)
+
+    def __setitem__(self, sid, pcurve):
+        array = pcurve.array
+        if len(array.shape) == 1:  # shape L -> (L, 1)
+            array = array.reshape(-1, 1)
+        self._set([sid], array[None])
+
+    def __contains__(self, sid):
+        return 0 <= sid < len(self._sidx) and self._sidx[sid] >= 0
+
+    def __iter__(self):
+        return iter(self._sids[:self._n].tolist())
+
+    def __len__(self):
+        return self._n
+
+    def __repr__(self):
+        return '<%s %d sites, shape_y=%d, shape_z=%d>' % (
+            self.__class__.__name__, self._n, self.shape_y, self.shape_z)
 
     def setdefault(self, sid, value, dtype=F64):
         """
@@ -169,27 +271,66 @@ class ProbabilityMap(dict):
         :param value: value used to fill the returned ProbabilityCurve
         :param dtype: dtype used internally (F32 or F64)
         """
-        try:
-            return self[sid]
-        except KeyError:
-            array = numpy.empty((self.shape_y, self.shape_z), dtype)
-            array.fill(value)
-            pc = ProbabilityCurve(array)
-            self[sid] = pc
-            return pc
+        [i] = self._add([sid], value, dtype)
+        return ProbabilityCurve(self._array[i])
+
+    def update(self, other):
+        """
+        Set the curves of the given ProbabilityMap or dictionary
+        """
+        if isinstance(other, ProbabilityMap):
+            if other:
+                self._set(*other._items())
+        else:
+            for sid in other:
+                self[sid] = other[sid]
+
+    def multiply_at(self, sids, array):
+        """
+        Multiply in place the curves of the given site IDs, with missing
+        sites starting from 1; it is the scatter operation composing the
+        probabilities of no exceedence of independent ruptures.
+
+        :param sids: an array of N site IDs, possibly repeated
+        :param array: an array of shape (N, L, I)
+        """
+        sids, array = _reduceat(numpy.multiply, sids, array)
+        idx = self._add(sids, 1.)
+        self._array[idx] *= array
+
+    def add_at(self, sids, array):
+        """
+        Add in place to the curves of the given site IDs, with missing
+        sites starting from 0; it is the scatter operation composing
+        mutually exclusive probabilities.
+
+        :param sids: an array of N site IDs, possibly repeated
+        :param array: an array of shape (N, L, I)
+        """
+        sids, array = _reduceat(numpy.add, sids, array)
+        idx = self._add(sids, 0.)
+        self._array[idx] += array
+
+    def copy(self):
+        """
+        :returns: a copy of the map, not sharing memory with the original
+        """
+        new = self.__class__(self.shape_y, self.shape_z)
+        new.update(self)
+        return new
 
     @property
     def sids(self):
         """The ordered keys of the map as a numpy.uint32 array"""
-        return numpy.array(sorted(self), numpy.uint32)
+        return numpy.sort(self._sids[:self._n])
 
     def array(self, N):
         """
         An array of shape (N, L, I)
         """
         arr = numpy.zeros((N, self.shape_y, self.shape_z))
-        for sid in self:
-            arr[sid] = self[sid].array
+        sids, array = self._items()
+        arr[sids] = array
         return arr
 
     @property
@@ -215,10 +356,9 @@ class ProbabilityMap(dict):
             index on the z-axis (default 0)
         """
         curves = numpy.zeros(nsites, imtls.dt)
+        sids, array = self._items()
         for imt in curves.dtype.names:
-            curves_by_imt = curves[imt]
-            for sid in self:
-                curves_by_imt[sid] = self[sid].array[imtls(imt), idx]
+            curves[imt][sids] = array[:, imtls(imt), idx]
         return curves
 
     def filter(self, sids):
@@ -226,11 +366,11 @@ class ProbabilityMap(dict):
         Extracs a submap of self for the given sids.
         """
         dic = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            try:
-                dic[sid] = self[sid]
-            except KeyError:
-                pass
+        sids = numpy.array(list(sids), U32)
+        idx = self._get_idx(sids)
+        ok = idx >= 0
+        if ok.any():
+            dic._set(sids[ok], self._array[idx[ok]])
         return dic
 
     def extract(self, inner_idx):
@@ -239,10 +379,9 @@ class ProbabilityMap(dict):
         specified by the index `inner_idx`.
         """
         out = self.__class__(self.shape_y, 1)
-        for sid in self:
-            curve = self[sid]
-            array = curve.array[:, inner_idx].reshape(-1, 1)
-            out[sid] = ProbabilityCurve(array)
+        if self:
+            sids, array = self._items()
+            out._set(sids, array[:, :, [inner_idx]])
         return out
 
     def __ior__(self, other):
@@ -251,79 +390,73 @@ class ProbabilityMap(dict):
         if (other.shape_y, other.shape_z) != (self.shape_y, self.shape_z):
             raise ValueError('%s has inconsistent shape with %s' %
                              (other, self))
-        self_sids = set(self)
-        other_sids = set(other)
-        for sid in self_sids & other_sids:
-            self[sid] = self[sid] | other[sid]
-        for sid in other_sids - self_sids:
-            self[sid] = other[sid]
+        sids, array = other._items()
+        old = self._get_idx(sids) >= 0
+        idx = self._add(sids, 0., array.dtype)
+        i = idx[old]
+        self._array[i] = 1. - (1. - self._array[i]) * (1. - array[old])
+        self._array[idx[~old]] = array[~old]
         return self
 
     def __or__(self, other):
-        new = self.__class__(self.shape_y, self.shape_z)
-        new.update(self)
+        new = self.copy()
         new |= other
         return new
 
     __ror__ = __or__
 
     def __add__(self, other):
-        try:
-            other.get
-            is_pmap = True
-            sids = set(self) | set(other)
-        except AttributeError:  # no .get method, assume a float
-            is_pmap = False
-            assert 0. <= other <= 1., other  # must be a probability
-            sids = set(self)
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            prob = other.get(sid, 1) if is_pmap else other
-            new[sid] = self.get(sid, 1) + prob
+        new = self.copy()
+        new += other
         return new
 
     def __iadd__(self, other):
         # this is used when composing mutually exclusive probabilities
-        for sid in other:
-            pcurve = self.setdefault(sid, 0)
-            pcurve += other[sid]
+        if other:
+            self.add_at(*other._items())
         return self
 
     def __mul__(self, other):
-        try:
-            other.get
-            is_pmap = True
-            sids = set(self) | set(other)
-        except AttributeError:  # no .get method, assume a float
-            is_pmap = False
+        new = self.copy()
+        if isinstance(other, ProbabilityMap):
+            if other:
+                new.multiply_at(*other._items())
+        else:  # assume a float
             assert 0. <= other <= 1., other  # must be a probability
-            sids = set(self)
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            prob = other.get(sid, 1) if is_pmap else other
-            new[sid] = self.get(sid, 1) * prob
+            if new:
+                new._array[:new._n] *= other
         return new
 
     def __ipow__(self, n):
-        for sid, pcurve in self.items():
-            self[sid] = pcurve ** n
+        if self:
+            self._array[:self._n] **= n
         return self
 
     def __pow__(self, n):
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid, pcurve in self.items():
-            new[sid] = pcurve ** n
+        new = self.copy()
+        new **= n
         return new
 
     def __invert__(self):
         new = self.__class__(self.shape_y, self.shape_z)
-        for sid in self:
-            if (self[sid].array != 1.).any():
-                new[sid] = ~self[sid]  # store only nonzero probabilities
+        if not self:
+            return new
+        sids, array = self._items()
+        # store only nonzero probabilities
+        ok = (array != 1.).reshape(len(sids), -1).any(axis=1)
+        if ok.any():
+            new._set(sids[ok], 1. - array[ok])
         return new
 
     def __getstate__(self):
-        return dict(shape_y=self.shape_y, shape_z=self.shape_z)
+        sids, array = self._items()
+        return dict(shape_y=self.shape_y, shape_z=self.shape_z,
+                    sids=sids, array=array)
+
+    def __setstate__(self, state):
+        self.__init__(state['shape_y'], state['shape_z'])
+        if len(state['sids']):
+            self._set(state['sids'], state['array'])
 
 
 def get_shape(pmaps):
@@ -288,6 +288,22 @@ class SiteCollection(object):
         new.complete = self.complete
         return new
 
+    def shared(self, shared_array):
+        """
+        :param shared_array:
+            a :class:`openquake.baselib.parallel.SharedArray` with the
+            same content of the underlying array
+        :returns:
+            a complete SiteCollection pickled as a handle to the shared
+            memory, so that the workers can attach it without copying
+        """
+        assert self.complete is self, 'Not a complete site collection'
+        new = object.__new__(self.__class__)
+        new.array = self.array
+        new.complete = new
+        new._shared = shared_array
+        return new
+
     def reduce(self, nsites):
         """
         :returns: a filtered SiteCollection with around nsites (if nsites<=N)
@@ -523,7 +539,17 @@ class SiteCollection(object):
         return len(numpy.unique(self.geohash(length)))
 
     def __getstate__(self):
-        return dict(array=self.array, complete=self.complete)
+        array = self.__dict__.get('_shared', self.array)
+        return dict(array=array, complete=self.complete)
+
+    def __setstate__(self, state):
+        array = state['array']
+        if hasattr(array, 'unlink'):  # SharedArray, attach a read-only view
+            self.array = array.array  # must be released before _shared
+            self._shared = array
+        else:
+            self.array = array
+        self.complete = state['complete']
 
     def __getitem__(self, sid):
         """
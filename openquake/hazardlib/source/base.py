@@ -20,8 +20,6 @@ seismic sources.
 import abc
 import zlib
 import numpy
-from openquake.hazardlib.geo import Point
-from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 
 
 class BaseSeismicSource(metaclass=abc.ABCMeta):
@@ -157,32 +155,11 @@ class BaseSeismicSource(metaclass=abc.ABCMeta):
                 if num_occ:
                     yield rup, num_occ
             return
-        # else (multi)point sources and area sources
-        rup_args = []
-        rates = []
+        # else (multi)point sources and area sources: the rates are
+        # managed as arrays, one point at the time, and only the ruptures
+        # with nonzero occurrences are instantiated
         for src in self:
-            for mag, mag_occ_rate in src.get_annual_occurrence_rates():
-                if mag < self.min_mag:
-                    continue
-                for np_prob, np in src.nodal_plane_distribution.data:
-                    for hc_prob, hc_depth in src.hypocenter_distribution.data:
-                        args = (mag_occ_rate, np_prob, hc_prob,
-                                mag, np, hc_depth, src)
-                        rup_args.append(args)
-                        rates.append(mag_occ_rate * np_prob * hc_prob)
-        eff_rates = numpy.array(rates) * tom.time_span * eff_num_ses
-        occurs = numpy.random.poisson(eff_rates)
-        for num_occ, args, rate in zip(occurs, rup_args, rates):
-            if num_occ:
-                mag_occ_rate, np_prob, hc_prob, mag, np, hc_depth, src = args
-                hc = Point(latitude=src.location.latitude,
-                           longitude=src.location.longitude,
-                           depth=hc_depth)
-                surface, _ = src._get_rupture_surface(mag, np, hc)
-                rup = ParametricProbabilisticRupture(
-                    mag, np.rake, src.tectonic_region_type, hc,
-                    surface, rate, tom)
-                yield rup, num_occ
+            yield from src.sample_point_ruptures(eff_num_ses, self.min_mag)
 
     @abc.abstractmethod
     def get_one_rupture(self, ses_seed, rupture_mutex=False):
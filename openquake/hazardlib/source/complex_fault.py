@@ -174,6 +174,46 @@ class ComplexFaultSource(ParametricSeismicSource):
         sfc = ComplexFaultSurface.from_fault_data(self.edges, 2.0)
         return sfc.get_area()
 
+    def _get_geometry(self):
+        """
+        :returns:
+            a dictionary with the whole fault mesh, the lengths and areas
+            of its cells and the rupture slices computed so far
+
+        The dictionary is built once and then stored in the source, so that
+        it is shared by count_ruptures, iter_ruptures and by the sources
+        generated by splitting; it is also pickled with the source, so
+        that the workers do not need to recompute it.
+        """
+        try:
+            return self._geom
+        except AttributeError:
+            pass
+        mesh = ComplexFaultSurface.from_fault_data(
+            self.edges, self.rupture_mesh_spacing).mesh
+        _, cell_length, _, cell_area = mesh.get_cell_dimensions()
+        self._geom = dict(mesh=mesh, cell_length=cell_length,
+                          cell_area=cell_area, slices={})
+        return self._geom
+
+    def _get_rupture_slices(self, mag):
+        """
+        :param mag: a magnitude
+        :returns: the rupture slices for the given magnitude (cached)
+        """
+        geom = self._get_geometry()
+        rupture_area = self.magnitude_scaling_relationship.get_median_area(
+            mag, self.rake)
+        rupture_length = numpy.sqrt(rupture_area * self.rupture_aspect_ratio)
+        key = rupture_area, rupture_length
+        try:
+            return geom['slices'][key]
+        except KeyError:
+            slices = geom['slices'][key] = _float_ruptures(
+                rupture_area, rupture_length, geom['cell_area'],
+                geom['cell_length'])
+            return slices
+
     def iter_ruptures(self, **kwargs):
         """
         See :meth:
@@ -182,21 +222,12 @@ class ComplexFaultSource(ParametricSeismicSource):
         Uses :func:`_float_ruptures` for finding possible rupture locations
         on the whole fault surface.
         """
-        whole_fault_surface = ComplexFaultSurface.from_fault_data(
-            self.edges, self.rupture_mesh_spacing)
-        whole_fault_mesh = whole_fault_surface.mesh
-        cell_center, cell_length, cell_width, cell_area = (
-            whole_fault_mesh.get_cell_dimensions())
+        whole_fault_mesh = self._get_geometry()['mesh']
         for mag, mag_occ_rate in self.get_annual_occurrence_rates():
             # min_mag is inside get_annual_occurrence_rates
             if mag_occ_rate == 0:
                 continue
-            rupture_area = self.magnitude_scaling_relationship.get_median_area(
-                mag, self.rake)
-            rupture_length = numpy.sqrt(
-                rupture_area * self.rupture_aspect_ratio)
-            rupture_slices = _float_ruptures(
-                rupture_area, rupture_length, cell_area, cell_length)
+            rupture_slices = self._get_rupture_slices(mag)
             occurrence_rate = mag_occ_rate / float(len(rupture_slices))
             for rupture_slice in rupture_slices:
                 mesh = whole_fault_mesh[rupture_slice]
@@ -219,22 +250,11 @@ class ComplexFaultSource(ParametricSeismicSource):
         See :meth:
         `openquake.hazardlib.source.base.BaseSeismicSource.count_ruptures`.
         """
-        whole_fault_surface = ComplexFaultSurface.from_fault_data(
-            self.edges, self.rupture_mesh_spacing)
-        whole_fault_mesh = whole_fault_surface.mesh
-        cell_center, cell_length, cell_width, cell_area = (
-            whole_fault_mesh.get_cell_dimensions())
         self._nr = []
         for (mag, mag_occ_rate) in self.get_annual_occurrence_rates():
             if mag_occ_rate == 0:
                 continue
-            rupture_area = self.magnitude_scaling_relationship.get_median_area(
-                mag, self.rake)
-            rupture_length = numpy.sqrt(
-                rupture_area * self.rupture_aspect_ratio)
-            rupture_slices = _float_ruptures(
-                rupture_area, rupture_length, cell_area, cell_length)
-            self._nr.append(len(rupture_slices))
+            self._nr.append(len(self._get_rupture_slices(mag)))
         return sum(self._nr)
 
     def modify_set_geometry(self, edges, spacing):
@@ -244,6 +264,7 @@ class ComplexFaultSource(ParametricSeismicSource):
         ComplexFaultSurface.check_fault_data(edges, spacing)
         self.edges = edges
         self.rupture_mesh_spacing = spacing
+        vars(self).pop('_geom', None)  # invalidate the geometry cache
 
     def __iter__(self):
         mag_rates = self.get_annual_occurrence_rates()
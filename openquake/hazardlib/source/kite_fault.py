@@ -90,12 +90,19 @@ class KiteFaultSource(ParametricSeismicSource):
         :returns:
             The surface of the fault
         """
-        # Get the surface of the fault
+        # Get the surface of the fault; it is built once and then stored
+        # in the source (and in its splits)
+        try:
+            return self._geom['surface']
+        except AttributeError:
+            pass
         # TODO we must automate the definition of the idl parameter
-        return KiteSurface.from_profiles(self.profiles,
-                                         self.profiles_sampling,
-                                         self.rupture_mesh_spacing,
-                                         idl=False, align=False)
+        surface = KiteSurface.from_profiles(self.profiles,
+                                            self.profiles_sampling,
+                                            self.rupture_mesh_spacing,
+                                            idl=False, align=False)
+        self._geom = dict(surface=surface)
+        return surface
 
     def count_ruptures(self) -> int:
         """
@@ -81,6 +81,157 @@ def msr_name(src):
         return 'Undefined'
 
 
+#: cache of rupture templates, see :func:`get_rupture_template`
+_templates = {}
+
+#: maximum number of templates kept in the cache
+MAX_TEMPLATES = 100_000
+
+
+def get_rupture_template(src, mag, nodal_plane, hc_depth):
+    """
+    Compute the geometry of a planar rupture relative to its hypocenter.
+    The geometry depends only on the magnitude, the nodal plane, the
+    hypocenter depth, the MSR, the aspect ratio and the seismogenic depths,
+    so the templates are cached and shared by all the point sources with
+    the same parameters, for instance the points of an area source.
+
+    :param src:
+        a PointSource, AreaSource or MultiPointSource
+    :param mag:
+        a magnitude
+    :param nodal_plane:
+        a :class:`openquake.hazardlib.geo.nodalplane.NodalPlane`
+    :param hc_depth:
+        the depth of the hypocenter
+    :returns:
+        a read-only array of shape (5, 3) with the moves (azimuth,
+        horizontal distance, vertical increment) from the hypocenter to the
+        rupture center and from the rupture center to the corners
+        tl, tr, bl, br
+    """
+    key = (mag, nodal_plane.strike, nodal_plane.dip, nodal_plane.rake,
+           hc_depth, type(src.magnitude_scaling_relationship),
+           src.rupture_aspect_ratio, src.upper_seismogenic_depth,
+           src.lower_seismogenic_depth)
+    try:
+        tmpl = _templates.pop(key)  # to be reinserted as last
+    except KeyError:
+        pass
+    else:
+        _templates[key] = tmpl
+        return tmpl
+    eps = .001  # 1 meter buffer to survive numerical errors
+    assert src.upper_seismogenic_depth < hc_depth + eps, (
+        src.upper_seismogenic_depth, hc_depth)
+    assert src.lower_seismogenic_depth + eps > hc_depth, (
+        src.lower_seismogenic_depth, hc_depth)
+    rdip = math.radians(nodal_plane.dip)
+
+    # precalculated azimuth values for horizontal-only and vertical-only
+    # moves from one point to another on the plane defined by strike
+    # and dip:
+    azimuth_right = nodal_plane.strike
+    azimuth_down = (azimuth_right + 90) % 360
+    azimuth_left = (azimuth_down + 90) % 360
+    azimuth_up = (azimuth_left + 90) % 360
+
+    rup_length, rup_width = _get_rupture_dimensions(
+        src, mag, nodal_plane.rake, nodal_plane.dip)
+    # calculate the height of the rupture being projected
+    # on the vertical plane:
+    rup_proj_height = rup_width * math.sin(rdip)
+    # and it's width being projected on the horizontal one:
+    rup_proj_width = rup_width * math.cos(rdip)
+
+    # half height of the vertical component of rupture width
+    # is the vertical distance between the rupture geometrical
+    # center and it's upper and lower borders:
+    hheight = rup_proj_height / 2.
+    # calculate how much shallower the upper border of the rupture
+    # is than the upper seismogenic depth:
+    vshift = src.upper_seismogenic_depth - hc_depth + hheight
+    # if it is shallower (vshift > 0) than we need to move the rupture
+    # by that value vertically.
+    if vshift < 0:
+        # the top edge is below upper seismogenic depth. now we need
+        # to check that we do not cross the lower border.
+        vshift = src.lower_seismogenic_depth - hc_depth - hheight
+        if vshift > 0:
+            # the bottom edge of the rupture is above the lower sesmogenic
+            # depth. that means that we don't need to move the rupture
+            # as it fits inside seismogenic layer.
+            vshift = 0
+        # if vshift < 0 than we need to move the rupture up by that value.
+
+    # now we need to find the position of rupture's geometrical center.
+    # in any case the hypocenter point must lie on the surface, however
+    # the rupture center might be off (below or above) along the dip.
+    tmpl = numpy.zeros((5, 3))
+    if vshift != 0:
+        # we need to move the rupture center to make the rupture fit
+        # inside the seismogenic layer.
+        hshift = abs(vshift / math.tan(rdip))
+        tmpl[0] = (azimuth_up if vshift < 0 else azimuth_down), hshift, vshift
+
+    # from the rupture center we can now compute the coordinates of the
+    # four coorners by moving along the diagonals of the plane. This seems
+    # to be better then moving along the perimeter, because in this case
+    # errors are accumulated that induce distorsions in the shape with
+    # consequent raise of exceptions when creating PlanarSurface objects
+    # theta is the angle between the diagonal of the surface projection
+    # and the line passing through the rupture center and parallel to the
+    # top and bottom edges. Theta is zero for vertical ruptures (because
+    # rup_proj_width is zero)
+    theta = math.degrees(
+        math.atan((rup_proj_width / 2.) / (rup_length / 2.)))
+    hor_dist = math.sqrt(
+        (rup_length / 2.) ** 2 + (rup_proj_width / 2.) ** 2)
+
+    tmpl[1] = (nodal_plane.strike + 180 + theta) % 360, hor_dist, -hheight
+    tmpl[2] = (nodal_plane.strike - theta) % 360, hor_dist, -hheight
+    tmpl[3] = (nodal_plane.strike + 180 - theta) % 360, hor_dist, hheight
+    tmpl[4] = (nodal_plane.strike + theta) % 360, hor_dist, hheight
+    tmpl.flags.writeable = False
+    _templates[key] = tmpl
+    if len(_templates) > MAX_TEMPLATES:  # discard the oldest
+        del _templates[next(iter(_templates))]
+    return tmpl
+
+
+def translate_templates(templates, hlons, hlats, hdeps):
+    """
+    Translate U rupture templates to the given hypocenters, with a few
+    vectorized calls to :func:`openquake.hazardlib.geo.geodetic.point_at`.
+
+    :param templates: an array of shape (U, 5, 3)
+    :param hlons: an array of U hypocenter longitudes
+    :param hlats: an array of U hypocenter latitudes
+    :param hdeps: an array of U hypocenter depths
+    :returns:
+        an array of shape (U, 3) with the rupture centers and an array of
+        shape (U, 3, 4) with the (lon, lat, depth) of the corners
+        tl, tr, bl, br
+    """
+    az, hdist, vinc = templates[:, 0].T
+    clons, clats = geodetic.point_at(hlons, hlats, az, hdist)
+    moved = vinc != 0
+    clons = numpy.where(moved, clons, hlons)
+    clats = numpy.where(moved, clats, hlats)
+    cdeps = hdeps + vinc
+    az, hdist, vinc = templates[:, 1:].transpose(2, 0, 1)  # shape (U, 4)
+    lons, lats = geodetic.point_at(clons[:, None], clats[:, None], az, hdist)
+    centers = numpy.array([clons, clats, cdeps]).T
+    corners = numpy.array([lons, lats, cdeps[:, None] + vinc])
+    return centers, corners.transpose(1, 0, 2)
+
+
+def _planar_surface(strike, dip, corners):
+    # build a PlanarSurface from an array (lon, lat, depth) x (tl, tr, bl, br)
+    tl, tr, bl, br = [Point(*p) for p in corners.T]
+    return PlanarSurface(strike, dip, tl, tr, br, bl)
+
+
 def calc_average(pointsources):
     """
     :returns:
@@ -209,22 +360,100 @@ class PointSource(ParametricSeismicSource):
         Generate one rupture for each combination of magnitude, nodal plane
         and hypocenter depth.
         """
-        filtermag = kwargs.get('mag')
+        rows = list(self._gen_rows(kwargs.get('mag')))
+        if not rows:
+            return
+        hypos, centers, corners = self._get_geometry(rows)
+        for (mag, np, hc_depth, rate), hypo, center, corners34 in zip(
+                rows, hypos, centers, corners):
+            hc = Point(*(center if kwargs.get('shift_hypo') else hypo))
+            surface = _planar_surface(np.strike, np.dip, corners34)
+            yield ParametricProbabilisticRupture(
+                mag, np.rake, self.tectonic_region_type, hc, surface, rate,
+                self.temporal_occurrence_model)
+
+    def _gen_rows(self, filtermag=None):
+        # yield tuples (mag, nodal_plane, hc_depth, occurrence_rate)
         for mag, mag_occ_rate in self.get_annual_occurrence_rates():
             if filtermag and mag != filtermag:
                 continue  # yield only ruptures of magnitude filtermag
             for np_prob, np in self.nodal_plane_distribution.data:
                 for hc_prob, hc_depth in self.hypocenter_distribution.data:
-                    hc = Point(latitude=self.location.latitude,
-                               longitude=self.location.longitude,
-                               depth=hc_depth)
-                    occurrence_rate = mag_occ_rate * np_prob * hc_prob
-                    surface, nhc = self._get_rupture_surface(mag, np, hc)
-                    yield ParametricProbabilisticRupture(
-                        mag, np.rake, self.tectonic_region_type,
-                        nhc if kwargs.get('shift_hypo') else hc,
-                        surface, occurrence_rate,
-                        self.temporal_occurrence_model)
+                    yield mag, np, hc_depth, mag_occ_rate * np_prob * hc_prob
+
+    def _get_geometry(self, rows):
+        # returns hypocenters, rupture centers and corners for all the rows
+        templates = numpy.array([get_rupture_template(self, mag, np, dep)
+                                 for mag, np, dep, _rate in rows])
+        U = len(rows)
+        hypos = numpy.zeros((U, 3))
+        hypos[:, 0] = self.location.longitude
+        hypos[:, 1] = self.location.latitude
+        hypos[:, 2] = [row[2] for row in rows]
+        centers, corners = translate_templates(templates, *hypos.T)
+        return hypos, centers, corners
+
+    def get_rupture_arrays(self, mag=None):
+        """
+        Build the geometry of all the ruptures of the source as arrays,
+        without instantiating any rupture or surface object.
+
+        :param mag: if given, consider only the ruptures of that magnitude
+        :returns:
+            a dictionary with keys mag, rake, strike, dip, occurrence_rate
+            (arrays of shape U), hypo and center (arrays of shape (U, 3))
+            and corners (array of shape (U, 3, 4) with the (lon, lat, depth)
+            of the corners tl, tr, bl, br)
+        """
+        rows = list(self._gen_rows(mag))
+        if not rows:
+            return {}
+        dic = dict(mag=numpy.array([row[0] for row in rows]),
+                   rake=numpy.array([row[1].rake for row in rows]),
+                   strike=numpy.array([row[1].strike for row in rows]),
+                   dip=numpy.array([row[1].dip for row in rows]),
+                   occurrence_rate=numpy.array([row[3] for row in rows]))
+        dic['hypo'], dic['center'], dic['corners'] = self._get_geometry(rows)
+        return dic
+
+    def sample_point_ruptures(self, eff_num_ses, min_mag=0):
+        """
+        Sample the ruptures of the point source from a Poisson distribution.
+        The rates are computed as an array of shape (M, N, H) with M the
+        number of magnitudes, N the number of nodal planes and H the
+        number of hypocenters and only the ruptures with nonzero
+        occurrences are instantiated. The random numbers are drawn from
+        the global numpy generator, seeded in
+        :meth:`openquake.hazardlib.source.base.BaseSeismicSource.sample_ruptures`.
+
+        :param eff_num_ses: number of stochastic event sets * number of samples
+        :param min_mag: discard the magnitudes below min_mag
+        :yields: pairs (rupture, num_occurrences)
+        """
+        mag_rates = [(mag, rate) for mag, rate in
+                     self.get_annual_occurrence_rates() if mag >= min_mag]
+        if not mag_rates:
+            return
+        rates = numpy.array([rate for mag, rate in mag_rates])
+        np_probs, nps = zip(*self.nodal_plane_distribution.data)
+        hc_probs, hc_deps = zip(*self.hypocenter_distribution.data)
+        rates = (rates[:, None, None] * numpy.array(np_probs)[:, None] *
+                 numpy.array(hc_probs))
+        tom = self.temporal_occurrence_model
+        occurs = numpy.random.poisson(rates * tom.time_span * eff_num_ses)
+        idxs = occurs.nonzero()
+        if not len(idxs[0]):
+            return
+        rows = [(mag_rates[m][0], nps[n], hc_deps[h], float(rates[m, n, h]))
+                for m, n, h in zip(*idxs)]
+        hypos, _centers, corners = self._get_geometry(rows)
+        for (mag, np, hc_depth, rate), hypo, corners34, num_occ in zip(
+                rows, hypos, corners, occurs[idxs]):
+            surface = _planar_surface(np.strike, np.dip, corners34)
+            rup = ParametricProbabilisticRupture(
+                mag, np.rake, self.tectonic_region_type, Point(*hypo),
+                surface, rate, tom)
+            yield rup, num_occ
 
     def avg_ruptures(self):
         """
@@ -269,95 +498,14 @@ class PointSource(ParametricSeismicSource):
         :returns:
             Instance of :class:`~openquake.hazardlib.geo.surface.planar.PlanarSurface`.
         """
-        eps = .001  # 1 meter buffer to survive numerical errors
-        assert self.upper_seismogenic_depth < hypocenter.depth + eps, (
-            self.upper_seismogenic_depth, hypocenter.depth)
-        assert self.lower_seismogenic_depth + eps > hypocenter.depth, (
-            self.lower_seismogenic_depth, hypocenter.depth)
-        rdip = math.radians(nodal_plane.dip)
-
-        # precalculated azimuth values for horizontal-only and vertical-only
-        # moves from one point to another on the plane defined by strike
-        # and dip:
-        azimuth_right = nodal_plane.strike
-        azimuth_down = (azimuth_right + 90) % 360
-        azimuth_left = (azimuth_down + 90) % 360
-        azimuth_up = (azimuth_left + 90) % 360
-
-        rup_length, rup_width = _get_rupture_dimensions(
-            self, mag, nodal_plane.rake, nodal_plane.dip)
-        # calculate the height of the rupture being projected
-        # on the vertical plane:
-        rup_proj_height = rup_width * math.sin(rdip)
-        # and it's width being projected on the horizontal one:
-        rup_proj_width = rup_width * math.cos(rdip)
-
-        # half height of the vertical component of rupture width
-        # is the vertical distance between the rupture geometrical
-        # center and it's upper and lower borders:
-        hheight = rup_proj_height / 2.
-        # calculate how much shallower the upper border of the rupture
-        # is than the upper seismogenic depth:
-        vshift = self.upper_seismogenic_depth - hypocenter.depth + hheight
-        # if it is shallower (vshift > 0) than we need to move the rupture
-        # by that value vertically.
-        if vshift < 0:
-            # the top edge is below upper seismogenic depth. now we need
-            # to check that we do not cross the lower border.
-            vshift = self.lower_seismogenic_depth - hypocenter.depth - hheight
-            if vshift > 0:
-                # the bottom edge of the rupture is above the lower sesmogenic
-                # depth. that means that we don't need to move the rupture
-                # as it fits inside seismogenic layer.
-                vshift = 0
-            # if vshift < 0 than we need to move the rupture up by that value.
-
-        # now we need to find the position of rupture's geometrical center.
-        # in any case the hypocenter point must lie on the surface, however
-        # the rupture center might be off (below or above) along the dip.
-        rupture_center = hypocenter
-        if vshift != 0:
-            # we need to move the rupture center to make the rupture fit
-            # inside the seismogenic layer.
-            hshift = abs(vshift / math.tan(rdip))
-            rupture_center = rupture_center.point_at(
-                horizontal_distance=hshift, vertical_increment=vshift,
-                azimuth=(azimuth_up if vshift < 0 else azimuth_down))
-
-        # from the rupture center we can now compute the coordinates of the
-        # four coorners by moving along the diagonals of the plane. This seems
-        # to be better then moving along the perimeter, because in this case
-        # errors are accumulated that induce distorsions in the shape with
-        # consequent raise of exceptions when creating PlanarSurface objects
-        # theta is the angle between the diagonal of the surface projection
-        # and the line passing through the rupture center and parallel to the
-        # top and bottom edges. Theta is zero for vertical ruptures (because
-        # rup_proj_width is zero)
-        theta = math.degrees(
-            math.atan((rup_proj_width / 2.) / (rup_length / 2.)))
-        hor_dist = math.sqrt(
-            (rup_length / 2.) ** 2 + (rup_proj_width / 2.) ** 2)
-
-        left_top = rupture_center.point_at(
-            horizontal_distance=hor_dist,
-            vertical_increment=-rup_proj_height / 2.,
-            azimuth=(nodal_plane.strike + 180 + theta) % 360)
-        right_top = rupture_center.point_at(
-            horizontal_distance=hor_dist,
-            vertical_increment=-rup_proj_height / 2.,
-            azimuth=(nodal_plane.strike - theta) % 360)
-        left_bottom = rupture_center.point_at(
-            horizontal_distance=hor_dist,
-            vertical_increment=rup_proj_height / 2.,
-            azimuth=(nodal_plane.strike + 180 - theta) % 360)
-        right_bottom = rupture_center.point_at(
-            horizontal_distance=hor_dist,
-            vertical_increment=rup_proj_height / 2.,
-            azimuth=(nodal_plane.strike + theta) % 360)
-        surface = PlanarSurface(
-            nodal_plane.strike, nodal_plane.dip, left_top, right_top,
-            right_bottom, left_bottom)
-        return surface, rupture_center
+        tmpl = get_rupture_template(self, mag, nodal_plane, hypocenter.depth)
+        center, corners = translate_templates(
+            tmpl[None], numpy.array([hypocenter.longitude]),
+            numpy.array([hypocenter.latitude]),
+            numpy.array([hypocenter.depth]))
+        surface = _planar_surface(
+            nodal_plane.strike, nodal_plane.dip, corners[0])
+        return surface, Point(*center[0])
 
     @property
     def polygon(self):
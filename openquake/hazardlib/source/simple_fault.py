@@ -122,6 +122,23 @@ class SimpleFaultSource(ParametricSeismicSource):
                              'ruptures of magnitude %s' %
                              (rupture_mesh_spacing, min_mag))
 
+    def _get_geometry(self):
+        """
+        :returns:
+            a dictionary with the mesh of the whole fault surface, built
+            once and then stored in the source (and in its splits)
+        """
+        try:
+            return self._geom
+        except AttributeError:
+            pass
+        mesh = SimpleFaultSurface.from_fault_data(
+            self.fault_trace, self.upper_seismogenic_depth,
+            self.lower_seismogenic_depth, self.dip,
+            self.rupture_mesh_spacing).mesh
+        self._geom = dict(mesh=mesh)
+        return self._geom
+
     def iter_ruptures(self, **kwargs):
         """
         See :meth:
@@ -134,10 +151,7 @@ class SimpleFaultSource(ParametricSeismicSource):
         rate of each of those ruptures is the magnitude occurrence rate
         divided by the number of ruptures that can be placed in a fault.
         """
-        whole_fault_surface = SimpleFaultSurface.from_fault_data(
-            self.fault_trace, self.upper_seismogenic_depth,
-            self.lower_seismogenic_depth, self.dip, self.rupture_mesh_spacing)
-        whole_fault_mesh = whole_fault_surface.mesh
+        whole_fault_mesh = self._get_geometry()['mesh']
         mesh_rows, mesh_cols = whole_fault_mesh.shape
         fault_length = float((mesh_cols - 1) * self.rupture_mesh_spacing)
         fault_width = float((mesh_rows - 1) * self.rupture_mesh_spacing)
@@ -198,10 +212,7 @@ class SimpleFaultSource(ParametricSeismicSource):
         See :meth:
         `openquake.hazardlib.source.base.BaseSeismicSource.count_ruptures`.
         """
-        whole_fault_surface = SimpleFaultSurface.from_fault_data(
-            self.fault_trace, self.upper_seismogenic_depth,
-            self.lower_seismogenic_depth, self.dip, self.rupture_mesh_spacing)
-        whole_fault_mesh = whole_fault_surface.mesh
+        whole_fault_mesh = self._get_geometry()['mesh']
         mesh_rows, mesh_cols = whole_fault_mesh.shape
         fault_length = float((mesh_cols - 1) * self.rupture_mesh_spacing)
         fault_width = float((mesh_rows - 1) * self.rupture_mesh_spacing)
@@ -280,6 +291,7 @@ class SimpleFaultSource(ParametricSeismicSource):
         self.lower_seismogenic_depth = lower_seismogenic_depth
         self.dip = dip
         self.rupture_mesh_spacing = spacing
+        vars(self).pop('_geom', None)  # invalidate the geometry cache
 
     def modify_adjust_mfd_from_slip(self, slip_rate, rigidity):
         """
@@ -318,6 +330,7 @@ class SimpleFaultSource(ParametricSeismicSource):
             self.lower_seismogenic_depth, self.dip + increment,
             self.rupture_mesh_spacing)
         self.dip += increment
+        vars(self).pop('_geom', None)  # invalidate the geometry cache
 
     def modify_set_dip(self, dip):
         """
@@ -330,6 +343,7 @@ class SimpleFaultSource(ParametricSeismicSource):
             self.fault_trace, self.upper_seismogenic_depth,
             self.lower_seismogenic_depth, dip, self.rupture_mesh_spacing)
         self.dip = dip
+        vars(self).pop('_geom', None)  # invalidate the geometry cache
 
     def __iter__(self):
         mag_rates = self.get_annual_occurrence_rates()
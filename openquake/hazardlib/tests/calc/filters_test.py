@@ -17,10 +17,13 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import unittest
+import numpy
 from numpy.testing import assert_almost_equal as aae
 from openquake.baselib.general import gettemp
-from openquake.hazardlib import nrml
+from openquake.hazardlib import nrml, mfd, pmf, scalerel, tom
 from openquake.hazardlib.geo.point import Point
+from openquake.hazardlib.geo.nodalplane import NodalPlane
+from openquake.hazardlib.source import PointSource
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.calc.filters import (
     MagDepDistance, SourceFilter, angular_distance, split_source)
@@ -56,6 +59,30 @@ class SourceFilterTestCase(unittest.TestCase):
         sites = srcfilter.get_close_sites(src)
         self.assertIsNotNone(sites)
 
+    def test_get_close_sids(self):
+        # the bulk filtering must agree with within_bbox, also for
+        # boxes crossing the international date line
+        rng = numpy.random.default_rng(42)
+        lons = (175 + rng.uniform(-10, 10, 2000) + 180) % 360 - 180
+        lats = rng.uniform(-50, -30, 2000)
+        sitecol = SiteCollection.from_points(lons, lats)
+        srcfilter = SourceFilter(sitecol, MagDepDistance.new('200'))
+        srcs = []
+        for i in range(100):
+            lon = (175 + rng.uniform(-10, 10) + 180) % 360 - 180
+            loc = Point(lon, rng.uniform(-50, -30))
+            srcs.append(PointSource(
+                str(i), 'ps', 'Active Shallow Crust',
+                mfd.TruncatedGRMFD(5, 6, .1, 4, 1), 1., scalerel.WC1994(),
+                1., tom.PoissonTOM(50), 0, 20, loc,
+                pmf.PMF([(1, NodalPlane(0, 90, 0))]), pmf.PMF([(1, 10)])))
+        indptr, sids = srcfilter.get_close_sids(srcs)
+        self.assertEqual(len(indptr), 101)
+        for i, src in enumerate(srcs):
+            bbox = srcfilter.get_enlarged_box(src)
+            numpy.testing.assert_equal(
+                sids[indptr[i]:indptr[i + 1]], sitecol.within_bbox(bbox))
+
 
 # from https://groups.google.com/d/msg/openquake-users/P03SxJsfW_s/nCdcxj8WAAAJ
 characteric_source = '''\
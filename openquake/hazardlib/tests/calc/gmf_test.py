@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2021 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from unittest import mock
+import numpy
+from openquake.baselib.general import AccumDict
+from openquake.hazardlib import const
+from openquake.hazardlib.correlation import JB2009CorrelationModel
+from openquake.hazardlib.calc.gmf import GmfComputer
+from openquake.hazardlib.contexts import ContextMaker
+from openquake.hazardlib.geo import Point, PlanarSurface
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.source.rupture import BaseRupture, EBRupture
+
+
+def make_rupture(rup_id):
+    surface = PlanarSurface.from_corner_points(
+        Point(0, 0, 1), Point(.1, 0, 1), Point(.1, 0, 10), Point(0, 0, 10))
+    rup = BaseRupture(6.5, 90, const.TRT.ACTIVE_SHALLOW_CRUST,
+                      Point(.05, 0, 5), surface)
+    rup.rup_id = rup_id
+    return rup
+
+
+def compute_all_by_site(computer, min_iml, rlzs_by_gsim):
+    # the implementation used up to engine 3.11, appending the ground
+    # motion values site by site
+    eids_by_rlz = computer.ebrupture.get_eids_by_rlz(rlzs_by_gsim)
+    data = AccumDict(accum=[])
+    for gs, rlzs in rlzs_by_gsim.items():
+        num_events = sum(len(eids_by_rlz[rlz]) for rlz in rlzs)
+        array, sig, eps = computer.compute(gs, num_events)
+        array = array.transpose(1, 0, 2)  # from M, N, E to N, M, E
+        for i, miniml in enumerate(min_iml.values()):
+            arr = array[:, i, :]
+            arr[arr < miniml] = 0
+        n = 0
+        for rlz in rlzs:
+            eids = eids_by_rlz[rlz]
+            for ei, eid in enumerate(eids):
+                gmfa = array[:, :, n + ei]  # shape (N, M)
+                if not gmfa.sum():
+                    continue
+                for i, gmv in enumerate(gmfa):
+                    if gmv.sum():
+                        data['sid'].append(computer.sids[i])
+                        data['eid'].append(eid)
+                        data['rlz'].append(rlz)
+                        for m in range(len(gmv)):
+                            data[f'gmv_{m}'].append(gmv[m])
+            n += len(eids)
+    return {key: numpy.array(val, numpy.uint32 if key in 'eid sid rlz'
+                             else numpy.float32)
+            for key, val in data.items()}
+
+
+class CounterBasedGmfTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sitecol = SiteCollection([
+            Site(Point(lon, 0), vs30=760) for lon in numpy.linspace(
+                -.5, .5, 20)])
+        self.cmaker = ContextMaker(
+            const.TRT.ACTIVE_SHALLOW_CRUST, [BooreAtkinson2008()],
+            dict(imtls={'PGA': [0], 'SA(1.0)': [0]}))
+
+    def compute(self, sitecol, eids, truncation_level=3):
+        computer = GmfComputer(make_rupture(42), sitecol, self.cmaker,
+                               truncation_level, counter_based=True)
+        return computer.compute(BooreAtkinson2008(), len(eids), eids)
+
+    def test_subsets(self):
+        eids = numpy.arange(100, 110)
+        gmf, sig, eps = self.compute(self.sitecol, eids)
+        self.assertEqual(gmf.shape, (2, 20, 10))
+        self.assertLessEqual(numpy.abs(eps).max(), 3)
+
+        # the same numbers are generated for any subset of the events
+        gmf1, sig1, eps1 = self.compute(self.sitecol, eids[[7, 2, 5]])
+        numpy.testing.assert_equal(gmf1, gmf[:, :, [7, 2, 5]])
+        numpy.testing.assert_equal(eps1, eps[:, [7, 2, 5]])
+
+        # and for any subset of the sites
+        gmf2, _, _ = self.compute(self.sitecol.filtered([3, 11, 12]), eids)
+        numpy.testing.assert_equal(gmf2, gmf[:, [3, 11, 12]])
+
+    def test_distribution(self):
+        eids = numpy.arange(20000)
+        computer = GmfComputer(make_rupture(1), self.sitecol, self.cmaker,
+                               None, counter_based=True)
+        residuals = computer._rvs(computer.imts[0], eids, 20, len(eids))
+        self.assertAlmostEqual(residuals.mean(), 0, delta=.01)
+        self.assertAlmostEqual(residuals.std(), 1, delta=.01)
+        # the intra-event residuals are independent from the inter-event ones
+        inter = computer._rvs(computer.imts[0], eids, len(eids))
+        self.assertLess(abs(numpy.corrcoef(inter, residuals[0])[0, 1]), .03)
+
+    @mock.patch('openquake.hazardlib.calc.gmf.MIN_THREADED_SIZE', 1)
+    def test_threads(self):
+        eids = numpy.arange(50)
+        for cormo in (None, JB2009CorrelationModel(vs30_clustering=False)):
+            sequential = GmfComputer(
+                make_rupture(42), self.sitecol, self.cmaker, 3,
+                cormo, counter_based=True).compute(
+                    BooreAtkinson2008(), len(eids), eids)
+            threaded = GmfComputer(
+                make_rupture(42), self.sitecol, self.cmaker, 3,
+                cormo, counter_based=True, num_threads=4).compute(
+                    BooreAtkinson2008(), len(eids), eids)
+            for seq, thr in zip(sequential, threaded):
+                numpy.testing.assert_equal(thr, seq)
+
+
+class ComputeAllTestCase(unittest.TestCase):
+    # the columnar rows must be the same of the site-by-site rows
+    def test_by_site(self):
+        sitecol = SiteCollection([
+            Site(Point(lon, lat), vs30=760)
+            for lon in numpy.linspace(-1, 1, 10)
+            for lat in numpy.linspace(-1, 1, 10)])
+        cmaker = ContextMaker(
+            const.TRT.ACTIVE_SHALLOW_CRUST, [BooreAtkinson2008()],
+            dict(imtls={'PGA': [0], 'SA(0.3)': [0], 'SA(1.0)': [0]}))
+        ebr = EBRupture(make_rupture(42), 'src', 0, 50, id=0)
+        computer = GmfComputer(ebr, sitecol, cmaker)
+        gsim = cmaker.gsims[0]
+        rlzs_by_gsim = {gsim: numpy.uint32([0, 1, 2])}
+        # the GMFs are sampled once and reused by both implementations
+        array, sig, eps = computer.compute(gsim, 50)
+        computer.compute = lambda gs, num_events, eids=None: (
+            array.copy(), sig, eps)
+        min_iml = {'PGA': .05, 'SA(0.3)': .1, 'SA(1.0)': .05}
+        expected = compute_all_by_site(computer, min_iml, rlzs_by_gsim)
+        data, _dt = computer.compute_all(min_iml, rlzs_by_gsim)
+        # some sites are discarded, but not all of them
+        self.assertLess(len(expected['sid']), 50 * 100)
+        self.assertGreater(len(expected['sid']), 0)
+        self.assertEqual(sorted(data), sorted(expected))
+        for key in expected:
+            numpy.testing.assert_equal(data[key], expected[key])
@@ -23,8 +23,10 @@ from openquake.hazardlib.const import TRT
 from openquake.baselib.general import DictArray
 from openquake.hazardlib.tom import PoissonTOM
 from openquake.hazardlib.contexts import (
-    Effect, RuptureContext, _collapse, _make_pmap, ContextMaker, get_distances)
+    Effect, RuptureContext, _collapse, _make_pmap, ContextMaker, get_distances,
+    ContextBuffer)
 from openquake.hazardlib import valid
+from openquake.hazardlib.calc.filters import MagDepDistance
 from openquake.hazardlib.geo.surface import SimpleFaultSurface as SFS
 from openquake.hazardlib.source.rupture import \
     NonParametricProbabilisticRupture as NPPR
@@ -152,6 +154,37 @@ class ClosestPointOnTheRuptureTestCase(unittest.TestCase):
         self.assertTrue(abs(dsts[1, 1]-0.0) < 1e-2, msg)
 
 
+class PlanarContextsTestCase(unittest.TestCase):
+    def test_same_as_gen_ctxs(self):
+        # the batched distances give the same contexts as the rupture
+        # by rupture computation
+        mfd = ArbitraryMFD([5.0, 6.5], [.01, .001])
+        npd = PMF([(.5, NodalPlane(0., 90., 0.)),
+                   (.5, NodalPlane(45., 30., 90.))])
+        hyd = PMF([(.5, 5.), (.5, 15.)])
+        src = PointSource('0', 'test', TRT.ACTIVE_SHALLOW_CRUST, mfd, 2.,
+                          WC1994(), 1., PoissonTOM(1.), 0., 20.,
+                          Point(0., 0.), npd, hyd)
+        sites = SiteCollection([
+            Site(Point(lon, lat), vs30=760, vs30measured=True, z1pt0=40)
+            for lon in numpy.linspace(-1, 1, 7)
+            for lat in numpy.linspace(-.5, .5, 5)])
+        gsims = [valid.gsim('AbrahamsonEtAl2014'), valid.gsim('Atkinson2015')]
+        cmaker = ContextMaker(TRT.ACTIVE_SHALLOW_CRUST, gsims, dict(
+            maximum_distance=MagDepDistance.new('50'),
+            imtls=DictArray({'PGA': [.01]})))
+        cmaker.MAX_PAIRS = 70  # force more blocks
+        rups = list(src.iter_ruptures())
+        ctxs1 = list(cmaker.gen_ctxs(rups, sites, 0))
+        ctxs2 = list(cmaker.gen_ctxs_planar(rups, sites, 0))
+        self.assertEqual(len(ctxs1), len(ctxs2))
+        for ctx1, ctx2 in zip(ctxs1, ctxs2):
+            self.assertEqual(ctx1.mag, ctx2.mag)
+            numpy.testing.assert_equal(ctx1.sids, ctx2.sids)
+            for par in ('rrup', 'rjb', 'rx', 'ry0', 'rhypo', 'vs30'):
+                aac(getattr(ctx1, par), getattr(ctx2, par), atol=1E-9)
+
+
 class EffectTestCase(unittest.TestCase):
     def test_dist_by_mag(self):
         effect = Effect(intensities, dists)
@@ -227,3 +260,34 @@ class CollapseTestCase(unittest.TestCase):
                                investigation_time=50))
         pmap = _make_pmap(ctxs, cmaker)
         numpy.testing.assert_almost_equal(pmap[0].array, 0.066381)
+
+
+class ContextBufferTestCase(unittest.TestCase):
+    def test(self):
+        imtls = DictArray({'PGA': [0.01]})
+        gsim = valid.gsim('AkkarBommer2010')
+        cmaker = ContextMaker('TRT', [gsim], dict(imtls=imtls))
+        buf = ContextBuffer(cmaker.ctx_dt(), size=2)
+        ctxs = []
+        for mag, nsites in [(5.5, 2), (6.5, 1), (7., 3)]:
+            ctx = RuptureContext()
+            ctx.src_id = 1
+            ctx.mag = mag
+            ctx.rake = 90
+            ctx.occurrence_rate = .001
+            ctx.sids = numpy.arange(nsites, dtype=numpy.uint32)
+            ctx.vs30 = numpy.full(nsites, 760.)
+            ctx.rrup = numpy.linspace(10., 100., nsites)
+            ctx.rjb = ctx.rrup - 1.
+            ctx.clon = ctx.clat = numpy.zeros(nsites)
+            buf.add(ctx)
+            ctxs.append(ctx)
+        self.assertEqual(len(buf), 3)
+        arr = buf.array
+        self.assertEqual(list(arr.rup_id), [0, 0, 1, 2, 2, 2])
+        self.assertEqual(list(arr.mag), [5.5, 5.5, 6.5, 7., 7., 7.])
+        aac(arr.rjb, [9., 99., 9., 9., 54., 99.])
+
+        # the buffer can be passed directly to the GSIMs
+        aac(gsim.get_mean_std(arr, cmaker.imts),
+            gsim.get_mean_std(ctxs, cmaker.imts))
@@ -19,7 +19,8 @@ import numpy
 
 from openquake.hazardlib.imt import SA, PGA
 from openquake.hazardlib.correlation import JB2009CorrelationModel, \
-                                            HM2018CorrelationModel
+                                            HM2018CorrelationModel, \
+                                            hmcorrelation
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.geo import Point
 
@@ -298,3 +299,91 @@ class HM2018ApplyCorrelationTestCase(unittest.TestCase):
              [[1.        , 0.3807, 0.5066],
               [0.3807, 1.        , 0.3075],
               [0.5066, 0.3075, 1.        ]], 2)
+
+
+class LowRankCorrelationTestCase(unittest.TestCase):
+    def setUp(self):
+        lons, lats = numpy.meshgrid(numpy.linspace(10, 10.05, 15),
+                                    numpy.linspace(45, 45.05, 15))
+        self.sitecol = SiteCollection.from_points(
+            lons.flatten(), lats.flatten())
+
+    def test_cache(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False)
+        cormo.cachesize = 2
+        res = numpy.random.RandomState(42).normal(size=(3, 4))
+        sites1 = self.sitecol.filtered([0, 100, 200])
+        sites2 = self.sitecol.filtered([1, 101, 201])
+        cormo.apply_correlation(sites1, PGA(), res)
+        cormo.apply_correlation(sites2, PGA(), res)
+        cormo.apply_correlation(sites1, PGA(), res)  # sites1 is now last
+        cormo.apply_correlation(sites1, SA(1.), res)  # sites2 discarded
+        key = sites1.sids.tobytes()
+        self.assertEqual(list(cormo.cache), [('PGA', key), ('SA(1.0)', key)])
+
+        # the factor is the one of the filtered sites, not of the complete
+        # site collection
+        corma = cormo._get_correlation_matrix(sites1, PGA())
+        aaae(cormo.get_factor(sites1, PGA()),
+             numpy.linalg.cholesky(corma))
+
+    def test_low_rank(self):
+        imt = SA(1.)
+        exact = JB2009CorrelationModel(vs30_clustering=False)
+        cormo = JB2009CorrelationModel(vs30_clustering=False, tolerance=.05)
+        factor, pivots, diag = cormo.get_factor(self.sitecol, imt)
+        self.assertLess(len(pivots), len(self.sitecol))
+        self.assertLessEqual(diag.max(), .05)
+
+        # the variances are preserved exactly
+        corma = exact._get_correlation_matrix(self.sitecol, imt)
+        aaae((factor ** 2).sum(axis=1) + diag, numpy.ones(len(self.sitecol)))
+
+        # the correlation matrix is well approximated
+        approx = factor @ factor.T + numpy.diag(diag)
+        self.assertLess(numpy.abs(approx - corma).max(), .05)
+
+        # same output shape as the exact model
+        res = numpy.random.RandomState(42).normal(
+            size=(len(self.sitecol), 3))
+        self.assertEqual(cormo.apply_correlation(self.sitecol, imt, res).shape,
+                         exact.apply_correlation(self.sitecol, imt, res).shape)
+
+    def test_hm2018_filtered(self):
+        imt = SA(2.)
+        sites = self.sitecol.filtered([3, 50, 51, 120])
+        stddev = numpy.array([.5, .6, .7, .8])
+        res = numpy.random.RandomState(42).normal(size=(4, 5))
+        corr = HM2018CorrelationModel().apply_correlation(
+            sites, imt, res * stddev[:, None], stddev)
+        lt = numpy.linalg.cholesky(hmcorrelation(sites, imt))
+        aaae(corr, stddev[:, None] * (lt @ res))
+
+        # with a tiny tolerance the pivoted factor is complete
+        cormo = HM2018CorrelationModel(tolerance=1E-12)
+        factor, pivots, diag = cormo.get_factor(sites, imt)
+        self.assertEqual(len(pivots), 4)
+        aaae(factor @ factor.T, lt @ lt.T)
+
+    def test_eviction(self):
+        # 2 IMTs x 8 site subsets = 16 keys > cachesize=10, repeated twice
+        # with a different order, so that the factors are discarded and
+        # recomputed; the residuals must be the same as without cache
+        rng = numpy.random.RandomState(42)
+        subsets = [numpy.sort(rng.choice(len(self.sitecol), 20, False))
+                   for _ in range(8)]
+        keys = [(imt, sids) for imt in (PGA(), SA(1.)) for sids in subsets]
+        calls = keys + keys[::-1] + keys
+        for tolerance in (0, .05):
+            cached = JB2009CorrelationModel(False, tolerance)
+            self.assertEqual(cached.cachesize, 10)
+            uncached = JB2009CorrelationModel(False, tolerance)
+            uncached.cachesize = 0
+            for imt, sids in calls:
+                sites = self.sitecol.filtered(sids)
+                res = rng.normal(size=(len(sites), 3))
+                aaae(cached.apply_correlation(sites, imt, res),
+                     uncached.apply_correlation(sites, imt, res), 12)
+                self.assertLessEqual(len(cached.cache), 10)
+                self.assertEqual(len(uncached.cache), 0)
+            self.assertEqual(len(cached.cache), 10)
@@ -14,14 +14,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import pickle
+from unittest import mock
 import math
 
 import numpy
+from scipy.spatial.distance import cdist
 
 from openquake.hazardlib.geo.point import Point
 from openquake.hazardlib.geo.polygon import Polygon
 from openquake.hazardlib.geo.mesh import Mesh, RectangularMesh
-from openquake.hazardlib.geo import utils as geo_utils
+from openquake.hazardlib.geo import utils as geo_utils, geodetic
 
 from openquake.hazardlib.tests import assert_angles_equal
 from openquake.hazardlib.tests.geo import _mesh_test_data
@@ -257,6 +260,59 @@ class MeshGetMinDistanceTestCase(unittest.TestCase):
                    expected_distance_indices=[3, 3, 3, 0, 0, 3, 3, 3, 3])
 
 
+class MeshKDTreeTestCase(unittest.TestCase):
+    # the KD-tree and the chunked brute force give the same results
+    # of the full distance matrix
+    def setUp(self):
+        rng = numpy.random.RandomState(42)
+        self.mesh = RectangularMesh(*rng.uniform(0, 1, (3, 20, 15)))
+        self.sites = Mesh(rng.uniform(-1, 2, 1000), rng.uniform(-1, 2, 1000))
+        matrix = cdist(self.mesh.xyz, self.sites.xyz)
+        self.expected = matrix.min(axis=0), matrix.argmin(axis=0)
+
+    def test_few_sites(self):
+        # 300 points x 1000 sites: the brute force is used
+        with mock.patch('openquake.hazardlib.geo.mesh.cKDTree') as kdt:
+            aac(self.mesh.get_min_distance(self.sites), self.expected[0])
+        self.assertFalse(kdt.called)
+
+    def test_kdtree(self):
+        with mock.patch.object(geodetic, 'MAX_DISTANCE_MATRIX', 1000):
+            aac(self.mesh.get_min_distance(self.sites), self.expected[0])
+            closest = self.mesh.get_closest_points(self.sites)
+        self.assertIn('3d', self.mesh._kdtrees)
+        aac(closest.lons, self.mesh.lons.flat[self.expected[1]])
+        aac(closest.depths, self.mesh.depths.flat[self.expected[1]])
+        # the KD-tree is not pickled
+        self.assertNotIn('_kdtrees', vars(pickle.loads(pickle.dumps(
+            self.mesh))))
+
+    def test_repeated_queries(self):
+        # the KD-tree is built when the queried pairs exceed the threshold
+        sites = Mesh(self.sites.lons[:10], self.sites.lats[:10])
+        with mock.patch.object(geodetic, 'MAX_DISTANCE_MATRIX', 30000):
+            for _ in range(10):  # 10 x 300 x 10 = 30000 pairs
+                self.mesh.get_min_distance(sites)
+            self.assertNotIn('3d', self.mesh._kdtrees)
+            dists = self.mesh.get_min_distance(sites)
+        self.assertIn('3d', self.mesh._kdtrees)
+        aac(dists, self.expected[0][:10])
+
+    def test_joyner_boore(self):
+        expected = self.mesh.get_joyner_boore_distance(self.sites)
+        self.assertNotIn('2d', self.mesh._kdtrees)
+        with mock.patch.object(geodetic, 'MAX_DISTANCE_MATRIX', 1000):
+            aac(self.mesh.get_joyner_boore_distance(self.sites), expected)
+        self.assertIn('2d', self.mesh._kdtrees)
+
+    def test_chunks(self):
+        with mock.patch.object(geodetic, 'MAX_DISTANCE_MATRIX', 3000):
+            dists, idxs = geodetic.min_distance_idx(
+                self.mesh.xyz, self.sites.xyz)
+        aac(dists, self.expected[0])
+        numpy.testing.assert_equal(idxs, self.expected[1])
+
+
 class MeshGetDistanceMatrixTestCase(unittest.TestCase):
     def test_zeroes(self):
         mesh = Mesh(numpy.zeros(1000), numpy.zeros(1000), None)
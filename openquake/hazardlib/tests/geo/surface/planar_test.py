@@ -19,7 +19,8 @@ import numpy
 from openquake.hazardlib.geo import Point
 from openquake.hazardlib.geo.mesh import Mesh
 from openquake.hazardlib.geo import utils as geo_utils
-from openquake.hazardlib.geo.surface.planar import PlanarSurface
+from openquake.hazardlib.geo.surface.planar import (
+    PlanarSurface, build_planar_array, get_distances_planar)
 from openquake.hazardlib.tests.geo.surface import _planar_test_data as tdata
 
 aac = numpy.testing.assert_allclose
@@ -523,3 +524,31 @@ class PlanarSurfaceGetMiddlePointTestCase(unittest.TestCase):
         aac(midpoint.longitude, 0.0, atol=1E-4)
         aac(midpoint.latitude, 0.044966, atol=1E-4)
         aac(midpoint.depth, -4.0, atol=1E-4)
+
+
+class GetDistancesPlanarTestCase(unittest.TestCase):
+    def test_same_as_surfaces(self):
+        surfaces, hypos = [], []
+        for strike, dip in [(0, 90), (30, 45), (200, 20)]:
+            tl = Point(0.1, -0.1, 2.)
+            tr = tl.point_at(20, 0, strike)
+            hdist = 10 * numpy.cos(numpy.radians(dip))
+            vdist = 10 * numpy.sin(numpy.radians(dip))
+            bl = tl.point_at(hdist, vdist, strike + 90)
+            br = tr.point_at(hdist, vdist, strike + 90)
+            surfaces.append(PlanarSurface(strike, dip, tl, tr, br, bl))
+            hypos.append(surfaces[-1].get_middle_point())
+        lons, lats = numpy.meshgrid(numpy.linspace(-.5, .5, 11),
+                                    numpy.linspace(-.4, .4, 9))
+        mesh = Mesh(lons.flatten(), lats.flatten(), numpy.zeros(lons.size))
+        arr = build_planar_array(surfaces, hypos)
+        params = 'rrup rjb rx ry0 rhypo repi'.split()
+        dic = get_distances_planar(arr, mesh, params)
+        for surf, hypo, rrup, rjb, rx, ry0, rhypo, repi in zip(
+                surfaces, hypos, *[dic[param] for param in params]):
+            aac(rrup, surf.get_min_distance(mesh))
+            aac(rjb, surf.get_joyner_boore_distance(mesh), atol=1E-9)
+            aac(rx, surf.get_rx_distance(mesh))
+            aac(ry0, surf.get_ry0_distance(mesh))
+            aac(rhypo, hypo.distance_to_mesh(mesh))
+            aac(repi, hypo.distance_to_mesh(mesh, with_depths=False))
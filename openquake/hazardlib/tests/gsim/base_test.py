@@ -26,12 +26,15 @@ from copy import deepcopy
 from openquake.hazardlib import const
 from openquake.hazardlib.gsim.base import (
     GMPE, CoeffsTable, SitesContext, RuptureContext,
-    NotVerifiedWarning, DeprecationWarning)
+    NotVerifiedWarning, DeprecationWarning, _set_poes, _truncnorm_sf)
 from openquake.hazardlib.geo.point import Point
 from openquake.hazardlib.imt import PGA, PGV, SA
+from openquake.baselib.general import DictArray
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.source.rupture import BaseRupture
-from openquake.hazardlib.gsim.base import ContextMaker, to_distribution_values
+from openquake.hazardlib.gsim.base import (
+    ContextMaker, to_distribution_values)
+from openquake.hazardlib.gsim import get_available_gsims
 
 aac = numpy.testing.assert_allclose
 
@@ -356,3 +359,63 @@ class CoeffsTableTestCase(unittest.TestCase):
         self.assertEqual(str(te.exception),
                          "CoeffsTable cannot be constructed with "
                          "inputs of the form 'int'")
+
+
+class VectorizedGsimTestCase(unittest.TestCase):
+    # the stacked context path must agree with the context-by-context path
+    def _ctxs(self, gsim, rng):
+        ctxs = []
+        for mag, rake in zip([4.2, 5., 5.7, 6.3, 7.1, 8.],
+                             [0., 90., -90., 45., -150., 170.]):
+            ctx = RuptureContext()
+            ctx.sids = numpy.arange(4, dtype=numpy.uint32)
+            ctx.mag = mag
+            ctx.rake = rake
+            ctx.dip = 30. if rake else 90.
+            ctx.ztor = mag / 2
+            ctx.width = mag * 2
+            ctx.hypo_depth = mag * 3
+            for dist in gsim.REQUIRES_DISTANCES:
+                setattr(ctx, dist, rng.uniform(1., 200., 4))
+            ctx.rx = rng.uniform(-50., 50., 4)
+            ctx.vs30 = numpy.array([150., 250., 500., 1200.])
+            ctx.vs30measured = numpy.array([True, False, True, False])
+            ctx.z1pt0 = numpy.array([-1., 40., 200., 500.])
+            ctx.z2pt5 = numpy.array([.5, 1., 2., 4.])
+            ctx.backarc = numpy.array([False, True, False, True])
+            ctxs.append(ctx)
+        return ctxs
+
+    def test_compute(self):
+        rng = numpy.random.RandomState(42)
+        imts = [PGA(), SA(0.2), SA(1.0)]
+        # all the GSIMs inheriting vectorized = True, in all modules
+        gsims = [cls() for name, cls in sorted(get_available_gsims().items())
+                 if cls.vectorized]
+        self.assertGreaterEqual(len(gsims), 5)
+        for gsim in gsims:
+            ctxs = self._ctxs(gsim, rng)
+            vec = gsim.get_mean_std(ctxs, imts)
+            gsim.vectorized = False  # force the slow path
+            slow = gsim.get_mean_std(ctxs, imts)
+            aac(vec, slow, rtol=1E-12, err_msg=gsim.__class__.__name__)
+
+
+class SetPoesTestCase(unittest.TestCase):
+    # the in-place kernel must agree with the truncated normal sf
+    def test_truncation_levels(self):
+        imtls = DictArray({'PGA': [.01, .1, .2, .5],
+                           'SA(1.0)': [.05, .3, .4, .8]})
+        loglevels = DictArray({imt: numpy.log(imls)
+                               for imt, imls in imtls.items()})
+        mean = numpy.log([[.05, .1], [.2, .01], [.6, .5]])  # shape (N, M)
+        std = numpy.array([[.5, .6], [.7, .8], [.9, 1.]])
+        for trunclevel in (None, 0, 3.):
+            out = numpy.zeros((2, 3, loglevels.size))[1]
+            _set_poes((mean, std), loglevels, trunclevel, out)
+            for m, imt in enumerate(loglevels):
+                z = (loglevels[imt] - mean[:, m, None]) / std[:, m, None]
+                expected = (z <= 0) if trunclevel == 0 else _truncnorm_sf(
+                    trunclevel, z)
+                aac(out[:, loglevels(imt)], expected,
+                    atol=1E-15, err_msg=str(trunclevel))
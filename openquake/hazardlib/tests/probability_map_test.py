@@ -16,6 +16,7 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import pickle
 import unittest
 import numpy
 from openquake.hazardlib.probability_map import ProbabilityMap
@@ -40,3 +41,38 @@ class ProbabilityMapTestCase(unittest.TestCase):
         # test pmap power
         pmap = pmap1 ** 2
         numpy.testing.assert_almost_equal(pmap[0].array, [[.16], [0], [0]])
+
+    def test_scatter(self):
+        pmap = ProbabilityMap(2, 1)
+        pmap.multiply_at(numpy.array([5, 1]), numpy.full((2, 2, 1), .5))
+        pmap.multiply_at(numpy.array([1, 7, 3]), numpy.full((3, 2, 1), .2))
+        self.assertEqual(list(pmap), [5, 1, 7, 3])
+        numpy.testing.assert_equal(pmap.sids, [1, 3, 5, 7])
+        numpy.testing.assert_almost_equal(
+            pmap.array(8)[:, 0, 0], [0, .1, 0, .2, 0, .5, 0, .2])
+        self.assertNotIn(2, pmap)
+        with self.assertRaises(KeyError):
+            pmap[2]
+
+        # the complement discards the curves with zero probability
+        pmap.setdefault(2, 1.)
+        self.assertEqual(len(pmap), 5)
+        self.assertEqual(list(~pmap), [5, 1, 7, 3])
+
+        # mutually exclusive probabilities are added
+        pmap.add_at(numpy.array([0, 2]), numpy.full((2, 2, 1), .3))
+        numpy.testing.assert_almost_equal(pmap[0].array, [[.3], [.3]])
+        numpy.testing.assert_almost_equal(pmap[2].array, [[1.3], [1.3]])
+
+        # repeated site IDs are composed together
+        pmap.multiply_at(numpy.array([0, 9, 0]), numpy.full((3, 2, 1), .5))
+        numpy.testing.assert_almost_equal(pmap[0].array, [[.075], [.075]])
+        numpy.testing.assert_almost_equal(pmap[9].array, [[.5], [.5]])
+
+    def test_pickle(self):
+        pmap = ProbabilityMap.from_array(numpy.array([[.1, .2], [.3, .4]]),
+                                         [3, 1])
+        new = pickle.loads(pickle.dumps(pmap))
+        self.assertEqual(list(new), [3, 1])
+        numpy.testing.assert_equal(new.array(4), pmap.array(4))
+        numpy.testing.assert_equal(new.extract(0)[1].array, [[.3], [.4]])
@@ -21,8 +21,9 @@ import tempfile
 import numpy
 from shapely import wkt
 
-from openquake.baselib import hdf5
+from openquake.baselib import hdf5, parallel
 from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.calc.filters import SourceFilter
 from openquake.hazardlib.geo.point import Point
 
 assert_eq = numpy.testing.assert_equal
@@ -307,3 +308,21 @@ class SitePickleTestCase(unittest.TestCase):
         site1 = Site(point, 760.0, 100.0, 5.0)
         site2 = pickle.loads(pickle.dumps(site1))
         self.assertEqual(site1, site2)
+
+    @unittest.skipUnless(parallel.shared_memory, 'requires Python 3.8+')
+    def test_shared(self):
+        sitecol = SiteCollection.from_points([0, 1, 2], [0, 1, 2])
+        sa = parallel.SharedArray(sitecol.array)
+        try:
+            srcfilter = SourceFilter(sitecol.shared(sa), {'default': 100})
+            srcfilter.kdt = 'a kd-tree'
+            sf = pickle.loads(pickle.dumps(srcfilter))
+            self.assertFalse(hasattr(sf, 'kdt'))  # not sent
+            sc = sf.sitecol
+            self.assertIs(sc.complete, sc)
+            self.assertFalse(sc.array.flags.writeable)  # read-only view
+            numpy.testing.assert_equal(sc.array, sitecol.array)
+            self.assertEqual(sc._shared.name, sa.name)
+            del sf, sc
+        finally:
+            sa.unlink()
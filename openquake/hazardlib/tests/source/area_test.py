@@ -15,6 +15,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
 
+from numpy.testing import assert_allclose as aac
+
 from openquake.hazardlib.const import TRT
 from openquake.hazardlib.scalerel.peer import PeerMSR
 from openquake.hazardlib.mfd import TruncatedGRMFD, EvenlyDiscretizedMFD
@@ -100,3 +102,29 @@ class AreaSourceIterRupturesTestCase(unittest.TestCase):
         for rupture in ruptures:
             self.assertNotEqual(rupture.occurrence_rate, 3)
             self.assertEqual(rupture.occurrence_rate, 3.0 / 8.0)
+
+    def test_sample_ruptures(self):
+        source = self.make_area_source(Polygon([Point(-2, -2), Point(0, -2),
+                                                Point(0, 0), Point(-2, 0)]),
+                                       discretization=66.7,
+                                       rupture_mesh_spacing=5)
+        source.min_mag = 6
+        num_ses = 100_000
+        sampled = list(source.sample_ruptures(num_ses, ses_seed=42))
+        # with so many SES all the ruptures with magnitude 6.5 occur
+        ruptures = [rup for rup in source.iter_ruptures() if rup.mag > 6]
+        self.assertEqual(len(sampled), len(ruptures))  # 9 * 2 ruptures
+        for (rup, et_id, num_occ), exp in zip(sampled, ruptures):
+            self.assertEqual(rup.mag, exp.mag)
+            self.assertAlmostEqual(rup.occurrence_rate, exp.occurrence_rate)
+            self.assertEqual(rup.hypocenter, exp.hypocenter)
+            aac(rup.surface.corner_lons, exp.surface.corner_lons, atol=1E-4)
+            aac(rup.surface.corner_lats, exp.surface.corner_lats, atol=1E-4)
+            aac(rup.surface.corner_depths, exp.surface.corner_depths)
+            # expected number of occurrences 5E-5 * 50 * 100_000 = 250
+            self.assertGreater(num_occ, 150)
+            self.assertLess(num_occ, 350)
+
+        # the sampling is reproducible
+        again = list(source.sample_ruptures(num_ses, ses_seed=42))
+        self.assertEqual([n for _, _, n in again], [n for _, _, n in sampled])
@@ -13,7 +13,9 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pickle
 import unittest
+from unittest import mock
 
 import numpy
 
@@ -21,6 +23,7 @@ from openquake.hazardlib.source.complex_fault import (ComplexFaultSource,
                                                       _float_ruptures)
 from openquake.hazardlib.geo import Line, Point
 from openquake.hazardlib.geo.surface.simple_fault import SimpleFaultSurface
+from openquake.hazardlib.geo.surface.complex_fault import ComplexFaultSurface
 from openquake.hazardlib.scalerel.peer import PeerMSR
 from openquake.hazardlib.mfd import EvenlyDiscretizedMFD
 from openquake.hazardlib.tom import PoissonTOM
@@ -363,3 +366,34 @@ class ModifyComplexFaultGeometryTestCase(unittest.TestCase):
                                    exp_lats_bot[iloc])
             self.assertAlmostEqual(fault.edges[1].points[iloc].depth,
                                    exp_depths_bot[iloc])
+
+    def test_geometry_cache(self):
+        self.mfd = EvenlyDiscretizedMFD(6.5, 0.5, [1.0, 0.5])
+        fault = self._make_source(self.edges)
+        expected = [(rup.mag, rup.surface.mesh.lons.tolist())
+                    for rup in fault.iter_ruptures()]
+        fault = self._make_source(self.edges)
+        with mock.patch.object(ComplexFaultSurface, 'from_fault_data',
+                               wraps=ComplexFaultSurface.from_fault_data) \
+                as from_fault_data:
+            num_rups = fault.count_ruptures()
+            splits = list(fault)
+            rups = [(rup.mag, rup.surface.mesh.lons.tolist())
+                    for rup in fault.iter_ruptures()]
+            for src in splits:
+                src.count_ruptures()
+            pik = pickle.loads(pickle.dumps(splits[0]))
+            self.assertEqual(len(list(pik.iter_ruptures())),
+                             splits[0].num_ruptures)
+        # the whole fault surface is built only once
+        self.assertEqual(from_fault_data.call_count, 1)
+        self.assertEqual(rups, expected)
+        self.assertEqual(num_rups, len(rups))
+
+        # modifying the geometry invalidates the cache
+        top_edge_2 = Line([Point(29.9, 30.0, 2.0), Point(31.1, 30.0, 2.1)])
+        bottom_edge_2 = Line([Point(29.6, 29.9, 29.0),
+                              Point(31.4, 29.9, 33.0)])
+        fault.modify_set_geometry([top_edge_2, bottom_edge_2], self.spacing)
+        lons = fault._get_geometry()['mesh'].lons
+        self.assertAlmostEqual(lons[0, 0], 29.9)
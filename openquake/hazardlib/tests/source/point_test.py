@@ -14,8 +14,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+from unittest import mock
 import numpy
 from openquake.hazardlib.const import TRT
+from openquake.hazardlib.source import point
 from openquake.hazardlib.source.point import PointSource, CollapsedPointSource
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 from openquake.hazardlib.mfd import TruncatedGRMFD, EvenlyDiscretizedMFD
@@ -412,6 +414,63 @@ class PointSourceIterRupturesTestCase(unittest.TestCase):
         self.assertEqual(len(ruptures), 1)
 
 
+class RuptureTemplateTestCase(unittest.TestCase):
+    def test_same_as_iter_ruptures(self):
+        np_dist = PMF([(0.5, NodalPlane(1, 20, 3)),
+                       (0.5, NodalPlane(92, 90, 4))])
+        hc_dist = PMF([(0.5, 1.5), (0.5, 4.5)])
+        src = make_point_source(nodal_plane_distribution=np_dist,
+                                hypocenter_distribution=hc_dist)
+        arr = src.get_rupture_arrays()
+        rups = list(src.iter_ruptures(shift_hypo=True))
+        self.assertEqual(len(rups), 8)
+        for u, rup in enumerate(rups):
+            self.assertEqual(arr['mag'][u], rup.mag)
+            self.assertEqual(arr['rake'][u], rup.rake)
+            self.assertEqual(arr['occurrence_rate'][u], rup.occurrence_rate)
+            numpy.testing.assert_equal(arr['corners'][u], [
+                rup.surface.corner_lons, rup.surface.corner_lats,
+                rup.surface.corner_depths])
+            numpy.testing.assert_equal(arr['center'][u], [
+                rup.hypocenter.x, rup.hypocenter.y, rup.hypocenter.z])
+        self.assertEqual(arr['hypo'][:, 2].tolist(), [1.5, 4.5] * 4)
+        self.assertEqual(src.get_rupture_arrays(mag=7), {})
+
+    def test_shared_templates(self):
+        # point sources with the same parameters in different locations
+        # share the same templates and have translated ruptures
+        ps1 = make_point_source(lon=1.2, lat=3.4)
+        ps2 = make_point_source(lon=1.3, lat=3.4)
+        [tmpl1, tmpl2] = [point.get_rupture_template(
+            ps, 3.5, NodalPlane(1, 2, 3), 4) for ps in (ps1, ps2)]
+        self.assertIs(tmpl1, tmpl2)
+        c1 = ps1.get_rupture_arrays()['corners']
+        c2 = ps2.get_rupture_arrays()['corners']
+        aac(c2[:, 0] - c1[:, 0], .1)  # longitudes
+        aac(c2[:, 1:], c1[:, 1:])  # latitudes and depths
+
+    @mock.patch.object(point, 'MAX_TEMPLATES', 2)
+    @mock.patch.dict(point._templates, clear=True)
+    def test_template_cache(self):
+        ps = make_point_source()
+        tmpl = [point.get_rupture_template(ps, mag, NodalPlane(1, 2, 3), 4)
+                for mag in (3.5, 4.5)]
+        # a hit makes the template the most recent one
+        self.assertIs(point.get_rupture_template(
+            ps, 3.5, NodalPlane(1, 2, 3), 4), tmpl[0])
+        point.get_rupture_template(ps, 5.5, NodalPlane(1, 2, 3), 4)
+        self.assertEqual(len(point._templates), 2)
+        self.assertEqual([key[0] for key in point._templates], [3.5, 5.5])
+
+        # MSR classes with the same name do not share templates
+        class PeerMSR(WC1994):
+            pass
+        ps2 = make_point_source()
+        ps2.magnitude_scaling_relationship = PeerMSR()
+        tmpl2 = point.get_rupture_template(ps2, 3.5, NodalPlane(1, 2, 3), 4)
+        self.assertFalse(numpy.allclose(tmpl2, tmpl[0]))
+
+
 class PointSourceMaxRupProjRadiusTestCase(unittest.TestCase):
     def test(self):
         mfd = TruncatedGRMFD(a_val=1, b_val=2, min_mag=3,
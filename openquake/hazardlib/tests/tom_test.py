@@ -17,7 +17,7 @@ import unittest
 
 import numpy
 
-from openquake.hazardlib.tom import PoissonTOM
+from openquake.hazardlib.tom import PoissonTOM, get_pnes
 
 
 class PoissonTOMTestCase(unittest.TestCase):
@@ -66,3 +66,15 @@ class PoissonTOMTestCase(unittest.TestCase):
             numpy.array([[0.6376282, 0.6703200, 0.7046881],
                          [0.7408182, 0.7788008, 0.8187308]])
         )
+
+    def test_get_pnes(self):
+        # two Poissonian ruptures and a nonparametric one
+        tom = PoissonTOM(50.)
+        rate = numpy.array([.01, numpy.nan, .02])
+        probs = numpy.array([[0, 0, 0], [.7, .2, .1], [0, 0, 0]])
+        poes = numpy.array([[[0.9], [0.8]], [[0.6], [0.5]], [[0.3], [0.2]]])
+        pnes = get_pnes(rate, probs, poes, tom.time_span)
+        aac = numpy.testing.assert_allclose
+        aac(pnes[0], tom.get_probability_no_exceedance(.01, poes[0]))
+        aac(pnes[1], [[.7 + .2 * .4 + .1 * .16], [.7 + .2 * .5 + .1 * .25]])
+        aac(pnes[2], tom.get_probability_no_exceedance(.02, poes[2]))
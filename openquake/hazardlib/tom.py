@@ -186,3 +186,41 @@ class PoissonTOM(BaseTOM):
 ￼            levels.
         """
         return numpy.exp(- occurrence_rate * self.time_span * poes)
+
+
+def get_pnes(rate, probs, poes, time_span):
+    """
+    Batched version of `get_probability_no_exceedance` for a block of
+    Poissonian and nonparametric ruptures.
+
+    :param rate:
+        An array of N occurrence rates, NaN for nonparametric ruptures
+    :param probs:
+        An array of shape (N, P) with the probabilities of the
+        nonparametric ruptures to occur 0, 1, ..., P-1 times in the time
+        span (zero-padded); it can be None if there are no such ruptures
+    :param poes:
+        An array of shape (N, L, G) with the conditional probabilities of
+        exceedance
+    :param time_span:
+        The time span of the Poissonian ruptures, in years
+    :return:
+        An array of shape (N, L, G) with the probabilities of no exceedance
+    """
+    nonpar = numpy.isnan(rate)
+    if not nonpar.any():  # all Poissonian
+        return numpy.exp(-(rate * time_span)[:, None, None] * poes)
+    pnes = numpy.empty_like(poes)
+    par = ~nonpar
+    if par.any():
+        pnes[par] = numpy.exp(
+            -(rate[par] * time_span)[:, None, None] * poes[par])
+    # Uses the formula ∑ p(k|T) * p(X<x|rup)^k, see
+    # :meth:`openquake.hazardlib.contexts.RuptureContext.
+    # get_probability_no_exceedance`
+    ok = 1. - poes[nonpar]
+    pnes_nonpar = numpy.zeros_like(ok)
+    for i, prob in enumerate(probs[nonpar].T):
+        pnes_nonpar += prob[:, None, None] * ok ** i
+    pnes[nonpar] = numpy.clip(pnes_nonpar, 0., 1.)  # avoid numeric issues
+    return pnes
@@ -21,13 +21,36 @@ import numpy
 import pandas
 
 from openquake.baselib import hdf5
-from openquake.baselib.general import group_array, AccumDict
+from openquake.baselib.general import (
+    group_array, AccumDict, humansize, counter_uniform)
+from openquake.baselib.performance import Monitor
 from openquake.risklib import scientific
+from openquake.risklib.riskmodels import get_values
 
 U32 = numpy.uint32
 F32 = numpy.float32
 
 
+def read_eps(tempname):
+    """
+    :param tempname: hdf5 file where the epsilons are (or None)
+    :returns: a read-only memory map over the (A, E) epsilon matrix (or None)
+
+    The epsilon matrix is stored contiguously by :func:`cache_epsilons`,
+    so it can be memory-mapped and fancy-indexed, reading only the pages
+    containing the requested (asset, event) pairs.
+    """
+    if tempname is None:
+        return
+    with hdf5.File(tempname, 'r') as h5:
+        dset = h5['epsilon_matrix']
+        offset = dset.id.get_offset()
+        if offset is None:  # chunked or empty dataset, read it in memory
+            return dset[()]
+        shape, dtype = dset.shape, dset.dtype
+    return numpy.memmap(tempname, dtype, 'r', offset, shape)
+
+
 def get_assets_by_taxo(assets, tempname=None):
     """
     :param assets: an array of assets
@@ -42,11 +65,9 @@ def get_assets_by_taxo(assets, tempname=None):
     if tempname is None:  # no epsilons
         return assets_by_taxo
     # otherwise read the epsilons and group them by taxonomy
-    with hdf5.File(tempname, 'r') as h5:
-        dset = h5['epsilon_matrix']
-        for taxo, assets in assets_by_taxo.items():
-            lst = [dset[aid] for aid in assets['ordinal']]
-            assets_by_taxo.eps[taxo] = numpy.array(lst)
+    eps = read_eps(tempname)
+    for taxo, assets in assets_by_taxo.items():
+        assets_by_taxo.eps[taxo] = numpy.array(eps[assets['ordinal']])
     return assets_by_taxo
 
 
@@ -56,6 +77,12 @@ def get_output(crmodel, assets_by_taxo, haz, rlzi=None):
     :param haz: an array or a dictionary of hazard on that site
     :param rlzi: if given, a realization index
     :returns: an ArrayWrapper loss_type -> array of shape (A, ...)
+
+    The hazard can contain the events of many realizations: in that case
+    the events are ordered by realization and the risk models are called
+    once per taxonomy on all the events, except for the BT and PM
+    distributions that are sampled realization by realization, to get the
+    same numbers as with separate calls; see :func:`split_by_rlz`.
     """
     primary = crmodel.primary_imtls
     alias = {imt: 'gmv_%d' % i for i, imt in enumerate(primary)}
@@ -73,12 +100,18 @@ def get_output(crmodel, assets_by_taxo, haz, rlzi=None):
         # sample method would receive the means in random
         # order and produce random results even if the
         # seed is set correctly; very tricky indeed! (MS)
-        haz = haz.sort_values('eid')
+        haz = haz.sort_values(['rlz', 'eid'])
         eids = haz.eid.to_numpy()
         data = haz
     else:  # ZeroGetter for this site (event based)
         eids = numpy.arange(1)
         data = {f'gmv_{m}': [0] for m, imt in enumerate(primary)}
+    if len(eids) and 'rlz' in data:  # slices of events by realization
+        _, starts = numpy.unique(data.rlz.to_numpy(), return_index=True)
+        slices = [slice(start, stop) for start, stop in zip(
+            starts, list(starts[1:]) + [len(eids)])]
+    else:
+        slices = [slice(None)]
     dic = dict(eids=eids, assets=assets_by_taxo.assets,
                loss_types=crmodel.loss_types, haz=haz)
     if rlzi is not None:
@@ -97,7 +130,14 @@ def get_output(crmodel, assets_by_taxo, haz, rlzi=None):
                 dat = data[alias.get(imt, imt)]
                 if hasattr(dat, 'to_numpy'):
                     dat = dat.to_numpy()
-                arrays.append(rm(lt, assets_, dat, eids, epsilons))
+                vf = rm.risk_functions.get((lt, 'vulnerability'))
+                if len(slices) == 1 or vf is None or _batchable(vf):
+                    arrays.append(rm(lt, assets_, dat, eids, epsilons))
+                else:  # call the risk model realization by realization
+                    arrays.append(numpy.concatenate(
+                        [rm(lt, assets_, dat[slc], eids[slc],
+                            epsilons[:, slc] if len(epsilons) else ())
+                         for slc in slices], axis=1))
             res = arrays[0] if len(arrays) == 1 else numpy.average(
                 arrays, weights=weights, axis=0)
             ls.append(res)
@@ -106,6 +146,153 @@ def get_output(crmodel, assets_by_taxo, haz, rlzi=None):
     return hdf5.ArrayWrapper((), dic)
 
 
+def split_by_rlz(out):
+    """
+    :param out: an output of :func:`get_output` with many realizations
+    :yields: an output for each realization, with attribute .rlzi
+    """
+    rlzs = out.haz.rlz.to_numpy()
+    uniq, starts = numpy.unique(rlzs, return_index=True)
+    for rlz, start, stop in zip(uniq, starts, list(starts[1:]) + [len(rlzs)]):
+        dic = dict(eids=out.eids[start:stop], assets=out.assets,
+                   loss_types=out.loss_types, haz=out.haz.iloc[start:stop],
+                   rlzi=rlz)
+        for lt in out.loss_types:
+            dic[lt] = out[lt][:, start:stop]
+        yield hdf5.ArrayWrapper((), dic)
+
+
+def _ranges(starts, counts):
+    # concatenation of the ranges [start, start + count)
+    cum = numpy.cumsum(counts) - counts
+    return numpy.arange(cum[-1] + counts[-1]) + numpy.repeat(
+        starts - cum, counts)
+
+
+def _batchable(vf):
+    # the BT and PM distributions reseed the global random generator at
+    # each call, so sampling them on a batch would change the numbers
+    return (vf.distribution_name == 'LN' or
+            vf.distribution_name != 'PM' and not (vf.covs > 0).any())
+
+
+def _sample_losses(vf, values, gmvs, epsilons, uniforms=None):
+    # flat version of RiskModel.event_based_risk
+    means, covs, idxs = vf.interpolate(gmvs)
+    ratios = numpy.zeros(len(gmvs))
+    if uniforms is not None:  # counter-based sampling
+        ratios[idxs] = vf.sample_uniform(means, covs, uniforms[idxs])
+    elif len(epsilons):
+        ratios[idxs] = vf.sample(means, covs, idxs, epsilons)
+    else:
+        ratios[idxs] = vf.sample(
+            means, covs, idxs, numpy.zeros(len(means), F32))
+    return ratios * values
+
+
+def get_outputs(crmodel, assets, haz, tempname=None, monitor=Monitor(),
+                counter_based=False):
+    """
+    Taxonomy-major version of :func:`get_output` working on many sites.
+    The vulnerability functions are called once per taxonomy on all the
+    (asset, event) pairs, except for the BT and PM distributions that are
+    sampled site by site, to get the same numbers as in :func:`get_output`.
+    If `counter_based` is set, all the distributions are sampled in a
+    batch with uniform numbers keyed by (seed, asset ordinal, event ID),
+    or by (seed, event ID) if the assets are fully correlated, and the
+    epsilons in `tempname` are not used.
+
+    :param crmodel: a CompositeRiskModel instance
+    :param assets: an array of assets ordered by site_id
+    :param haz: a DataFrame of GMFs with fields sid, eid, rlz, gmv_...
+    :param tempname: hdf5 file where the epsilons are (or None)
+    :param monitor: a Monitor instance, used to measure the epsilon reads
+    :param counter_based: if True, use a counter-based random generator
+    :yields: an ArrayWrapper for each site with assets and hazard
+    """
+    haz = haz.sort_values(['sid', 'eid'])
+    eids = haz.eid.to_numpy()
+    sids, hstart, hcount = numpy.unique(
+        haz.sid.to_numpy(), return_index=True, return_counts=True)
+    assets = assets[numpy.isin(assets['site_id'], sids)]
+    if len(assets) == 0:
+        return
+    pos = numpy.searchsorted(sids, assets['site_id'])
+    nevents = hcount[pos]  # number of events for each asset
+    astart = numpy.zeros(len(assets) + 1, int)
+    astart[1:] = numpy.cumsum(nevents)
+    primary = crmodel.primary_imtls
+    alias = {imt: 'gmv_%d' % i for i, imt in enumerate(primary)}
+    gmvs = {col: haz[col].to_numpy() for col in haz.columns
+            if col.startswith('gmv_')}
+    losses = {lt: numpy.zeros(astart[-1]) for lt in crmodel.loss_types}
+    eps = None if counter_based else read_eps(tempname)
+    ordinals = assets['ordinal']
+    if counter_based:
+        correlated = crmodel.oqparam.asset_correlation
+    order = numpy.argsort(assets['taxonomy'], kind='stable')
+    taxonomies, tstart = numpy.unique(
+        assets['taxonomy'][order], return_index=True)
+    for taxonomy, aidx in zip(taxonomies, numpy.split(order, tstart[1:])):
+        counts = nevents[aidx]
+        pidx = _ranges(astart[aidx], counts)  # pair indices
+        hidx = _ranges(hstart[pos[aidx]], counts)  # hazard indices
+        local = numpy.repeat(numpy.arange(len(aidx)), counts)
+        # the assets of a site are contiguous in aidx
+        splits = numpy.flatnonzero(numpy.diff(pos[aidx])) + 1
+        rmodels, weights = crmodel.get_rmodels_weights(taxonomy)
+        for lt in crmodel.loss_types:
+            arrays = []
+            for rm in rmodels:
+                imt = rm.imt_by_lt[lt]
+                dat = gmvs[alias.get(imt, imt)]
+                vf = rm.risk_functions[lt, 'vulnerability']
+                if counter_based:
+                    values = get_values(lt, assets[aidx], rm.time_event)
+                    uniforms = counter_uniform(vf.seed, eids[hidx]) if (
+                        correlated) else counter_uniform(
+                            vf.seed, ordinals[aidx][local], eids[hidx])
+                    arrays.append(_sample_losses(
+                        vf, values[local], dat[hidx], (), uniforms))
+                    continue
+                elif _batchable(vf):
+                    values = get_values(lt, assets[aidx], rm.time_event)
+                    if eps is None:
+                        epsilons = ()
+                    else:  # read only the needed (asset, event) pairs
+                        with monitor('reading epsilons', measuremem=True):
+                            epsilons = eps[ordinals[aidx][local], eids[hidx]]
+                    arrays.append(_sample_losses(
+                        vf, values[local], dat[hidx], epsilons))
+                    continue
+                ls = []
+                for idx in numpy.split(numpy.arange(len(aidx)), splits):
+                    p = pos[aidx[idx[0]]]
+                    slc = slice(hstart[p], hstart[p] + hcount[p])
+                    if eps is None:
+                        epsilons = ()
+                    else:
+                        with monitor('reading epsilons', measuremem=True):
+                            epsilons = eps[numpy.ix_(
+                                ordinals[aidx[idx]], eids[slc])]
+                    ls.append(rm(lt, assets[aidx[idx]], dat[slc], eids[slc],
+                                 epsilons).flatten())
+                arrays.append(numpy.concatenate(ls))
+            losses[lt][pidx] = arrays[0] if len(arrays) == 1 else (
+                numpy.average(arrays, weights=weights, axis=0))
+    # yield the outputs site by site, as views over the losses arrays
+    _, astarts = numpy.unique(pos, return_index=True)
+    for a0, a1 in zip(astarts, list(astarts[1:]) + [len(assets)]):
+        p = pos[a0]
+        slc = slice(hstart[p], hstart[p] + hcount[p])
+        dic = dict(eids=eids[slc], assets=assets[a0:a1],
+                   loss_types=crmodel.loss_types, haz=haz[slc])
+        for lt in crmodel.loss_types:
+            dic[lt] = losses[lt][astart[a0]:astart[a1]].reshape(
+                a1 - a0, hcount[p])
+        yield hdf5.ArrayWrapper((), dic)
+
+
 class RiskInput(object):
     """
     Contains all the assets and hazard values associated to a given
@@ -139,14 +326,17 @@ class RiskInput(object):
             with monitor('getting hazard', measuremem=False):
                 haz = hazard_getter.get_hazard()
         with monitor('computing risk', measuremem=False):
-            # this approach is slow for event_based_risk since a lot of
-            # small arrays are passed (one per realization) instead of
-            # a long array with all realizations; ebrisk does the right
-            # thing since it calls get_output directly
             assets_by_taxo = get_assets_by_taxo(self.assets, tempname)
-            if hasattr(haz, 'groupby'):  # DataFrame
+            if hasattr(haz, 'groupby') and not (
+                    set(haz.columns) - {'sid', 'eid', 'rlz'}):
+                # ZeroGetter, i.e. one zero ground motion per realization
                 for (sid, rlz), df in haz.groupby(['sid', 'rlz']):
                     yield get_output(crmodel, assets_by_taxo, df, rlz)
+            elif hasattr(haz, 'groupby'):  # DataFrame
+                # the realizations are computed together and then split
+                for sid, df in haz.groupby('sid'):
+                    yield from split_by_rlz(
+                        get_output(crmodel, assets_by_taxo, df))
             else:  # list of probability curves
                 for rlz, pc in enumerate(haz):
                     yield get_output(crmodel, assets_by_taxo, pc, rlz)
@@ -187,7 +377,6 @@ def cache_epsilons(dstore, oq, assetcol, crmodel, E):
     if oq.ignore_covs or not crmodel.covs or 'LN' not in crmodel.distributions:
         return
     A = len(assetcol)
-    logging.info('Storing the epsilon matrix in %s', dstore.tempname)
     if oq.calculation_mode == 'scenario_risk':
         eps = make_eps(assetcol.array, E, oq.master_seed, oq.asset_correlation)
     else:  # event based
@@ -200,9 +389,12 @@ def cache_epsilons(dstore, oq, assetcol, crmodel, E):
             for i, seed in enumerate(seeds):
                 numpy.random.seed(seed)
                 eps[:, i] = numpy.random.normal(size=A)
+    logging.info('Storing the epsilon matrix %s (%s) in %s', eps.shape,
+                 humansize(eps.nbytes), dstore.tempname)
     with hdf5.File(dstore.tempname, 'w') as cache:
         cache['sitecol'] = dstore['sitecol']
-        cache['epsilon_matrix'] = eps
+        # contiguous and uncompressed, to be memory-mapped by read_eps
+        cache.create_dataset('epsilon_matrix', data=eps)
     return dstore.tempname
 
 
@@ -29,9 +29,9 @@ from functools import lru_cache
 import numpy
 import pandas
 from numpy.testing import assert_equal
-from scipy import interpolate, stats, random
+from scipy import interpolate, special, stats, random
 
-from openquake.baselib.general import CallableDict, AccumDict
+from openquake.baselib.general import CallableDict
 from openquake.hazardlib.stats import compute_stats2
 
 F64 = numpy.float64
@@ -206,6 +206,25 @@ class VulnerabilityFunction(object):
         res = self._distribution.sample(means, covs, means * covs, idxs)
         return res
 
+    def sample_uniform(self, means, covs, uniforms):
+        """
+        Counter-based version of :meth:`sample`, applying the inverse
+        cumulative distribution function to the given uniform numbers.
+
+        :param means:
+           array of E' loss ratios
+        :param covs:
+           array of E' floats
+        :param uniforms:
+           array of E' numbers in the interval (0, 1)
+        :returns:
+           array of E' loss ratios
+        """
+        if not (self.covs > 0).any():
+            return means
+        return DISTRIBUTIONS[self.distribution_name]().ppf(
+            means, covs, means * covs, uniforms)
+
     # this is used in the tests, not in the engine code base
     def __call__(self, gmvs, epsilons):
         """
@@ -432,6 +451,24 @@ class VulnerabilityFunctionWithPMF(VulnerabilityFunction):
         self.set_distribution(epsilons)
         return self._distribution.sample(self.loss_ratios, probs)
 
+    def sample_uniform(self, probs, _covs, uniforms):
+        """
+        Counter-based version of :meth:`sample`, inverting the discrete
+        cumulative distribution on the given uniform numbers.
+
+        :param probs:
+           array of shape (M, E') with the probabilities of the loss ratios
+        :param _covs:
+           ignored, it is there only for API consistency
+        :param uniforms:
+           array of E' numbers in the interval (0, 1)
+        :returns:
+           array of E' loss ratios
+        """
+        cumprobs = probs.cumsum(axis=0)
+        idx = (cumprobs < uniforms * cumprobs[-1]).sum(axis=0)
+        return self.loss_ratios[numpy.minimum(idx, len(self.loss_ratios) - 1)]
+
     @lru_cache()
     def loss_ratio_exceedance_matrix(self, loss_ratios):
         """
@@ -746,6 +783,9 @@ class DegenerateDistribution(Distribution):
     def sample(self, means, _covs, _stddev, _idxs):
         return means
 
+    def ppf(self, means, _covs, _stddevs, _uniforms):
+        return means
+
     def survival(self, loss_ratio, mean, _stddev):
         return numpy.piecewise(
             loss_ratio, [loss_ratio > mean or not mean], [0, 1])
@@ -793,6 +833,14 @@ class LogNormalDistribution(Distribution):
         probs = means / numpy.sqrt(1 + covs ** 2) * numpy.exp(eps * sigma)
         return probs
 
+    def ppf(self, means, covs, _stddevs, uniforms):
+        """
+        :returns: the loss ratios corresponding to the given uniform numbers
+        """
+        sigma = numpy.sqrt(numpy.log(covs ** 2.0 + 1.0))
+        return means / numpy.sqrt(1 + covs ** 2) * numpy.exp(
+            special.ndtri(uniforms) * sigma)
+
     def survival(self, loss_ratio, mean, stddev):
         # scipy does not handle correctly the limit case stddev = 0.
         # In that case, when `mean` > 0 the survival function
@@ -839,6 +887,13 @@ class BetaDistribution(Distribution):
         res = numpy.random.beta(alpha, beta, size=None)
         return res
 
+    def ppf(self, means, _covs, stddevs, uniforms):
+        """
+        :returns: the loss ratios corresponding to the given uniform numbers
+        """
+        return stats.beta.ppf(uniforms, self._alpha(means, stddevs),
+                              self._beta(means, stddevs))
+
     def survival(self, loss_ratio, mean, stddev):
         return stats.beta.sf(loss_ratio,
                              self._alpha(mean, stddev),
@@ -1318,7 +1373,6 @@ def losses_by_period(losses, return_periods, num_events=None, eff_time=None):
     >>> losses_by_period(losses, [1, 2, 5, 10, 20, 50, 100], 20)
     array([ 0. ,  0. ,  0. ,  3.5,  8. , 13. , 23. ])
     """
-    P = len(return_periods)
     assert len(losses)
     if isinstance(losses, list):
         losses = numpy.array(losses)
@@ -1326,31 +1380,96 @@ def losses_by_period(losses, return_periods, num_events=None, eff_time=None):
     num_losses = losses.shape[-1]
     if num_events is None:
         num_events = num_losses
-    elif num_events < num_losses:
-        raise ValueError(
-            'There are not enough events (%d<%d) to compute the loss curve'
-            % (num_events, num_losses))
     if eff_time is None:
         eff_time = return_periods[-1]
-    losses = numpy.sort(losses)
-    # num_losses < num_events: just add zeros
-    num_zeros = num_events - num_losses
-    if num_zeros:
-        newlosses = numpy.zeros(shp + (num_events,), losses.dtype)
-        newlosses[..., num_events-num_losses:num_events] = losses
-        losses = newlosses
-    periods = eff_time / numpy.arange(num_events, 0., -1)
-    num_left = sum(1 for rp in return_periods if rp < periods[0])
-    num_right = sum(1 for rp in return_periods if rp > periods[-1])
-    rperiods = [rp for rp in return_periods if periods[0] <= rp <= periods[-1]]
-    curve = numpy.zeros(shp + (len(return_periods),), losses.dtype)
-    logr, logp = numpy.log(rperiods), numpy.log(periods)
-    for idx, _ in numpy.ndenumerate(losses[..., 0]):
-        tup = idx + (slice(num_left, P-num_right),)
-        curve[tup] = numpy.interp(logr, logp, losses[idx])
-        tup = idx + (slice(P-num_right, None),)
-        curve[tup] = numpy.nan
-    return curve
+    G = int(numpy.prod(shp))
+    offsets = numpy.arange(G + 1) * num_losses
+    curves = losses_by_periods(
+        losses.reshape(-1), offsets, return_periods,
+        numpy.full(G, num_events), eff_time)
+    return curves.reshape(shp + (len(return_periods),))
+
+
+def _sort_groups(losses, offsets, counts):
+    # sort the losses group by group; the groups are split in classes of
+    # similar size and each class is sorted as a matrix padded with -inf
+    out = numpy.zeros_like(losses)
+    sizecls = numpy.ceil(numpy.log2(numpy.maximum(counts, 1))).astype(int)
+    for c in numpy.unique(sizecls):
+        gs = numpy.flatnonzero(sizecls == c)
+        cnt = counts[gs][:, None]
+        cols = numpy.arange(cnt.max())
+        mat = numpy.full((len(gs), len(cols)), -numpy.inf, losses.dtype)
+        inside = cols < cnt
+        idx = (offsets[gs][:, None] + cols)[inside]
+        mat[inside] = losses[idx]
+        mat.sort(axis=1)
+        out[idx] = mat[cols >= len(cols) - cnt]
+    return out
+
+
+def losses_by_periods(losses, offsets, return_periods, num_events, eff_time):
+    """
+    Vectorized version of :func:`losses_by_period` for G groups of losses
+    of different lengths, stored in a flat array. The groups are sorted
+    in a few passes (one per class of groups of similar size) and the
+    interpolation on the logarithmic grid of the periods is performed in
+    a single pass, returning the same numbers as `numpy.interp`.
+
+    :param losses: a flat array with the losses of all groups
+    :param offsets: an array of G + 1 offsets in the array of losses
+    :param return_periods: P ordered return periods
+    :param num_events: an array of G numbers of events (>= number of losses)
+    :param eff_time: investigation_time * ses_per_logic_tree_path
+    :returns: an array of shape (G, P), possibly with NaN
+
+    >>> losses = [3, 2, 3.5, 4, 3, 23, 11, 2, 1, 4, 5, 7, 8, 9, 13,
+    ...           4, 1, 2, 5, 3]
+    >>> losses_by_periods(losses, [0, 15, 20], [1, 2, 5, 10, 20], [20, 10], 20)
+    array([[ 0. ,  3.5,  9. , 13. , 23. ],
+           [ 0. ,  0. ,  2. ,  4. ,  5. ]])
+    """
+    losses = numpy.asarray(losses)
+    offsets = numpy.asarray(offsets)
+    counts = numpy.diff(offsets)
+    N = numpy.asarray(num_events)[:, None]  # shape (G, 1)
+    if (N[:, 0] < counts).any():
+        raise ValueError(
+            'There are not enough events (%d<%d) to compute the loss curve'
+            % min(zip(N[:, 0] - counts, N[:, 0], counts))[1:])
+    losses = _sort_groups(
+        losses.astype(numpy.result_type(losses.dtype, F32)), offsets, counts)
+    # the groups are padded on the left with num_events - num_losses zeros
+    rperiods = numpy.array(return_periods, float)
+    logr = numpy.log(rperiods)
+
+    def logp(j):  # logarithm of the j-th period of each group
+        return numpy.log(eff_time / (N - j).astype(float))
+
+    def getloss(j):  # j-th loss of each group after padding
+        pos = j - (N - counts[:, None])
+        ok = pos >= 0
+        out = numpy.zeros(j.shape)
+        out[ok] = losses[(offsets[:-1, None] + pos)[ok]]
+        return out
+
+    # index j of the period on the left: periods[j] <= rp < periods[j + 1]
+    left, right = numpy.broadcast_arrays(
+        rperiods < eff_time / N, rperiods > eff_time)  # zeros, NaNs
+    j = numpy.floor(N - eff_time / rperiods).astype(int)
+    j = numpy.clip(j, 0, N - 1)
+    j[logp(j) > logr] -= 1  # correct the rounding errors
+    j = numpy.clip(j, 0, N - 1)
+    j[(j < N - 1) & (logp(numpy.minimum(j + 1, N - 1)) <= logr)] += 1
+    # same formula as in numpy.interp
+    j1 = numpy.minimum(j + 1, N - 1)
+    xj, fj, fj1 = logp(j), getloss(j), getloss(j1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        slope = (fj1 - fj) / (logp(j1) - xj)
+        curves = numpy.where(j1 > j, slope * (logr - xj) + fj, fj)
+    curves[left & ~right] = 0
+    curves[right] = numpy.nan
+    return curves.astype(numpy.result_type(losses.dtype, F32))
 
 
 class LossCurvesMapsBuilder(object):
@@ -1418,17 +1537,33 @@ class LossCurvesMapsBuilder(object):
         return losses_by_period(
             losses, self.return_periods, self.num_events[rlzi], self.eff_time)
 
+    # used in post_risk
+    def build_all_curves(self, losses, offsets, rlzs):
+        """
+        :param losses: a flat array with the losses of G groups
+        :param offsets: an array of G + 1 offsets in the array of losses
+        :param rlzs: an array of G realization indices
+        :returns: an array of loss curves of shape (G, P)
+        """
+        num_events = numpy.array([self.num_events[r] for r in rlzs])
+        return losses_by_periods(losses, offsets, self.return_periods,
+                                 num_events, self.eff_time)
+
 
-class AggLossTable(AccumDict):
+class AggLossTable(object):
     """
-    A dictionary of matrices of shape L', with L' the total number of loss
-    types (primary + secondary).
+    An event loss table with a row for each pair (event ID, aggregation
+    index) and a column for each loss type (primary + secondary), stored
+    as a list of partial tables which are summed together when needed.
+    The partial tables are compacted when they exceed `maxsize` bytes.
+
     :param aggkey: a dictionary tuple -> integer
     :param loss_types: a list of primary loss types
     :param sec_losses: a list of SecondaryLosses (can be empty)
+    :param maxsize: the maximum size in bytes of the partial tables
     """
     @classmethod
-    def new(cls, aggkey, loss_types, sec_losses=()):
+    def new(cls, aggkey, loss_types, sec_losses=(), maxsize=1E9):
         self = cls()
         self.aggkey = {key: k for k, key in enumerate(aggkey)}
         self.aggkey[()] = len(aggkey)
@@ -1436,68 +1571,131 @@ class AggLossTable(AccumDict):
         self.sec_losses = sec_losses
         for sec_loss in sec_losses:
             self.loss_names.extend(sec_loss.outputs)
-        self.accum = numpy.zeros(len(self.loss_names), F32)
+        self.maxsize = maxsize
+        self.clear()
+        return self
+
+    def __copy__(self):
+        new = object.__new__(self.__class__)
+        vars(new).update(vars(self))
+        new.partials = list(self.partials)
+        return new
+
+    def __iadd__(self, other):
+        self.partials.extend(other.partials)
+        self.nbytes += other.nbytes
+        if self.nbytes > self.maxsize:
+            self.compact()
         return self
 
+    def clear(self):
+        """
+        Remove all the rows of the table
+        """
+        self.partials = []  # triples (eids, aggids, losses)
+        self.nbytes = 0
+
+    def add(self, eids, aggids, losses):
+        """
+        Add a partial table
+
+        :param eids: an array of n event IDs
+        :param aggids: an array of n aggregation indices
+        :param losses: an array of shape (n, L')
+        """
+        self.partials.append((U32(eids), U32(aggids), losses))
+        self.nbytes += losses.nbytes + 8 * len(eids)
+        if self.nbytes > self.maxsize:
+            self.compact()
+
+    def compact(self):
+        """
+        Sum the partial tables into a single table ordered by event ID
+        and aggregation index
+        """
+        if not self.partials:
+            return
+        eids, aggids, losses = zip(*self.partials)
+        K1 = len(self.aggkey)
+        keys = numpy.concatenate(eids).astype(numpy.int64) * K1
+        keys += numpy.concatenate(aggids)
+        uniq, inv = numpy.unique(keys, return_inverse=True)
+        losses = numpy.concatenate(losses)
+        summed = numpy.zeros((len(uniq), len(self.loss_names)))
+        for lni in range(len(self.loss_names)):
+            summed[:, lni] = numpy.bincount(inv, losses[:, lni], len(uniq))
+        eids, aggids = divmod(uniq, K1)
+        self.partials = [(U32(eids), U32(aggids), summed)]
+        self.nbytes = summed.nbytes + 8 * len(uniq)
+
     def aggregate(self, out, minimum_loss, aggby):
         """
         Populate the event loss table
         """
         eids = out.eids
         assets = out.assets
+        E = len(eids)
+        for lt in out.loss_types:
+            if minimum_loss[lt]:
+                ls = out[lt]
+                ls[ls < minimum_loss[lt]] = 0
 
-        # initialize secondary losses outputs, if any
+        # secondary outputs, if any
         for sec_loss in self.sec_losses:
             for k in sec_loss.outputs:
-                setattr(out, k, numpy.zeros((len(assets), len(eids))))
+                setattr(out, k, numpy.zeros((len(assets), E)))
+        if self.sec_losses:
+            for a, asset in enumerate(assets):
+                lt_losses = [(lt, out[lt][a]) for lt in out.loss_types]
+                for sec_loss in self.sec_losses:
+                    for k, o in sec_loss.compute(
+                            asset, lt_losses, eids).items():
+                        out[k][a] = o
+
+        # aggregation of the total losses, stored also when zero
+        K = len(self.aggkey) - 1
+        L = len(self.loss_names)
+        losses = numpy.zeros((E, L))
+        for lni, ln in enumerate(self.loss_names):
+            losses[:, lni] = out[ln].sum(axis=0)
+        self.add(eids, numpy.full(E, K), losses)
+        if not aggby:
+            return
 
-        # populate outputs
+        # aggregation by tag, on the flattened (aggidx, event) indices
         if aggby == ['id']:
             idxs = [self.aggkey[o1, ] for o1 in assets['ordinal'] + 1]
         elif aggby == ['site_id']:
             idxs = [self.aggkey[s1, ] for s1 in assets['site_id'] + 1]
-        elif aggby:
-            idxs = [self.aggkey[tuple(rec)] for rec in assets[aggby]]
         else:
-            idxs = []
-        for a, asset in enumerate(out.assets):
-            lt_losses = []
-            for lti, lt in enumerate(out.loss_types):
-                ls = out[lt][a]
-                if minimum_loss[lt]:
-                    ls[ls < minimum_loss[lt]] = 0
-                lt_losses.append((lt, ls))
-
-            # secondary outputs, if any
-            for sec_loss in self.sec_losses:
-                for k, o in sec_loss.compute(asset, lt_losses, eids).items():
-                    out[k][a] = o
-
-        # aggregation
-        K = len(self.aggkey) - 1
+            idxs = [self.aggkey[tuple(rec)] for rec in assets[aggby]]
+        uniq, inv = numpy.unique(idxs, return_inverse=True)
+        UE = len(uniq) * E
+        flat = (inv[:, None] * E + numpy.arange(E)).flatten()
+        losses = numpy.zeros((UE, L))
+        nonzero = numpy.zeros(UE, bool)
         for lni, ln in enumerate(self.loss_names):
-            for eid, loss in zip(eids, out[ln].T):
-                self[eid, K][lni] += loss.sum()
-            # this is the slow part, if aggregate_by is given
-            for asset, idx, losses in zip(assets, idxs, out[ln]):
-                for eid, loss in zip(eids, losses):
-                    if loss:
-                        self[eid, idx][lni] += loss
+            ls = out[ln].flatten()
+            losses[:, lni] = numpy.bincount(flat, ls, UE)
+            nonzero |= numpy.bincount(flat, ls != 0, UE) > 0
+        u, e = divmod(nonzero.nonzero()[0], E)
+        self.add(eids[e], uniq[u], losses[nonzero])
 
     def to_dframe(self):
         """
         Convert the AggLosTable into a DataFrame
         """
-        out = AccumDict(accum=[])  # col -> values
-        for (eid, idx), arr in self.items():
-            out['event_id'].append(eid)
-            out['agg_id'].append(idx)
-            for l, ln in enumerate(self.loss_names):
-                out[ln].append(arr[l])
-        out['event_id'] = U32(out['event_id'])
-        out['agg_id'] = U32(out['agg_id'])
-        for ln in self.loss_names:
-            out[ln] = F32(out[ln])
+        self.compact()
+        out = {}  # col -> values
+        if self.partials:
+            [(eids, aggids, losses)] = self.partials
+        else:
+            eids = aggids = numpy.zeros(0, U32)
+            losses = numpy.zeros((0, len(self.loss_names)))
+        out['event_id'] = eids
+        out['agg_id'] = aggids
+        for lni, ln in enumerate(self.loss_names):
+            out[ln] = F32(losses[:, lni])
         return pandas.DataFrame(out)
 
 
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2021 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import unittest.mock
+import numpy
+import pandas
+from openquake.baselib import hdf5
+from openquake.baselib.general import gettemp
+from openquake.baselib.performance import Monitor
+from openquake.risklib import scientific, riskmodels, riskinput
+
+
+class FakeCompositeRiskModel(object):
+    primary_imtls = {'PGA': [.01, .1, 1.]}
+    loss_types = ['structural']
+
+    def __init__(self, vfs):
+        self.rmodels = {}
+        for taxo, vf in enumerate(vfs, 1):
+            vf.seed = 42
+            vf.init()
+            rm = riskmodels.RiskModel(
+                'ebrisk', taxo, {('structural', 'vulnerability'): vf})
+            rm.imt_by_lt = {'structural': 'PGA'}
+            self.rmodels[taxo] = rm
+
+    def get_rmodels_weights(self, taxo):
+        return [self.rmodels[taxo]], [1]
+
+
+class GetOutputsTestCase(unittest.TestCase):
+    def test_same_as_get_output(self):
+        imls = [.05, .1, .2, .4]
+        crmodel = FakeCompositeRiskModel([
+            scientific.VulnerabilityFunction(
+                'LN', 'PGA', imls, [.01, .06, .18, .36], [.3, .3, .3, .3]),
+            scientific.VulnerabilityFunction(
+                'BT', 'PGA', imls, [.01, .06, .18, .36], [.3, .3, .3, .3],
+                'BT')])
+        rng = numpy.random.RandomState(42)
+        A, E, N = 12, 20, 5
+        assets = numpy.zeros(A, [('ordinal', numpy.uint32),
+                                 ('site_id', numpy.uint32),
+                                 ('taxonomy', numpy.uint32),
+                                 ('value-structural', numpy.float32)])
+        assets['ordinal'] = numpy.arange(A)
+        assets['site_id'] = numpy.sort(rng.randint(0, N, A))
+        assets['taxonomy'] = rng.randint(1, 3, A)
+        assets['value-structural'] = rng.uniform(100, 200, A)
+        sids, eids = numpy.nonzero(rng.uniform(size=(N, E)) < .6)
+        haz = pandas.DataFrame(dict(
+            sid=sids, eid=eids, rlz=numpy.zeros(len(sids), int),
+            gmv_0=rng.lognormal(-2, 1, len(sids)).astype(numpy.float32)))
+        haz = haz.sample(frac=1, random_state=42)  # shuffle the rows
+        tempname = gettemp(suffix='.hdf5')
+        with hdf5.File(tempname, 'w') as h5:
+            h5['epsilon_matrix'] = rng.normal(size=(A, E))
+        outs = list(riskinput.get_outputs(crmodel, assets, haz, tempname))
+        self.assertEqual(len(outs), len(numpy.unique(assets['site_id'])))
+        for out in outs:
+            ok = assets['site_id'] == out.assets['site_id'][0]
+            abt = riskinput.get_assets_by_taxo(assets[ok], tempname)
+            expected = riskinput.get_output(
+                crmodel, abt, haz[haz.sid == out.assets['site_id'][0]])
+            numpy.testing.assert_equal(out.eids, expected.eids)
+            numpy.testing.assert_equal(out.structural, expected.structural)
+
+
+class GenOutputsTestCase(unittest.TestCase):
+    def test_same_as_by_rlz(self):
+        imls = [.05, .1, .2, .4]
+        lrs = numpy.array([.01, .06, .18, .36])
+        crmodel = FakeCompositeRiskModel([
+            scientific.VulnerabilityFunction(
+                'LN', 'PGA', imls, lrs, [.3, .3, .3, .3]),
+            scientific.VulnerabilityFunction(
+                'BT', 'PGA', imls, lrs, [.3, .3, .3, .3], 'BT'),
+            scientific.VulnerabilityFunctionWithPMF(
+                'PM', 'PGA', imls, numpy.array([0, .2, .4]), numpy.array(
+                    [[.7, .5, .2, .1], [.2, .4, .5, .3], [.1, .1, .3, .6]]))])
+        rng = numpy.random.RandomState(42)
+        A, E, N = 9, 30, 2
+        assets = numpy.zeros(A, [('ordinal', numpy.uint32),
+                                 ('site_id', numpy.uint32),
+                                 ('taxonomy', numpy.uint32),
+                                 ('value-structural', numpy.float32)])
+        assets['ordinal'] = numpy.arange(A)
+        assets['site_id'] = numpy.sort(rng.randint(0, N, A))
+        assets['taxonomy'] = rng.randint(1, 4, A)
+        assets['value-structural'] = rng.uniform(100, 200, A)
+        sids, eids = numpy.nonzero(rng.uniform(size=(N, E)) < .8)
+        haz = pandas.DataFrame(dict(
+            sid=sids, eid=eids, rlz=eids % 3,  # 3 realizations
+            gmv_0=rng.lognormal(-2, 1, len(sids)).astype(numpy.float32)))
+        tempname = gettemp(suffix='.hdf5')
+        with hdf5.File(tempname, 'w') as h5:
+            h5['epsilon_matrix'] = rng.normal(size=(A, E))
+        ri = riskinput.RiskInput(None, assets)
+        outs = list(ri.gen_outputs(crmodel, Monitor(), tempname, haz))
+        abt = riskinput.get_assets_by_taxo(assets, tempname)
+        expected = [riskinput.get_output(crmodel, abt, df, rlz)
+                    for (sid, rlz), df in haz.groupby(['sid', 'rlz'])]
+        self.assertEqual(len(outs), len(expected))
+        for out, exp in zip(outs, expected):
+            self.assertEqual(out.rlzi, exp.rlzi)
+            numpy.testing.assert_equal(out.eids, exp.eids)
+            numpy.testing.assert_equal(out.haz.gmv_0.to_numpy(),
+                                       exp.haz.gmv_0.to_numpy())
+            numpy.testing.assert_equal(out.structural, exp.structural)
+
+
+class CounterBasedTestCase(unittest.TestCase):
+    def test_subsets(self):
+        imls = [.05, .1, .2, .4]
+        lrs = numpy.array([.01, .06, .18, .36])
+        crmodel = FakeCompositeRiskModel([
+            scientific.VulnerabilityFunction(
+                'LN', 'PGA', imls, lrs, [.3, .3, .3, .3]),
+            scientific.VulnerabilityFunction(
+                'BT', 'PGA', imls, lrs, [.3, .3, .3, .3], 'BT'),
+            scientific.VulnerabilityFunctionWithPMF(
+                'PM', 'PGA', imls, numpy.array([0, .2, .4]), numpy.array(
+                    [[.8, .5, .2, 0], [.2, .4, .5, .3], [0, .1, .3, .7]]))])
+        crmodel.oqparam = unittest.mock.Mock(asset_correlation=0)
+        rng = numpy.random.RandomState(42)
+        A, E, N = 30, 40, 6
+        assets = numpy.zeros(A, [('ordinal', numpy.uint32),
+                                 ('site_id', numpy.uint32),
+                                 ('taxonomy', numpy.uint32),
+                                 ('value-structural', numpy.float32)])
+        assets['ordinal'] = numpy.arange(A)
+        assets['site_id'] = numpy.sort(rng.randint(0, N, A))
+        assets['taxonomy'] = rng.randint(1, 4, A)
+        assets['value-structural'] = rng.uniform(100, 200, A)
+        sids, eids = numpy.nonzero(numpy.ones((N, E)))
+        haz = pandas.DataFrame(dict(
+            sid=sids, eid=eids, rlz=numpy.zeros(len(sids), int),
+            gmv_0=rng.lognormal(-2, 1, len(sids)).astype(numpy.float32)))
+        outs = list(riskinput.get_outputs(
+            crmodel, assets, haz, counter_based=True))
+        losses = numpy.zeros((A, E))
+        for out in outs:
+            losses[out.assets['ordinal']] = out.structural
+
+        # computing a subset of the events and of the assets is the same
+        ok = haz.eid.isin(range(0, E, 3)).to_numpy()
+        some = assets[::2]
+        for out in riskinput.get_outputs(
+                crmodel, some, haz[ok], counter_based=True):
+            expected = losses[out.assets['ordinal']][:, ::3]
+            numpy.testing.assert_equal(out.structural, expected)
+
+        # the sampled PM losses are multiple of the loss ratios
+        values = assets['value-structural'][:, None]
+        for out in outs:
+            pm = out.assets['taxonomy'] == 3
+            ratios = out.structural[pm] / values[out.assets['ordinal'][pm]]
+            numpy.testing.assert_allclose(
+                ratios, numpy.round(ratios * 5) / 5, atol=1E-6)
+
+
+class ReadEpsTestCase(unittest.TestCase):
+    def test(self):
+        self.assertIsNone(riskinput.read_eps(None))
+        eps = numpy.random.RandomState(42).normal(size=(5, 7))
+        contiguous = gettemp(suffix='.hdf5')
+        with hdf5.File(contiguous, 'w') as h5:
+            h5['epsilon_matrix'] = eps
+        mm = riskinput.read_eps(contiguous)
+        self.assertIsInstance(mm, numpy.memmap)
+        numpy.testing.assert_equal(mm[[3, 1]], eps[[3, 1]])
+        numpy.testing.assert_equal(mm[[0, 4], [6, 2]], eps[[0, 4], [6, 2]])
+
+        chunked = gettemp(suffix='.hdf5')
+        with hdf5.File(chunked, 'w') as h5:
+            h5.create_dataset('epsilon_matrix', data=eps, chunks=(1, 7))
+        numpy.testing.assert_equal(riskinput.read_eps(chunked), eps)
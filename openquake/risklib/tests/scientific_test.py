@@ -20,6 +20,7 @@ import unittest
 import pickle
 
 import numpy
+from openquake.baselib.hdf5 import ArrayWrapper
 from openquake.risklib import scientific
 
 aaae = numpy.testing.assert_array_almost_equal
@@ -607,6 +608,115 @@ class InsuredLossesTestCase(unittest.TestCase):
         numpy.testing.assert_allclose((m1 * l1 + m2 * l2) / (l1 + l2), m)
 
 
+class AggLossTableTestCase(unittest.TestCase):
+    def make_out(self, eids, A, rng):
+        assets = numpy.zeros(A, [('ordinal', numpy.uint32),
+                                 ('taxonomy', numpy.uint32)])
+        assets['ordinal'] = numpy.arange(A)
+        assets['taxonomy'] = rng.randint(1, 4, A)
+        losses = rng.uniform(0, 1, (A, len(eids)))
+        losses[losses < .3] = 0
+        return ArrayWrapper((), dict(eids=eids, assets=assets,
+                                     loss_types=['structural'],
+                                     structural=losses))
+
+    def naive_dframe(self, outs, aggkey):
+        # the aggregation with a dictionary (eid, agg_id) -> loss
+        K = len(aggkey)
+        acc = {}
+        for out in outs:
+            for eid, losses in zip(out.eids, out.structural.T):
+                acc[eid, K] = acc.get((eid, K), 0) + losses.sum()
+            for asset, losses in zip(out.assets, out.structural):
+                idx = aggkey.index((asset['taxonomy'],))
+                for eid, loss in zip(out.eids, losses):
+                    if loss:
+                        acc[eid, idx] = acc.get((eid, idx), 0) + loss
+        return numpy.array([k + (v,) for k, v in sorted(acc.items())])
+
+    def test_aggregate(self):
+        rng = numpy.random.RandomState(42)
+        aggkey = [(1,), (2,), (3,)]
+        outs = [self.make_out(numpy.arange(10, 20), 6, rng),
+                self.make_out(numpy.arange(15, 30), 4, rng)]
+        expected = self.naive_dframe(outs, aggkey)
+        for maxsize in (1E9, 100):  # the second forces the compaction
+            alt = scientific.AggLossTable.new(
+                aggkey, ['structural'], maxsize=maxsize)
+            for out in outs:
+                alt.aggregate(out, dict(structural=0), ['taxonomy'])
+            df = alt.to_dframe()
+            numpy.testing.assert_equal(df.event_id, expected[:, 0])
+            numpy.testing.assert_equal(df.agg_id, expected[:, 1])
+            aaae(df.structural, expected[:, 2], decimal=5)
+
+
+def old_losses_by_period(losses, return_periods, num_events, eff_time):
+    # the implementation used up to engine 3.11, for a single group;
+    # it is kept here as an independent reference
+    P = len(return_periods)
+    losses = numpy.sort(losses)
+    num_losses = len(losses)
+    if num_events > num_losses:
+        losses = numpy.concatenate(
+            [numpy.zeros(num_events - num_losses, losses.dtype), losses])
+    periods = eff_time / numpy.arange(num_events, 0., -1)
+    num_left = sum(1 for rp in return_periods if rp < periods[0])
+    num_right = sum(1 for rp in return_periods if rp > periods[-1])
+    rperiods = [rp for rp in return_periods if periods[0] <= rp <= periods[-1]]
+    curve = numpy.zeros(P, losses.dtype)
+    curve[num_left:P-num_right] = numpy.interp(
+        numpy.log(rperiods), numpy.log(periods), losses)
+    curve[P-num_right:] = numpy.nan
+    return curve
+
+
+class LossesByPeriodsTestCase(unittest.TestCase):
+    def test_ragged(self):
+        # the batched curves must be identical to the curves computed
+        # with the old implementation, also when num_events > num_losses
+        rng = numpy.random.RandomState(42)
+        counts = rng.randint(1, 30, 20)
+        num_events = counts + rng.randint(0, 20, 20)
+        offsets = numpy.concatenate([[0], numpy.cumsum(counts)])
+        losses = rng.lognormal(0, 2, offsets[-1]).astype(numpy.float32)
+        rperiods = [1, 2, 5, 10, 20, 50, 100, 200]
+        curves = scientific.losses_by_periods(
+            losses, offsets, rperiods, num_events, 100)
+        self.assertEqual(curves.shape, (20, 8))
+        for g, (o1, o2) in enumerate(zip(offsets[:-1], offsets[1:])):
+            expected = old_losses_by_period(
+                losses[o1:o2], rperiods, num_events[g], 100)
+            numpy.testing.assert_equal(curves[g], expected)
+            numpy.testing.assert_equal(
+                scientific.losses_by_period(
+                    losses[o1:o2], rperiods, num_events[g], 100), expected)
+
+    def test_multidim(self):
+        # losses of shape (L, E) give curves of shape (L, P)
+        rng = numpy.random.RandomState(42)
+        losses = rng.lognormal(0, 2, (3, 25))
+        rperiods = [1, 2, 5, 10, 20, 50]
+        curves = scientific.losses_by_period(losses, rperiods, 40, 50)
+        for li in range(3):
+            numpy.testing.assert_equal(
+                curves[li],
+                old_losses_by_period(losses[li], rperiods, 40, 50))
+
+    def test_expected(self):
+        # hard-coded values, with zeros on the left and NaNs on the right
+        losses = [3, 2, 3.5, 4, 3, 23, 11, 2, 1, 4, 5, 7, 8, 9, 13]
+        curve = scientific.losses_by_period(
+            losses, [1, 2, 5, 10, 20, 50, 100], 20, 50)
+        numpy.testing.assert_allclose(
+            curve, [0, 0, 3.5, 8, 11.89932057, 23, numpy.nan])
+
+    def test_not_enough_events(self):
+        with self.assertRaises(ValueError):
+            scientific.losses_by_periods(
+                [1, 2, 3], [0, 1, 3], [1, 10], [1, 1], 10)
+
+
 class InsuredLossCurveTestCase(unittest.TestCase):
     def test_curve(self):
         curve = numpy.array(